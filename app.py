@@ -1,10 +1,17 @@
 # KRISHSAATHI - Main application
 # Enterprise-grade agricultural intelligence platform
 
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, request, jsonify, send_from_directory, render_template, redirect, url_for, session
+import click
+from flask import Flask, Response, request, jsonify, send_from_directory, render_template, redirect, url_for, session, stream_with_context, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
 
 from config import (
     SUPPORTED_LANGUAGES,
@@ -18,14 +25,22 @@ from config import (
 )
 from translations import get_translation, get_chatbot_template, translate_crop
 from language_middleware import get_request_language
-from services.weather import fetch_weather
-from services.mandi import fetch_mandi
+from services.weather import fetch_weather, get_weather_cache_stats
+from services.mandi import get_mandi_prices, ingest_mandi_prices
+from services.mandi_trends import get_mandi_trends
 from services.schemes import get_schemes
 from services.soil import get_soil_advisory
 from services.satellite import get_satellite_info
-from services.advisory import get_advisory
-from services.pest_health_ai import get_pest_health_reply
-from models import db, Farmer, FarmerCrop, ChatSession, ChatMessage
+from services.advisory_cache import get_cached_advisory, get_advisory_cache_stats, build_advisory_cache
+from services.pest_health_ai import get_pest_health_reply, stream_pest_health_reply, get_llm_gateway_stats
+from services.http_client import get_pool_stats
+from services.answer_cache import get_answer_cache_stats
+from services.diagnosis_jobs import enqueue_diagnosis, job_to_dict, start_diagnosis_workers, DIAGNOSIS_WORKERS
+from services.image_prep import prepare_image_base64, prepare_upload, check_upload_length, get_image_prep_stats, ImageRejected
+from services.image_cache import get_image_cache_stats
+from services.sms_outbox import get_outbox_stats
+from services.gazetteer import geocode_farmer, farmer_coordinates, location_key
+from models import db, ensure_schema, Farmer, FarmerCrop, ChatSession, ChatMessage, DiagnosisJob
 
 app = Flask(
     __name__,
@@ -49,8 +64,10 @@ if not _writable(app.instance_path):
     app.instance_path = '/tmp/krishsaathi_instance'
     os.makedirs(app.instance_path, exist_ok=True)
 
-# If using SQLite, put DB in writable instance path so serverless can open it
-if app.config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite'):
+# If using SQLite with a relative path, put DB in writable instance path so serverless can open it
+# (an absolute path, sqlite:////..., is used as given)
+_db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+if _db_uri.startswith('sqlite') and not _db_uri.startswith('sqlite:////'):
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(app.instance_path, 'krishsaathi.db')
 
 db.init_app(app)
@@ -59,11 +76,32 @@ SESSION_FARMER_ID = 'farmer_id'
 
 
 def get_current_farmer():
-    """Return Farmer for session or None."""
-    fid = session.get(SESSION_FARMER_ID)
-    if not fid:
-        return None
-    return Farmer.query.get(fid)
+    """
+    Return Farmer for session or None. Loaded once per request (crops joined in the same query) and
+    kept in flask.g for the context processor, routes and services.
+    """
+    if 'current_farmer' not in g:
+        fid = session.get(SESSION_FARMER_ID)
+        g.current_farmer = db.session.get(Farmer, fid, options=[joinedload(Farmer.crops)]) if fid else None
+    return g.current_farmer
+
+
+# Per-request SQL statement counter (app contexts of worker threads count separately)
+with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def _count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_app_context():
+            g.query_count = g.get('query_count', 0) + 1
+
+
+@app.after_request
+def report_query_count(response):
+    count = g.get('query_count', 0)
+    if app.config['QUERY_COUNT_HEADER']:
+        response.headers['X-Query-Count'] = str(count)
+    if app.config['QUERY_COUNT_WARN'] and count > app.config['QUERY_COUNT_WARN']:
+        app.logger.warning("%s %s issued %s SQL statements", request.method, request.path, count)
+    return response
 
 
 def get_farmer_display_name(farmer):
@@ -116,6 +154,7 @@ def login():
             db.session.commit()
         session[SESSION_FARMER_ID] = farmer.id
         session.permanent = True
+        g.current_farmer = farmer
         # If profile incomplete, go to profile; else dashboard
         if not farmer.district and not farmer.state:
             return redirect(url_for('profile'))
@@ -126,6 +165,7 @@ def login():
 @app.route('/logout')
 def logout():
     session.pop(SESSION_FARMER_ID, None)
+    g.pop('current_farmer', None)
     return redirect(url_for('index'))
 
 
@@ -141,6 +181,7 @@ def profile():
         farmer.state = (request.form.get('state') or '').strip()[:10]
         farmer.district = (request.form.get('district') or '').strip()[:80]
         farmer.village = (request.form.get('village') or '').strip()[:80]
+        geocode_farmer(farmer)
         # Crops: replace with submitted list
         FarmerCrop.query.filter_by(farmer_id=farmer.id).delete()
         crop_type = request.form.getlist('crop_type')
@@ -211,178 +252,504 @@ def update_language():
     return jsonify({'success': True, 'language': lang})
 
 
+@app.errorhandler(ImageRejected)
+def image_rejected(e):
+    """Uploads refused before a job is queued (e.g. an oversized multipart body in _chat_payload)."""
+    return jsonify({'error': str(e)}), e.status_code
+
+
 # API: Pest Health chatbot (uses farmer language and name when logged in)
-@app.route('/api/chatbot/message', methods=['POST'])
-def chatbot_message():
-    data = request.get_json() or {}
-    farmer = get_current_farmer()
+def _chat_payload():
+    """
+    Chatbot request fields from multipart/form-data (image sent as the 'image' file part, which Werkzeug
+    spools to a temp file instead of memory) or from the older JSON body with base64 image_base64.
+    Multipart bodies over the image limit are refused from Content-Length before they are read
+    (ImageRejected); chunked uploads without one are still bounded by MAX_CONTENT_LENGTH.
+    """
+    if request.mimetype == 'multipart/form-data':
+        check_upload_length(request.content_length)
+        return request.form
+    return request.get_json() or {}
+
+
+def _open_chat(data, farmer):
+    """
+    Language, message, image and ChatSession for a chatbot request. Nothing is written here: a new
+    session and the user's message are saved together with the reply by _save_turn.
+    The image is an uploaded FileStorage, a base64 string (JSON clients) or None.
+    """
     user_lang = (farmer.language_code if farmer else None) or request.headers.get('Accept-Language', 'hi')[:2]
     if user_lang not in LANGUAGE_CODES:
         user_lang = DEFAULT_LANGUAGE
     message = (data.get('message') or '').strip()
-    image_base64 = data.get('image_base64') or None
+    image_base64 = request.files.get('image') or data.get('image_base64') or None
     conversation_id = data.get('conversation_id')
     farmer_id = farmer.id if farmer else None
     
-    # History: Get or Create Session
-    session_id = None
+    # History: existing session, or a new one (inserted with the turn)
+    chat_session = None
     if conversation_id:
-        chat_session = ChatSession.query.get(conversation_id)
-        if chat_session and (chat_session.farmer_id == farmer_id or (not farmer_id and chat_session.guest_id)):
-            session_id = chat_session.id
-    
-    if not session_id:
+        chat_session = db.session.get(ChatSession, conversation_id)
+        if chat_session and not (chat_session.farmer_id == farmer_id or (not farmer_id and chat_session.guest_id)):
+            chat_session = None
+    if chat_session is None:
         chat_session = ChatSession(farmer_id=farmer_id)
-        db.session.add(chat_session)
-        db.session.commit()
-        session_id = chat_session.id
+    return user_lang, message, image_base64, chat_session
 
-    # Save User Message
+
+def _add_turn(chat_session, message, reply, user_lang):
+    """Add a chat turn (new session, user message, bot reply) to the DB session without committing."""
+    db.session.add(chat_session)
+    # Setting the backref does not load the session's existing messages
     if message:
-        user_msg = ChatMessage(session_id=session_id, is_user=True, text=message, language_code=user_lang)
-        db.session.add(user_msg)
-        db.session.commit()
+        db.session.add(ChatMessage(session=chat_session, is_user=True, text=message, language_code=user_lang))
+    if reply:
+        db.session.add(ChatMessage(session=chat_session, is_user=False, text=reply, language_code=user_lang))
+
+
+def _save_turn(chat_session, message, reply, user_lang):
+    """Write a chat turn, plus any profile changes made while answering, in one commit; returns the session id."""
+    _add_turn(chat_session, message, reply, user_lang)
+    db.session.flush()
+    session_id = chat_session.id  # read before commit expires it (saves a re-SELECT)
+    db.session.commit()
+    return session_id
+
+
+def _save_failed_turn(chat_session, message, user_lang, reply=None):
+    """
+    The reply failed or the client went away: drop the turn's pending changes but keep the user's
+    message (and any partial reply) so the conversation can be picked up again.
+    """
+    db.session.rollback()
+    try:
+        _save_turn(chat_session, message, reply, user_lang)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning("Could not save chat turn after failed reply: %s", e)
+
+
+@app.route('/api/chatbot/message', methods=['POST'])
+def chatbot_message():
+    data = _chat_payload()
+    farmer = get_current_farmer()
+    user_lang, message, image_base64, chat_session = _open_chat(data, farmer)
+    if image_base64:
+        return _queue_diagnosis(image_base64, message, user_lang, farmer, chat_session)
 
     farmer_name = get_farmer_display_name(farmer)
-    reply = get_pest_health_reply(
-        message, 
-        user_lang, 
-        image_base64, 
-        conversation_id=session_id, 
-        farmer_name=farmer_name,
-        farmer_id=farmer_id
-    )
+    try:
+        reply = get_pest_health_reply(
+            message, 
+            user_lang, 
+            image_base64, 
+            conversation_id=chat_session.id, 
+            farmer_name=farmer_name,
+            farmer=farmer
+        )
+    except Exception:
+        _save_failed_turn(chat_session, message, user_lang)
+        raise
     
-    # Save Bot Message
-    if reply:
-        bot_msg = ChatMessage(session_id=session_id, is_user=False, text=reply, language_code=user_lang)
-        db.session.add(bot_msg)
-        db.session.commit()
+    # Session, user message and bot message: one transaction
+    session_id = _save_turn(chat_session, message, reply, user_lang)
         
     return jsonify({'reply': reply, 'language': user_lang, 'conversation_id': session_id})
 
 
+def _queue_diagnosis(image, message, user_lang, farmer, chat_session=None):
+    """
+    Image analysis runs as a background job; the client polls /api/chatbot/jobs/<job_id>.
+    The chat turn (if any) is committed together with the job row.
+    """
+    # Decode once and shrink before storing: the job row and the vision call get the small JPEG
+    try:
+        if isinstance(image, str):
+            image_base64, prepared = prepare_image_base64(image)
+        else:
+            image_base64, prepared = prepare_upload(image.stream)
+    except ImageRejected as e:
+        if chat_session is not None:
+            _save_turn(chat_session, message, None, user_lang)
+        return jsonify({'error': str(e)}), e.status_code
+    session_id = None
+    if chat_session is not None:
+        _add_turn(chat_session, message, None, user_lang)
+        db.session.flush()  # assigns the session id inside the job's transaction
+        session_id = chat_session.id
+    job = enqueue_diagnosis(image_base64, message, user_lang, farmer.id if farmer else None, session_id)
+    out = job_to_dict(job)
+    out['poll_url'] = url_for('chatbot_job', job_id=job.id)
+    out['image'] = {
+        'bytes_in': prepared.bytes_in,
+        'bytes_out': prepared.bytes_out,
+        'width': prepared.width,
+        'height': prepared.height,
+        'ms': prepared.ms,
+    }
+    return jsonify(out), 202
+
+
+@app.route('/api/chatbot/jobs/<job_id>')
+def chatbot_job(job_id):
+    job = db.session.get(DiagnosisJob, job_id)
+    farmer = get_current_farmer()
+    if not job or (job.farmer_id and (not farmer or farmer.id != job.farmer_id)):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_to_dict(job))
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# Streaming variant of /api/chatbot/message as Server-Sent Events:
+# meta {conversation_id, language}, token {text}..., fallback {text} (replaces streamed text), done {reply, ...}
+@app.route('/api/chatbot/stream', methods=['POST'])
+def chatbot_stream():
+    data = _chat_payload()
+    farmer = get_current_farmer()
+    user_lang, message, image_base64, chat_session = _open_chat(data, farmer)
+    if image_base64:
+        return _queue_diagnosis(image_base64, message, user_lang, farmer, chat_session)
+    farmer_name = get_farmer_display_name(farmer)
+    started = time.perf_counter()
+
+    def generate():
+        parts = []
+        ttft_ms = None
+        saved = False
+        try:
+            # conversation_id is null here for a new conversation; done carries it once the turn is saved
+            yield _sse('meta', {'conversation_id': chat_session.id, 'language': user_lang})
+            for event, text in stream_pest_health_reply(
+                message, user_lang, image_base64, farmer_name=farmer_name, farmer=farmer
+            ):
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+                    app.logger.info("chatbot stream session=%s ttft_ms=%s", chat_session.id, ttft_ms)
+                if event == 'fallback':
+                    parts = [text]
+                else:
+                    parts.append(text)
+                yield _sse(event, {'text': text})
+            session_id = _save_turn(chat_session, message, ''.join(parts).strip(), user_lang)
+            saved = True
+            yield _sse('done', {
+                'reply': ''.join(parts),
+                'conversation_id': session_id,
+                'ttft_ms': ttft_ms,
+                'total_ms': round((time.perf_counter() - started) * 1000, 1),
+            })
+        finally:
+            # Client disconnected or the reply failed mid-stream: keep the message and what was produced
+            if not saved:
+                _save_failed_turn(chat_session, message, user_lang, ''.join(parts).strip())
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 @app.route('/api/chatbot/analyze-image', methods=['POST'])
 def chatbot_analyze_image():
-    data = request.get_json() or {}
+    data = _chat_payload()
     farmer = get_current_farmer()
     user_lang = (farmer.language_code if farmer else None) or request.headers.get('Accept-Language', 'hi')[:2]
     if user_lang not in LANGUAGE_CODES:
         user_lang = DEFAULT_LANGUAGE
-    image_base64 = data.get('image_base64') or data.get('image')
-    reply = get_pest_health_reply('', user_lang, image_base64, data.get('conversation_id'), farmer_name=get_farmer_display_name(farmer))
-    return jsonify({'reply': reply, 'language': user_lang})
+    image = request.files.get('image') or data.get('image_base64') or data.get('image')
+    if not image:
+        return jsonify({'error': 'An image file (multipart "image") or image_base64 is required'}), 400
+    return _queue_diagnosis(image, '', user_lang, farmer)
+
+
+VOICE_HISTORY_PAGE = 50
+VOICE_HISTORY_MAX_PAGE = 200
+
+
+def _history_page(session_id, limit, before=None):
+    """
+    Up to limit messages of a session, oldest first, ending just before message id `before` (keyset
+    pagination). Only limit + 1 rows are read, newest first, via ix_chat_message_session_id.
+    Returns (messages, has_more).
+    """
+    query = ChatMessage.query.filter(ChatMessage.session_id == session_id)
+    if before:
+        query = query.filter(ChatMessage.id < before)
+    rows = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+    return rows[:limit][::-1], len(rows) > limit
+
+
 @app.route('/api/voice/history')
 def api_voice_history():
+    """
+    Recent messages of a conversation (conversation_id, else the farmer's latest one).
+    Scroll back with ?before=<next_before from the previous page>; page size ?limit= (max 200).
+    """
     farmer = get_current_farmer()
-    # For now, only return history for logged-in users? 
-    # Or based on conversation_id passed in query param?
-    # Let's support both.
-    limit = 50
-    history = []
+    limit = min(max(request.args.get('limit', VOICE_HISTORY_PAGE, type=int), 1), VOICE_HISTORY_MAX_PAGE)
+    before = request.args.get('before', type=int)
+    chat_session = None
     
     cid = request.args.get('conversation_id')
     if cid:
-        chat_session = ChatSession.query.get(cid)
-        if chat_session:
-            # Check ownership
-            if farmer and chat_session.farmer_id == farmer.id:
-                 history = chat_session.messages[-limit:]
-            elif not farmer and not chat_session.farmer_id:
-                 # Guest session access by ID
-                 history = chat_session.messages[-limit:]
+        chat_session = db.session.get(ChatSession, cid)
+        # Check ownership (guest sessions are accessible by id)
+        if chat_session and not ((farmer and chat_session.farmer_id == farmer.id)
+                                 or (not farmer and not chat_session.farmer_id)):
+            chat_session = None
     elif farmer:
         # Get most recent session
         chat_session = ChatSession.query.filter_by(farmer_id=farmer.id).order_by(ChatSession.started_at.desc()).first()
-        if chat_session:
-             history = chat_session.messages[-limit:]
-             
+
+    history, has_more = _history_page(chat_session.id, limit, before) if chat_session else ([], False)
     out = []
     for msg in history:
         out.append({
+            'id': msg.id,
             'text': msg.text,
             'is_user': msg.is_user,
             'timestamp': msg.timestamp.isoformat()
         })
     
-    return jsonify({'history': out})
+    return jsonify({
+        'history': out,
+        'conversation_id': chat_session.id if chat_session else None,
+        'has_more': has_more,
+        'next_before': out[0]['id'] if has_more else None,
+    })
 
 # ---------- Real-time data APIs (use farmer district/state when logged in) ----------
 
-@app.route('/api/weather')
-def api_weather():
-    lang = get_request_language(get_current_farmer())
+def _resolve_lang(farmer):
+    lang = get_request_language(farmer)
     if lang not in LANGUAGE_CODES:
         lang = DEFAULT_LANGUAGE
+    return lang
+
+
+def _request_coords(farmer):
+    """lat/lon from the query string, else the farmer's geocoded profile location."""
     lat = request.args.get('lat', type=float)
     lon = request.args.get('lon', type=float)
-    data = fetch_weather(lat=lat, lon=lon)
+    if lat is None or lon is None:
+        lat, lon = farmer_coordinates(farmer)
+    return lat, lon
+
+
+def _weather_payload(lang, data):
     if data.get('current'):
         cond = data['current'].get('condition', '')
         data['current']['condition_label'] = get_translation(lang, 'common', f'weather.conditions.{cond}')
-    return jsonify(data)
+    return data
 
 
-@app.route('/api/mandi')
-def api_mandi():
-    lang = get_request_language(get_current_farmer())
-    if lang not in LANGUAGE_CODES:
-        lang = DEFAULT_LANGUAGE
-    limit = request.args.get('limit', default=15, type=int)
-    limit = min(max(limit, 1), 50)
-    out = fetch_mandi(limit=limit)
+def _mandi_payload(lang, out):
     prices = out.get('prices', [])
     for p in prices:
         p['commodity_local'] = translate_crop(p.get('commodity', ''), lang)
     out['prices'] = prices
+    return out
+
+
+def _soil_payload(lang, farmer):
+    state = request.args.get('state') or (farmer.state if farmer else '')
+    district = request.args.get('district') or (farmer.district if farmer else '')
+    return get_soil_advisory(state=state, district=district, lang=lang)
+
+
+def _satellite_payload(lang, farmer, lat, lon):
+    state = request.args.get('state') or (farmer.state if farmer else '')
+    info = get_satellite_info(lat=lat, lon=lon, state=state)
+    key = 'description_hi' if lang == 'hi' else 'description_en'
+    info['description'] = info.get(key, info['description_en'])
+    return info
+
+
+@app.route('/api/weather')
+def api_weather():
+    farmer = get_current_farmer()
+    lang = _resolve_lang(farmer)
+    lat, lon = _request_coords(farmer)
+    return jsonify(_weather_payload(lang, fetch_weather(lat=lat, lon=lon)))
+
+
+@app.route('/api/weather/cache-stats')
+def api_weather_cache_stats():
+    return jsonify(get_weather_cache_stats())
+
+
+@app.route('/api/chatbot/cache-stats')
+def api_chatbot_cache_stats():
+    return jsonify(get_answer_cache_stats())
+
+
+@app.route('/api/chatbot/llm-stats')
+def api_chatbot_llm_stats():
+    return jsonify(get_llm_gateway_stats())
+
+
+@app.route('/api/chatbot/image-stats')
+def api_chatbot_image_stats():
+    return jsonify({**get_image_prep_stats(), 'dedupe': get_image_cache_stats()})
+
+
+@app.route('/api/alerts/outbox-stats')
+def api_alerts_outbox_stats():
+    return jsonify(get_outbox_stats())
+
+
+@app.route('/api/http/pool-stats')
+def api_http_pool_stats():
+    return jsonify(get_pool_stats())
+
+
+@app.route('/api/mandi')
+def api_mandi():
+    """Mandi prices from the local store: ?commodity=&state=&market=&district=&date=YYYY-MM-DD&sort=-modal_price&cursor="""
+    lang = _resolve_lang(get_current_farmer())
+    limit = request.args.get('limit', default=15, type=int)
+    limit = min(max(limit, 1), 50)
+    arrival_date = request.args.get('date')
+    try:
+        if arrival_date:
+            arrival_date = datetime.strptime(arrival_date, '%Y-%m-%d').date()
+        out = get_mandi_prices(
+            limit=limit,
+            commodity=request.args.get('commodity'),
+            state=request.args.get('state'),
+            market=request.args.get('market'),
+            district=request.args.get('district'),
+            arrival_date=arrival_date,
+            sort=request.args.get('sort', '-arrival_date'),
+            cursor=request.args.get('cursor'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_mandi_payload(lang, out))
+
+
+@app.route('/api/mandi/trends')
+def api_mandi_trends():
+    """Moving averages, volatility, spreads and cross-market gaps: ?commodity=&state=&market=&sort=-volatility"""
+    lang = _resolve_lang(get_current_farmer())
+    limit = request.args.get('limit', default=50, type=int)
+    limit = min(max(limit, 1), 500)
+    try:
+        out = get_mandi_trends(
+            commodity=request.args.get('commodity'),
+            state=request.args.get('state'),
+            market=request.args.get('market'),
+            sort=request.args.get('sort', '-volatility'),
+            limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    for item in out['series'] + out['commodity_gaps']:
+        item['commodity_local'] = translate_crop(item['commodity'], lang)
     return jsonify(out)
 
 
 @app.route('/api/schemes')
 def api_schemes():
-    lang = get_request_language(get_current_farmer())
-    if lang not in LANGUAGE_CODES:
-        lang = DEFAULT_LANGUAGE
+    lang = _resolve_lang(get_current_farmer())
     schemes = get_schemes(lang=lang if lang != 'en' else 'en')
     return jsonify({'schemes': schemes})
 
 
 @app.route('/api/soil')
 def api_soil():
-    lang = get_request_language(get_current_farmer())
-    if lang not in LANGUAGE_CODES:
-        lang = DEFAULT_LANGUAGE
     farmer = get_current_farmer()
-    state = request.args.get('state') or (farmer.state if farmer else '')
-    district = request.args.get('district') or (farmer.district if farmer else '')
-    return jsonify(get_soil_advisory(state=state, district=district, lang=lang))
+    lang = _resolve_lang(farmer)
+    return jsonify(_soil_payload(lang, farmer))
 
 
 @app.route('/api/satellite')
 def api_satellite():
-    lang = get_request_language(get_current_farmer())
-    if lang not in LANGUAGE_CODES:
-        lang = DEFAULT_LANGUAGE
-    lat = request.args.get('lat', type=float)
-    lon = request.args.get('lon', type=float)
     farmer = get_current_farmer()
-    state = request.args.get('state') or (farmer.state if farmer else '')
-    info = get_satellite_info(lat=lat, lon=lon, state=state)
-    key = 'description_hi' if lang == 'hi' else 'description_en'
-    info['description'] = info.get(key, info['description_en'])
-    return jsonify(info)
+    lang = _resolve_lang(farmer)
+    lat, lon = _request_coords(farmer)
+    return jsonify(_satellite_payload(lang, farmer, lat, lon))
 
 
 @app.route('/api/advisory')
 def api_advisory():
-    lang = get_request_language(get_current_farmer())
-    if lang not in LANGUAGE_CODES:
-        lang = DEFAULT_LANGUAGE
-    lat = request.args.get('lat', type=float)
-    lon = request.args.get('lon', type=float)
     farmer = get_current_farmer()
+    lang = _resolve_lang(farmer)
+    lat, lon = _request_coords(farmer)
+    state = request.args.get('state') or (farmer.state if farmer else '')
+    return jsonify(get_cached_advisory(lang=lang, lat=lat, lon=lon, state=state, farmer=farmer))
+
+
+@app.route('/api/advisory/cache-stats')
+def api_advisory_cache_stats():
+    return jsonify(get_advisory_cache_stats())
+
+
+# Shared pool for /api/dashboard upstream calls (bounded so a slow upstream can't exhaust threads)
+_dashboard_pool = ThreadPoolExecutor(max_workers=app.config['DASHBOARD_MAX_WORKERS'], thread_name_prefix='dashboard')
+
+
+def _with_app_context(fn, *args, **kwargs):
+    with app.app_context():
+        return fn(*args, **kwargs)
+
+
+@app.route('/api/dashboard')
+def api_dashboard():
+    """
+    All dashboard cards in one response. Farmer and language are resolved once; weather and mandi
+    are fetched concurrently. The advisory is served from the cohort cache (services/advisory_cache.py),
+    reusing the fetched weather on a miss. Sections that fail or miss the deadline come back as null
+    with a message in `errors`.
+    """
+    farmer = get_current_farmer()
+    lang = _resolve_lang(farmer)
+    lat, lon = _request_coords(farmer)
+    limit = request.args.get('mandi_limit', default=15, type=int)
+    limit = min(max(limit, 1), 50)
+
+    futures = {
+        'weather': _dashboard_pool.submit(fetch_weather, lat=lat, lon=lon),
+        'mandi': _dashboard_pool.submit(_with_app_context, get_mandi_prices, limit=limit),
+    }
+    out = {'language': lang, 'errors': {}}
+    # Local sections are cheap; build them while the upstream calls are in flight
+    for name, build in (
+        ('schemes', lambda: {'schemes': get_schemes(lang=lang)}),
+        ('soil', lambda: _soil_payload(lang, farmer)),
+        ('satellite', lambda: _satellite_payload(lang, farmer, lat, lon)),
+    ):
+        try:
+            out[name] = build()
+        except Exception as e:
+            out[name] = None
+            out['errors'][name] = str(e)
+
+    done, _ = wait(futures.values(), timeout=app.config['DASHBOARD_TIMEOUT'])
+    results = {}
+    for name, fut in futures.items():
+        if fut not in done:
+            out['errors'][name] = 'timeout'
+            continue
+        try:
+            results[name] = fut.result()
+        except Exception as e:
+            out['errors'][name] = str(e)
+    out['weather'] = _weather_payload(lang, results['weather']) if 'weather' in results else None
+    out['mandi'] = _mandi_payload(lang, results['mandi']) if 'mandi' in results else None
+
     state = request.args.get('state') or (farmer.state if farmer else '')
-    return jsonify(get_advisory(lang=lang, lat=lat, lon=lon, state=state, farmer=farmer))
+    weather = results.get('weather') or {'current': None, 'daily': None}
+    try:
+        out['advisory'] = get_cached_advisory(lang=lang, lat=lat, lon=lon, state=state, farmer=farmer, weather=weather)
+    except Exception as e:
+        out['advisory'] = None
+        out['errors']['advisory'] = str(e)
+    return jsonify(out)
 
 
 # Serve locale JSON files for frontend i18n
@@ -399,17 +766,88 @@ def serve_locale(lang, module):
 # ---------- Init DB and background jobs ----------
 
 with app.app_context():
-    db.create_all()
-
-# Optional: start background scheduler for weather alerts (see services/alert_scheduler.py)
-try:
+    ensure_schema()
+
+
+@app.cli.command('geocode-farmers')
+@click.option('--all', 'all_farmers', is_flag=True, help='Re-resolve every farmer, not only missing/stale rows.')
+@click.option('--chunk-size', default=1000, show_default=True)
+def geocode_farmers_command(all_farmers, chunk_size):
+    """Backfill cached coordinates on Farmer rows from the offline gazetteer."""
+    last_id, scanned, updated, unresolved = 0, 0, 0, 0
+    while True:
+        farmers = Farmer.query.filter(Farmer.id > last_id).order_by(Farmer.id).limit(chunk_size).all()
+        if not farmers:
+            break
+        for farmer in farmers:
+            scanned += 1
+            if (all_farmers or farmer.geo_key != location_key(farmer)) and geocode_farmer(farmer, force=all_farmers):
+                updated += 1
+                if farmer.lat is None:
+                    unresolved += 1
+        db.session.commit()
+        last_id = farmers[-1].id
+        db.session.expunge_all()
+    click.echo(f'Scanned {scanned} farmers, updated {updated}, unresolved {unresolved}.')
+
+
+@app.cli.command('ingest-mandi')
+@click.option('--page-size', default=1000, show_default=True)
+@click.option('--max-pages', default=None, type=int)
+def ingest_mandi_command(page_size, max_pages):
+    """Incrementally load daily mandi prices from data.gov.in into the local store."""
+    stats = ingest_mandi_prices(page_size=page_size, max_pages=max_pages)
+    click.echo(', '.join(f'{k}={v}' for k, v in stats.items()))
+
+@app.cli.command('build-advisories')
+def build_advisories_command():
+    """Precompute the advisory of every farmer cohort (also run by the scheduler after each weather refresh)."""
+    stats = build_advisory_cache()
+    click.echo(', '.join(f'{k}={v}' for k, v in stats.items()))
+
+@app.cli.command('scheduler')
+def scheduler_command():
+    """Run the scheduled jobs (weather alerts, advisory cache, mandi ingest, SMS dispatch) in the foreground, leader-elected via the DB."""
     from services.alert_scheduler import start_alert_scheduler
-    start_alert_scheduler(app)
-except Exception:
-    pass
+    start_alert_scheduler(app, blocking=True)
+
+@app.cli.command('diagnosis-workers')
+@click.option('--workers', default=DIAGNOSIS_WORKERS or 2, show_default=True)
+def diagnosis_workers_command(workers):
+    """Run image diagnosis workers in the foreground (web processes can then use DIAGNOSIS_WORKERS=0)."""
+    pool = start_diagnosis_workers(app, workers=workers)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop(timeout=5)
+
+
+def start_background_services():
+    """Start the in-process background jobs of a web server process.
+
+    Called by the web entrypoints only (`python app.py`, gunicorn's post_worker_init in gunicorn.conf.py),
+    never at import, so CLI commands and benchmarks neither run diagnosis jobs nor compete for the
+    scheduler lease and send SMS.
+    """
+    # Image diagnosis workers (services/diagnosis_jobs.py); queued jobs persist in the DB across restarts
+    start_diagnosis_workers(app)
+    # Background scheduler for weather alerts and mandi ingest (see services/alert_scheduler.py). With
+    # SCHEDULER_IN_WEB=1 every worker may start it and a DB lease makes exactly one of them run the jobs;
+    # by default it is left to `flask scheduler`.
+    try:
+        from services.alert_scheduler import start_alert_scheduler, SCHEDULER_IN_WEB
+        if SCHEDULER_IN_WEB:
+            start_alert_scheduler(app)
+    except Exception:
+        pass
 
 
 if __name__ == '__main__':
     os.makedirs(app.static_folder, exist_ok=True)
     os.makedirs(app.template_folder, exist_ok=True)
-    app.run(host='0.0.0.0', port=5000, debug=app.config.get('DEBUG', True))
+    debug = app.config.get('DEBUG', True)
+    # The debug reloader imports this module twice; only the serving child starts background jobs
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    app.run(host='0.0.0.0', port=5000, debug=debug)
@@ -0,0 +1,107 @@
+# Benchmark: per-cohort advisory cache build and lookup vs computing get_advisory per request
+# Usage: python -m benchmarks.bench_advisory_cache [farmers] [cells] [requests] [upstream_ms]
+# Seeds a throwaway SQLite DB with farmers spread over weather cells, states, crops, stages and languages,
+# fills the weather cache with synthetic forecasts (no network), builds the cache and then serves advisories
+# for random farmers both ways, reporting cohort count, build time, per-request latency and hit rate.
+# get_advisory is timed with a warm weather cache and as a fresh worker would run it (empty in-process
+# weather cache, forecasts "fetched" with upstream_ms of simulated latency per cell).
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy.orm import joinedload
+
+from config import CROP_STAGES, CROP_TYPES, INDIAN_STATES, LANGUAGE_CODES
+from models import db, Farmer, FarmerCrop, ensure_schema
+from services import weather
+from services.advisory import get_advisory
+from services.advisory_cache import build_advisory_cache, get_cached_advisory, get_advisory_cache_stats
+from services.gazetteer import location_key
+
+
+def _forecast(rnd, days=3):
+    return {
+        "current": {"temperature": rnd.uniform(15, 42), "humidity": rnd.uniform(20, 95), "condition": "sunny"},
+        "daily": {
+            "time": [f"d{i}" for i in range(days)],
+            "temperature_2m_max": [rnd.uniform(20, 46) for _ in range(days)],
+            "temperature_2m_min": [rnd.uniform(0, 25) for _ in range(days)],
+            "precipitation_sum": [rnd.choice((0, 0, 2, 15, 60)) for _ in range(days)],
+            "wind_speed_10m_max": [rnd.uniform(0, 50) for _ in range(days)],
+            "relative_humidity_2m_max": [rnd.uniform(30, 100) for _ in range(days)],
+            "weather_code": [rnd.choice((0, 1, 3, 61, 95)) for _ in range(days)],
+        },
+    }
+
+
+def _seed(n_farmers, n_cells, rnd):
+    cells = [(round(20 + i // 50 * 0.1, 4), round(75 + i % 50 * 0.1, 4)) for i in range(n_cells)]
+    for cell in cells + [weather.geo_cell(weather.DEFAULT_LAT, weather.DEFAULT_LON)]:
+        weather._weather_cache.put(cell, _forecast(rnd))
+    states = [name for _, name in INDIAN_STATES[:5]]
+    langs = LANGUAGE_CODES[:3]
+    for i in range(n_farmers):
+        lat, lon = rnd.choice(cells)
+        farmer = Farmer(name=f"f{i}", mobile=f"9{i:09d}", language_code=rnd.choice(langs), state=rnd.choice(states),
+                        district="", village="", lat=lat, lon=lon)
+        farmer.geo_key = location_key(farmer)
+        for _ in range(rnd.randint(0, 2)):
+            farmer.crops.append(FarmerCrop(crop_type=rnd.choice(CROP_TYPES[:6]), stage=rnd.choice(CROP_STAGES)))
+        db.session.add(farmer)
+        if i % 5000 == 4999:
+            db.session.commit()
+    db.session.commit()
+
+
+def _serve(farmers, fn):
+    t0 = time.perf_counter()
+    for farmer in farmers:
+        fn(lang=farmer.language_code, lat=farmer.lat, lon=farmer.lon, state=farmer.state, farmer=farmer)
+    return (time.perf_counter() - t0) / len(farmers) * 1000
+
+
+def main():
+    n_farmers = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_cells = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    n_requests = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    upstream_ms = float(sys.argv[4]) if len(sys.argv) > 4 else 50
+    rnd = random.Random(7)
+    path = os.path.join(tempfile.mkdtemp(), "advisory.db")
+    bench = Flask(__name__)
+    bench.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + path
+    db.init_app(bench)
+
+    with bench.app_context():
+        ensure_schema()
+        _seed(n_farmers, n_cells, rnd)
+        stats = build_advisory_cache()
+        print(f"build: farmers={stats['farmers']} cohorts={stats['cohorts']} cells={stats['cells']} "
+              f"rows={stats['rows_written']} in {stats['wall_time_s'] * 1000:.0f} ms")
+
+        ids = rnd.sample(range(1, n_farmers + 1), min(n_requests, n_farmers))
+        farmers = Farmer.query.options(joinedload(Farmer.crops)).filter(Farmer.id.in_(ids)).all()
+        for farmer in farmers[:50]:
+            a = get_advisory(farmer.language_code, farmer.lat, farmer.lon, farmer.state, farmer)
+            b = get_cached_advisory(farmer.language_code, farmer.lat, farmer.lon, farmer.state, farmer)
+            assert a == b, (farmer.id, a, b)
+        warm = _serve(farmers, get_advisory)
+        cached = _serve(farmers, get_cached_advisory)
+        s = get_advisory_cache_stats()
+        print(f"per request ({len(farmers)} farmers): cached lookup={cached:.3f} ms; hit ratio={s['hit_ratio']:.2%} "
+              f"(misses={s['misses']}, stale={s['stale']})")
+        print(f"  get_advisory, warm weather cache:  {warm:8.3f} ms -> {warm / cached:5.1f}x")
+
+        forecasts = dict(weather._weather_cache._entries)
+        weather._weather_cache.clear()
+        weather._weather_cache.loader = lambda lat, lon: time.sleep(upstream_ms / 1000) or forecasts[(lat, lon)][1]
+        cold = _serve(farmers, get_advisory)
+        print(f"  get_advisory, fresh worker ({upstream_ms:.0f} ms upstream): {cold:8.3f} ms -> {cold / cached:5.1f}x")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Benchmark: chat history for a session with 100k messages, whole-relationship load vs keyset page
+# Usage: python -m benchmarks.bench_chat_history [messages] [page]
+# Runs against a throwaway SQLite file: the old `chat_session.messages[-limit:]`, the new
+# _history_page (latest page and a page deep in the conversation), and, with and without the indexes,
+# the latest page of a short conversation buried under the big one.
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from app import _history_page
+from models import db, ChatSession, ChatMessage, ensure_schema
+
+
+def _timed(fn, runs=5):
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+        db.session.expire_all()
+    return result, best * 1000
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    page = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    path = os.path.join(tempfile.mkdtemp(), "history.db")
+    bench = Flask(__name__)
+    bench.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + path
+    db.init_app(bench)
+
+    with bench.app_context():
+        ensure_schema()
+        # Other sessions' messages interleaved, as in a shared production table
+        sessions = [ChatSession(farmer_id=None) for _ in range(21)]
+        db.session.add_all(sessions)
+        db.session.flush()
+        target, short = sessions[0].id, sessions[20].id
+        start = datetime.utcnow() - timedelta(days=365)
+        rows = [
+            {"session_id": short, "is_user": i % 2 == 0, "text": f"old message {i}", "language_code": "hi",
+             "timestamp": start - timedelta(minutes=30 - i)}
+            for i in range(30)
+        ] + [
+            {"session_id": target if i % 4 == 0 else sessions[1 + i % 19].id, "is_user": i % 2 == 0,
+             "text": f"message {i} " + "x" * 80, "language_code": "hi", "timestamp": start + timedelta(seconds=i)}
+            for i in range(n * 4)
+        ]
+        t0 = time.perf_counter()
+        db.session.execute(db.insert(ChatMessage), rows)
+        db.session.commit()
+        print(f"inserted {len(rows):,} messages ({n:,} in the session) in {time.perf_counter() - t0:.1f} s")
+
+        def old():
+            return db.session.get(ChatSession, target).messages[-page:]
+
+        latest, has_more = _history_page(target, page)
+        middle_id = latest[0].id - (n // 2) * 4
+
+        for label, fn in (
+            ("relationship[-limit:]", old),
+            ("keyset latest page", lambda: _history_page(target, page)[0]),
+            ("keyset page mid-history", lambda: _history_page(target, page, before=middle_id)[0]),
+            ("keyset short session", lambda: _history_page(short, page)[0]),
+        ):
+            result, ms = _timed(fn, runs=3 if fn is old else 20)
+            print(f"{label:26s} rows={len(result):4d} {ms:8.2f} ms")
+
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT * FROM chat_message WHERE session_id = :s AND id < :b ORDER BY id DESC LIMIT :l"
+        ), {"s": target, "b": middle_id, "l": page + 1}).all()
+        print("plan:", "; ".join(row[-1] for row in plan))
+
+        db.session.execute(db.text("DROP INDEX ix_chat_message_session_id"))
+        db.session.execute(db.text("DROP INDEX ix_chat_message_session_time"))
+        db.session.commit()
+        for label, fn in (
+            ("mid-history, no indexes", lambda: _history_page(target, page, before=middle_id)[0]),
+            ("short session, no indexes", lambda: _history_page(short, page)[0]),
+        ):
+            result, ms = _timed(fn)
+            print(f"{label:26s} rows={len(result):4d} {ms:8.2f} ms")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
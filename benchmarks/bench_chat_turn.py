@@ -0,0 +1,97 @@
+# Benchmark: SQL statements and commits per chatbot turn (POST /api/chatbot/message)
+# Usage: python -m benchmarks.bench_chat_turn [turns]
+# Counts every statement and COMMIT the app sends to the database for guest and logged-in turns,
+# new and continued conversations, and asserts a turn is written in a single transaction.
+# Runs the app against a throwaway SQLite file (set before the app is imported), removed at the end.
+
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+_db_path = os.path.join(tempfile.mkdtemp(), "chat_turn.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + _db_path
+os.environ["SCHEDULER_IN_WEB"] = "0"
+os.environ["DIAGNOSIS_WORKERS"] = "0"
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, SESSION_FARMER_ID  # noqa: E402
+from models import db, Farmer  # noqa: E402
+
+# (statements, commits) allowed per turn
+EXPECTED = {
+    "guest, new conversation": (3, 1),  # INSERT session, INSERT user + bot message
+    "guest, continued": (3, 1),  # SELECT session, INSERT messages
+    "farmer, new conversation": (4, 1),  # SELECT farmer, INSERT session, INSERT messages
+    "farmer, continued": (4, 1),  # SELECT farmer, SELECT session, INSERT messages
+    "farmer, profile update": (5, 1),  # + UPDATE farmer
+}
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.counts = Counter()
+        event.listen(engine, "before_cursor_execute", self._statement)
+        event.listen(engine, "commit", self._commit)
+
+    def _statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.counts[statement.split(None, 1)[0].upper()] += 1
+
+    def _commit(self, conn):
+        self.counts["COMMIT"] += 1
+
+    def take(self):
+        counts, self.counts = self.counts, Counter()
+        return counts
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    client = app.test_client()
+    with app.app_context():
+        farmer = Farmer(name="Bench Kisan", mobile="0000000000", language_code="en", state="Punjab")
+        db.session.add(farmer)
+        db.session.commit()
+        farmer_id = farmer.id
+        counter = StatementCounter(db.engine)
+
+    def ask(message, conversation_id=None):
+        r = client.post("/api/chatbot/message", json={"message": message, "conversation_id": conversation_id})
+        assert r.status_code == 200, r.get_data(as_text=True)
+        return r.get_json()["conversation_id"]
+
+    ok = True
+    try:
+        for label, (max_statements, max_commits) in EXPECTED.items():
+            if label.startswith("farmer"):
+                with client.session_transaction() as s:
+                    s[SESSION_FARMER_ID] = farmer_id
+            else:
+                with client.session_transaction() as s:
+                    s.pop(SESSION_FARMER_ID, None)
+            conversation_id = ask("hello") if label.endswith("continued") else None
+            counter.take()
+            t0 = time.perf_counter()
+            for i in range(turns):
+                message = f"district Bench{chr(97 + i % 26)}{i}" if label.endswith("profile update") else "wheat sowing time"
+                ask(message, conversation_id)
+            elapsed = (time.perf_counter() - t0) / turns
+            counts = counter.take()
+            statements = sum(n for k, n in counts.items() if k != "COMMIT") / turns
+            commits = counts["COMMIT"] / turns
+            passed = statements <= max_statements and commits <= max_commits
+            ok &= passed
+            print(f"{label:26s} statements/turn={statements:4.1f} (max {max_statements}) "
+                  f"commits/turn={commits:3.1f} (max {max_commits}) {elapsed * 1000:6.1f} ms "
+                  f"{'ok' if passed else 'FAIL'}  {dict(counts)}")
+    finally:
+        with app.app_context():
+            db.engine.dispose()
+        os.remove(_db_path)
+    assert ok, "a chat turn used more statements or commits than expected"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Benchmark: crop-stage advice for many farmers - rules index vs table scan vs the old if/elif
+# Usage: python -m benchmarks.bench_crop_advice [farmers] [cells]
+# Farmers get 1-3 crops (some with free-text names, blank stages or seasons) and the weather conditions of
+# one of `cells` forecast cells. The old function advised on the first crop's stage only; the rules index
+# covers every crop, stage, season and condition. The index result is checked against a plain scan of the
+# rules table on a sample.
+
+import random
+import sys
+import time
+from collections import namedtuple
+
+from config import CROP_STAGES, CROP_TYPES, SEASONS
+from services.agri_knowledge import WEATHER_ADVISORY
+from services.crop_advice import (
+    ANY, CONDITIONS, CROP_STAGE_RULES, CropAdviceIndex, advisory_crops, _weather_rules,
+)
+
+Crop = namedtuple("Crop", "crop_type stage season")
+
+
+def legacy_crop_advice(crops):
+    """The crop-stage branch of get_advisory before the rules table (first crop only)."""
+    for c in list(crops)[:2]:
+        stage = (c.stage or "").strip() or "general"
+        crop_name = c.crop_type or "crop"
+        if stage == "sowing":
+            return [f"{crop_name}: Ensure seed treatment and timely sowing; check soil moisture."]
+        elif stage == "vegetative":
+            return [f"{crop_name}: Monitor for pests; avoid excess nitrogen; weeding and irrigation as needed."]
+        elif stage == "flowering":
+            return [f"{crop_name}: Avoid water stress; watch for pests during flowering."]
+        elif stage == "harvesting":
+            return [f"{crop_name}: Plan harvest; avoid rain if possible; store grain dry."]
+        else:
+            return [f"{crop_name}: Regular monitoring for disease and pest; follow recommended spray schedule."]
+    return []
+
+
+def scan_advice(rules, known_crops, per_crop, crops, conditions):
+    """Reference: match every rule of the table against every crop and condition, no index."""
+    out = []
+    for crop, stage, season in crops:
+        key = crop.strip().lower()
+        key = key if key in known_crops else ANY
+        keys = []
+        for condition in tuple(conditions) + (ANY,):
+            matches = [
+                ((r.condition == ANY, r.stage == ANY, r.crop == ANY, r.season == ANY, order), r.advice)
+                for order, r in enumerate(rules)
+                if r.condition == condition and r.crop in (ANY, key) and r.stage in (ANY, stage) and r.season in (ANY, season)
+            ]
+            keys.extend(dict.fromkeys(k for _, advice in sorted(matches) for k in advice))
+        out.append((crop, tuple(dict.fromkeys(keys))[:per_crop]))
+    return out
+
+
+def synthetic_farmers(n, n_cells, rnd):
+    names = list(CROP_TYPES) + ["Tomato", "banana", "vegetables"]
+    stages = list(CROP_STAGES) + ["", "tillering"]
+    seasons = list(SEASONS) + [None, ""]
+    cells = [tuple(c for c in CONDITIONS if rnd.random() < 0.25) for _ in range(n_cells)]
+    return [
+        ([Crop(rnd.choice(names), rnd.choice(stages), rnd.choice(seasons)) for _ in range(rnd.randint(1, 3))],
+         rnd.choice(cells))
+        for _ in range(n)
+    ]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_cells = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    farmers = synthetic_farmers(n, n_cells, random.Random(5))
+
+    t0 = time.perf_counter()
+    index = CropAdviceIndex()
+    build_ms = (time.perf_counter() - t0) * 1000
+    print(f"index: {len(index.index)} keys built in {build_ms:.1f} ms; farmers={n} cells={n_cells}")
+
+    t0 = time.perf_counter()
+    legacy = [legacy_crop_advice(crops) for crops, _ in farmers]
+    legacy_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    resolved = [(advisory_crops(crops), conditions) for crops, conditions in farmers]
+    resolve_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    single = [index.advise(crops, conditions) for crops, conditions in resolved]
+    single_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch = index.advise_batch(resolved)
+    batch_s = time.perf_counter() - t0
+    assert batch == single
+
+    rules = tuple(CROP_STAGE_RULES) + tuple(_weather_rules(WEATHER_ADVISORY)[0])
+    sample = resolved[:2000]
+    t0 = time.perf_counter()
+    scanned = [scan_advice(rules, index.crops, index.per_crop, crops, conditions) for crops, conditions in sample]
+    scan_s = (time.perf_counter() - t0) * len(resolved) / len(sample)
+    assert scanned == single[:len(sample)], "index and table scan disagree"
+
+    lines_old = sum(len(x) for x in legacy)
+    lines_new = sum(len(index.render(x)) for x in batch)
+    print(f"old if/elif (first crop only)     {legacy_s * 1000:8.1f} ms  {lines_old:,} crop lines")
+    print(f"rules table scan (extrapolated)   {scan_s * 1000:8.1f} ms")
+    print(f"index, per farmer                 {single_s * 1000:8.1f} ms  {lines_new:,} crop lines (+{resolve_s * 1000:.1f} ms resolving crops)")
+    print(f"index, advise_batch               {batch_s * 1000:8.1f} ms  -> {scan_s / batch_s:.0f}x vs scan; matches the scan on {len(sample)} farmers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Benchmark: image normalization (decode, orient, strip EXIF, downscale, recompress) before vision calls
+# Usage: python -m benchmarks.bench_image_prep [--runs 5]
+# The sample set is generated: textured "leaf" photos at common phone resolutions (JPEG with EXIF
+# orientation + GPS-sized metadata), a PNG screenshot with alpha and a WhatsApp-style small JPEG.
+
+import argparse
+import base64
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from services.image_prep import normalize_image, prepare_image_base64
+
+
+def _photo(width, height, seed, grain=18):
+    """Smooth colour field plus fine noise: compresses roughly like a real crop photo."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        90 + 60 * np.sin(x / 97 + seed),
+        140 + 50 * np.cos(y / 83),
+        60 + 40 * np.sin((x + y) / 151),
+    ], axis=-1)
+    noise = rng.normal(0, grain, size=(height, width, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+def sample_images():
+    samples = []
+    for name, (w, h), quality in (
+        ("12MP phone", (4000, 3000), 92),
+        ("8MP phone", (3264, 2448), 90),
+        ("1080p", (1920, 1080), 85),
+        ("whatsapp", (1280, 960), 70),
+    ):
+        img = _photo(w, h, len(samples))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotate 90
+        exif[0x010F] = "PhoneMaker"
+        exif[0x9286] = "x" * 4096  # user comment, stands in for maker notes / GPS blocks
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality, exif=exif)
+        samples.append((name, buf.getvalue()))
+    shot = _photo(1080, 2340, 9, grain=2).convert("RGBA")
+    buf = io.BytesIO()
+    shot.save(buf, format="PNG")
+    samples.append(("PNG screenshot", buf.getvalue()))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    total_in = total_out = 0
+    for name, raw in sample_images():
+        times = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            prepared = normalize_image(raw)
+            times.append((time.perf_counter() - t0) * 1000)
+        total_in += len(raw)
+        total_out += prepared.bytes_out
+        out = Image.open(io.BytesIO(prepared.data))
+        print(
+            f"{name:15s} in={len(raw) / 1024:8.0f} KiB -> out={prepared.bytes_out / 1024:5.0f} KiB "
+            f"{out.width}x{out.height} q={prepared.quality} exif={len(out.getexif())} "
+            f"median={sorted(times)[len(times) // 2]:6.1f} ms"
+        )
+    print(f"total: {total_in / 1024 / 1024:.1f} MiB -> {total_out / 1024 / 1024:.2f} MiB "
+          f"({1 - total_out / total_in:.1%} smaller)")
+
+    # End-to-end on the base64 JSON payload (what the endpoint receives)
+    raw = sample_images()[0][1]
+    payload = "data:image/jpeg;base64," + base64.b64encode(raw).decode()
+    t0 = time.perf_counter()
+    encoded, _ = prepare_image_base64(payload)
+    print(f"base64 12MP: {len(payload) / 1024:.0f} KiB -> {len(encoded) / 1024:.0f} KiB "
+          f"in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
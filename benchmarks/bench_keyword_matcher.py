@@ -0,0 +1,69 @@
+# Benchmark: Aho-Corasick keyword index vs the nested substring loops it replaced
+# Usage: python -m benchmarks.bench_keyword_matcher [keyword_multiplier]
+
+import random
+import sys
+import time
+
+from services.chatbot_engine import INTENT_KEYWORDS
+from services.agri_knowledge import CROP_DATABASE, PEST_DATABASE, DISEASE_DATABASE, GOVERNMENT_SCHEMES
+from services.keyword_matcher import build_keyword_index
+
+
+def scale_keywords(multiplier, seed=3):
+    """Intent table with multiplier x keywords: originals plus synthetic variants (as if more languages were added)."""
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyzकखगघचछजझटठडढतथदधनपफबभमयरलवशसह"
+    out = {}
+    for intent, keywords in INTENT_KEYWORDS.items():
+        extra = ["".join(rng.choice(alphabet) for _ in range(rng.randint(4, 10))) for _ in range(len(keywords) * (multiplier - 1))]
+        out[intent] = list(keywords) + extra
+    return out
+
+
+def loop_scan(message, intents):
+    """The previous implementation: detect_intent plus the four find_* loops."""
+    msg_lower = message.lower()
+    intent = "general"
+    for name, keywords in intents.items():
+        if any(k in msg_lower for k in keywords):
+            intent = name
+            break
+    found = []
+    for table in (CROP_DATABASE, PEST_DATABASE, DISEASE_DATABASE):
+        for key, data in table.items():
+            if key.replace("_", " ") in msg_lower or data.get("hindi", "").lower() in msg_lower:
+                found.append(key)
+                break
+    for key, data in GOVERNMENT_SCHEMES.items():
+        if any(kw.lower().replace("_", " ") in msg_lower for kw in (key, data["name"], data["hindi"])):
+            found.append(key)
+            break
+    return intent, found
+
+
+def main():
+    multiplier = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    intents = scale_keywords(multiplier)
+    t0 = time.perf_counter()
+    index = build_keyword_index(intents, CROP_DATABASE, PEST_DATABASE, DISEASE_DATABASE, GOVERNMENT_SCHEMES)
+    build_ms = (time.perf_counter() - t0) * 1000
+    messages = [
+        "My cotton crop has whitefly and leaves are turning yellow, what should I spray?",
+        "मेरे गेहूं में पीला रतुआ रोग लग गया है क्या करूं",
+        "How do I apply for PM Kisan Samman Nidhi and Kisan Credit Card?",
+        "aaj mandi mein dhan ka bhav kya hai",
+        "Is it going to rain tomorrow in my village? Should I irrigate the field?",
+    ] * 200
+    print(f"patterns={len(index)} (x{multiplier}) build={build_ms:.1f} ms")
+
+    for name, fn in (("loops", lambda m: loop_scan(m, intents)), ("aho-corasick", index.scan)):
+        t0 = time.perf_counter()
+        for m in messages:
+            fn(m)
+        per = (time.perf_counter() - t0) / len(messages) * 1e6
+        print(f"{name:>13}: {per:8.1f} us/message")
+
+
+if __name__ == "__main__":
+    main()
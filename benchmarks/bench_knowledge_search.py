@@ -0,0 +1,47 @@
+# Benchmark: BM25 knowledge index build, save/load and query latency
+# Usage: python -m benchmarks.bench_knowledge_search
+
+import os
+import tempfile
+import time
+
+from services.knowledge_search import BM25Index, _documents
+
+QUERIES = [
+    "white insects under cotton leaves sucking sap",
+    "leaves have diamond shaped spots with grey center",
+    "how much money do I get per year as income support",
+    "rain coming tomorrow what should I do",
+    "गेहूं में रतुआ रोग का इलाज",
+    "frost protection for wheat in cold wave",
+    "loan for seeds at low interest",
+]
+
+
+def main():
+    docs = list(_documents())
+    runs = 50
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        index = BM25Index.build(docs)
+    build_ms = (time.perf_counter() - t0) / runs * 1000
+
+    path = os.path.join(tempfile.mkdtemp(), "knowledge_index.json")
+    index.save(path)
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        loaded = BM25Index.load(path)
+    load_ms = (time.perf_counter() - t0) / runs * 1000
+    assert loaded.search(QUERIES[0]) == index.search(QUERIES[0])
+
+    n = 20000
+    t0 = time.perf_counter()
+    for i in range(n):
+        index.search(QUERIES[i % len(QUERIES)], k=5)
+    query_us = (time.perf_counter() - t0) / n * 1e6
+    print(f"docs={len(index)} terms={len(index.postings)} build={build_ms:.2f} ms load={load_ms:.2f} ms "
+          f"({os.path.getsize(path) / 1024:.0f} KiB) query={query_us:.1f} us ({1e6 / query_us:,.0f} queries/s/core)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Benchmark: vectorized mandi trend analytics over synthetic price history
+# Usage: python -m benchmarks.bench_mandi_trends [n_series] [days]
+
+import math
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from services.mandi_trends import PriceHistory
+
+
+def synthetic_history(n_series, days, seed=7):
+    rng = np.random.default_rng(seed)
+    keys = [(f"Commodity{i % 300}", f"State{i % 28}", f"Market{i}") for i in range(n_series)]
+    base = rng.uniform(500, 9000, size=(n_series, 1))
+    walk = np.cumsum(rng.normal(0, 0.02, size=(n_series, days)), axis=1)
+    modal = (base * np.exp(walk)).astype(np.float32)
+    modal[rng.random((n_series, days)) < 0.3] = np.nan  # markets that did not report
+    low = modal * 0.95
+    high = modal * 1.05
+    end = date.today()
+    dates = [end - timedelta(days=days - 1 - i) for i in range(days)]
+    return PriceHistory(keys, dates, modal, low, high)
+
+
+def main():
+    n_series = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 90
+    history = synthetic_history(n_series, days)
+    history.analyze()  # warm-up
+    runs = 5
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        stats = history.analyze()
+    elapsed = (time.perf_counter() - t0) / runs
+    print(f"series={n_series} days={days} analyze={elapsed * 1000:.1f} ms "
+          f"({n_series / elapsed:,.0f} series/s), commodities={len(stats['commodity_gaps']['commodity'])}")
+
+    # Reference: the same statistics computed per series in plain Python, on a sample
+    sample = min(n_series, 2000)
+    t0 = time.perf_counter()
+    for i in range(sample):
+        _python_series_stats(history.modal[i].tolist(), history.low[i].tolist(), history.high[i].tolist())
+    loop = (time.perf_counter() - t0) / sample * n_series
+    print(f"per-series python loop (extrapolated to {n_series} series) = {loop * 1000:.1f} ms "
+          f"-> {loop / elapsed:.1f}x slower")
+
+    ref = _python_series_stats(history.modal[0].tolist(), history.low[0].tolist(), history.high[0].tolist())
+    got = (stats["ma7"][0], stats["ma30"][0], stats["volatility"][0])
+    print("check series 0: python", [round(x, 4) for x in ref[:3]], "numpy", [round(float(x), 4) for x in got])
+
+
+def _python_series_stats(modal, low, high):
+    def mean(xs):
+        xs = [x for x in xs if x == x]
+        return sum(xs) / len(xs) if xs else float("nan")
+
+    ma7 = mean(modal[-7:])
+    ma30 = mean(modal[-30:])
+    filled, last = [], float("nan")
+    for x in modal[-31:]:
+        last = x if x == x else last
+        filled.append(last)
+    rets = [math.log(b / a) for a, b in zip(filled, filled[1:]) if a == a and b == b]
+    vol = statistics.pstdev(rets) if len(rets) >= 2 else float("nan")
+    spread = mean([(h - l) / m for m, l, h in zip(modal[-30:], low[-30:], high[-30:]) if m == m])
+    return ma7, ma30, vol, spread
+
+if __name__ == "__main__":
+    main()
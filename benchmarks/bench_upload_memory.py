@@ -0,0 +1,126 @@
+# Benchmark: peak Python memory of an image chat request, base64-in-JSON vs multipart upload
+# Usage: VISION_BACKEND=fake python -m benchmarks.bench_upload_memory [--megapixels 12]
+# Both requests go through the Flask test client to /api/chatbot/message; tracemalloc reports the peak
+# traced Python allocation (request body, form fields, base64 strings) while the request is parsed, the
+# image normalized and the job queued; Pillow's decode buffers are C memory and not counted in either case.
+# Asserts the multipart peak stays well below the JSON one, and that an upload over IMAGE_MAX_UPLOAD_BYTES
+# is refused with 413 from its Content-Length, before the body is read.
+# Runs the app against a throwaway SQLite file (set before the app is imported), removed at the end.
+
+import argparse
+import base64
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+_db_path = os.path.join(tempfile.mkdtemp(), "upload_memory.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + _db_path
+os.environ["SCHEDULER_IN_WEB"] = "0"
+os.environ["DIAGNOSIS_WORKERS"] = "0"
+
+from PIL import Image  # noqa: E402
+
+from app import app  # noqa: E402
+from benchmarks.bench_image_prep import _photo  # noqa: E402
+from models import db  # noqa: E402
+from services.image_prep import IMAGE_MAX_UPLOAD_REQUEST  # noqa: E402
+
+
+def _sample_jpeg(megapixels):
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    buf = io.BytesIO()
+    _photo(width, height, 3).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _measure(send):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    response = send()
+    elapsed = (time.perf_counter() - t0) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return response, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=float, default=12)
+    args = parser.parse_args()
+
+    raw = _sample_jpeg(args.megapixels)
+    print(f"photo: {Image.open(io.BytesIO(raw)).size} {len(raw) / 1024 / 1024:.1f} MiB")
+    client = app.test_client()
+
+    # Build each request body up front so only server-side handling is traced
+    payload = json.dumps({
+        "message": "leaves turning yellow",
+        "image_base64": "data:image/jpeg;base64," + base64.b64encode(raw).decode("ascii"),
+    })
+
+    def send_json():
+        return client.post("/api/chatbot/message", data=payload, content_type="application/json")
+
+    def send_multipart():
+        return client.post("/api/chatbot/message", content_type="multipart/form-data", data={
+            "message": "leaves turning yellow",
+            "image": (io.BytesIO(raw), "photo.jpg", "image/jpeg"),
+        })
+
+    peaks = {}
+    for name, send in (("json+base64", send_json), ("multipart", send_multipart)):
+        response, peak, elapsed = _measure(send)
+        assert response.status_code == 202, response.get_data(as_text=True)
+        peaks[name] = peak
+        print(f"{name:12s} status={response.status_code} peak={peak / 1024 / 1024:6.1f} MiB "
+              f"time={elapsed:6.1f} ms")
+    assert peaks["multipart"] < peaks["json+base64"] / 3, "multipart upload should peak well below base64 JSON"
+
+    # Oversized upload: refused from Content-Length, the body is never read
+    body = _CountingBody(IMAGE_MAX_UPLOAD_REQUEST + 1)
+    response = client.post("/api/chatbot/message", input_stream=body, content_type="multipart/form-data; boundary=x")
+    assert response.status_code == 413 and not body.read_bytes, (response.status_code, body.read_bytes)
+    print(f"oversized    status={response.status_code} body bytes read={body.read_bytes}")
+
+
+class _CountingBody(io.RawIOBase):
+    """A request body of `size` zero bytes (never allocated) that counts what the server reads from it."""
+
+    def __init__(self, size):
+        self.size = size
+        self.pos = 0
+        self.read_bytes = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.pos = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.size}[whence] + offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def readinto(self, buf):
+        n = max(0, min(len(buf), self.size - self.pos))
+        buf[:n] = bytes(n)
+        self.pos += n
+        self.read_bytes += n
+        return n
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        with app.app_context():
+            db.engine.dispose()
+        os.remove(_db_path)
@@ -59,10 +59,15 @@ TRANSLATION_MODULES = ['common', 'dashboard', 'chatbot', 'advisory', 'schemes',
 # Path to locale JSON files
 LOCALES_DIR = BASE_DIR / 'locales'
 
+# Offline gazetteer (state_code, district, village, lat, lon, aliases) used to geocode farmer profiles
+GAZETTEER_CSV = BASE_DIR / 'data' / 'gazetteer.csv'
+
 # Flask
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-change-in-production')
 DEBUG = os.environ.get('FLASK_DEBUG', '1') == '1'
 PERMANENT_SESSION_LIFETIME = 86400 * 30  # 30 days (sessions persist after app closed)
+# Request bodies above this are refused with 413 before being read (base64 photos are ~4/3 of the file size)
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', str(20 * 1024 * 1024)))
 
 # SQL database (SQLite by default; use DATABASE_URL for PostgreSQL in production)
 DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///krishsaathi.db')
@@ -70,6 +75,23 @@ if DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
 SQLALCHEMY_DATABASE_URI = DATABASE_URL
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Per-request SQL statement count: sent as an X-Query-Count header when enabled (default: in debug), and
+# requests issuing more than QUERY_COUNT_WARN statements are logged as warnings (0 = off)
+QUERY_COUNT_HEADER = os.environ.get('QUERY_COUNT_HEADER', '1' if DEBUG else '0') == '1'
+QUERY_COUNT_WARN = int(os.environ.get('QUERY_COUNT_WARN', '20'))
+
+# Chatbot routing: a text question whose local-answer confidence (0-1) reaches its intent's threshold is
+# answered from the knowledge base instead of the LLM. Intents not listed (or > 1) always go to the LLM.
+# Override per intent with e.g. LLM_BYPASS_THRESHOLDS="pest=0.5,crop=0.8"
+LLM_BYPASS_THRESHOLDS = {'greeting': 0.6, 'crop': 0.75, 'pest': 0.6, 'disease': 0.6, 'scheme': 0.6}
+LLM_BYPASS_THRESHOLDS.update({
+    k.strip(): float(v)
+    for k, v in (p.split('=', 1) for p in os.environ.get('LLM_BYPASS_THRESHOLDS', '').split(',') if '=' in p)
+})
+
+# /api/dashboard: upstream-bound sections (weather, mandi) run concurrently on a bounded pool
+DASHBOARD_MAX_WORKERS = int(os.environ.get('DASHBOARD_MAX_WORKERS', '8'))
+DASHBOARD_TIMEOUT = float(os.environ.get('DASHBOARD_TIMEOUT', '8'))  # seconds; slower sections are returned as errors
 
 # Google Gemini AI API Key
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
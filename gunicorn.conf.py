@@ -0,0 +1,7 @@
+# Gunicorn settings, loaded automatically from the working directory (`gunicorn app:app`)
+
+
+def post_worker_init(worker):
+    # Background jobs start per worker after the fork, not when app.py is imported
+    from app import start_background_services
+    start_background_services()
@@ -1,4 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateIndex
 from datetime import datetime
 
 db = SQLAlchemy()
@@ -11,12 +13,17 @@ class Farmer(db.Model):
     state = db.Column(db.String(100))
     district = db.Column(db.String(100))
     village = db.Column(db.String(100))
+    # Coordinates resolved from state/district/village via services.gazetteer (geo_key = location they were resolved from)
+    lat = db.Column(db.Float, nullable=True)
+    lon = db.Column(db.Float, nullable=True)
+    geo_level = db.Column(db.String(10), nullable=True)  # village / district / state
+    geo_key = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     # Using onupdate to automatically update the timestamp
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    crops = db.relationship('FarmerCrop', backref='farmer', lazy=True, cascade="all, delete-orphan")
+    crops = db.relationship('FarmerCrop', backref='farmer', lazy=True, cascade="all, delete-orphan", order_by='FarmerCrop.id')
     chat_sessions = db.relationship('ChatSession', backref='farmer', lazy=True)
 
 class FarmerCrop(db.Model):
@@ -27,6 +34,9 @@ class FarmerCrop(db.Model):
     season = db.Column(db.String(100))
 
 class ChatSession(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_session_farmer_started', 'farmer_id', 'started_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     farmer_id = db.Column(db.Integer, db.ForeignKey('farmer.id'), nullable=True)
     guest_id = db.Column(db.String(100), nullable=True) # For non-logged in users
@@ -34,9 +44,136 @@ class ChatSession(db.Model):
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade="all, delete-orphan")
 
 class ChatMessage(db.Model):
+    """Messages are paged by id (assigned in insert order) within a session: see ix_chat_message_session_id."""
+    __table_args__ = (
+        db.Index('ix_chat_message_session_id', 'session_id', 'id'),
+        db.Index('ix_chat_message_session_time', 'session_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False)
     is_user = db.Column(db.Boolean, default=True) # True = User, False = Bot
     text = db.Column(db.Text)
     language_code = db.Column(db.String(10))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+class MandiPrice(db.Model):
+    """Daily mandi price row ingested from data.gov.in (services.mandi.ingest_mandi_prices)."""
+    __table_args__ = (
+        db.UniqueConstraint('commodity', 'state', 'market', 'variety', 'grade', 'arrival_date', name='uq_mandi_price_row'),
+        # On lower() because services.mandi.query_mandi_store filters names case-insensitively
+        db.Index('ix_mandi_price_lookup_ci', db.text('lower(commodity)'), db.text('lower(state)'), db.text('lower(market)'),
+                 'arrival_date'),
+        db.Index('ix_mandi_price_arrival', 'arrival_date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    commodity = db.Column(db.String(100), nullable=False)
+    state = db.Column(db.String(100), nullable=False)
+    district = db.Column(db.String(100))
+    market = db.Column(db.String(150), nullable=False)
+    variety = db.Column(db.String(100), nullable=False, default='')
+    grade = db.Column(db.String(50), nullable=False, default='')
+    arrival_date = db.Column(db.Date, nullable=False)
+    min_price = db.Column(db.Float)
+    max_price = db.Column(db.Float)
+    modal_price = db.Column(db.Float)
+    ingested_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DiagnosisJob(db.Model):
+    """Queued image diagnosis (services.diagnosis_jobs); the image is dropped once the job finishes."""
+    __table_args__ = (
+        db.Index('ix_diagnosis_job_status', 'status', 'created_at'),
+    )
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    status = db.Column(db.String(10), nullable=False, default='queued')  # queued / running / done / failed
+    farmer_id = db.Column(db.Integer, db.ForeignKey('farmer.id'), nullable=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=True)
+    language_code = db.Column(db.String(10))
+    message = db.Column(db.Text)
+    image = db.Column(db.Text)  # base64 of the normalized JPEG (services.image_prep), cleared when the job finishes
+    result = db.Column(db.Text)
+    error = db.Column(db.String(255))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class SmsOutbox(db.Model):
+    """Queued SMS (services.sms_outbox); idempotency_key makes re-queuing the same alert a no-op."""
+    __table_args__ = (
+        db.Index('ix_sms_outbox_due', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(150), nullable=False, unique=True)
+    farmer_id = db.Column(db.Integer, db.ForeignKey('farmer.id'), nullable=True)
+    mobile = db.Column(db.String(15), nullable=False)
+    message = db.Column(db.String(480), nullable=False)
+    kind = db.Column(db.String(30))  # e.g. weather:rain
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending / sending / sent / dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+class SchedulerLease(db.Model):
+    """Leader lock for the background scheduler (services.alert_scheduler); renewed by the owner's heartbeat."""
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)  # host:pid of the process running the jobs
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow)
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class JobRun(db.Model):
+    """One execution of a scheduled job: who ran it, when, for how long and with what outcome."""
+    __table_args__ = (
+        db.Index('ix_job_run_job_started', 'job_id', 'started_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(50), nullable=False)
+    owner = db.Column(db.String(100))
+    status = db.Column(db.String(10), nullable=False, default='running')  # running / ok / failed
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Float)
+    result = db.Column(db.Text)  # JSON stats returned by the job
+    error = db.Column(db.String(255))
+
+class AdvisoryCache(db.Model):
+    """
+    Advisory precomputed per cohort (services.advisory_cache), without the current conditions. A row is served
+    while its version has the current ADVISORY_CACHE_VERSION prefix and it is younger than ADVISORY_CACHE_MAX_AGE.
+    """
+    cohort_key = db.Column(db.String(255), primary_key=True)  # cell|state|crops|language (see cohort_key)
+    version = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON of the /api/advisory response
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def ensure_schema():
+    """
+    create_all() plus ALTER TABLE ADD COLUMN for nullable columns added to existing tables,
+    and any missing indexes (there is no migration tool in this project).
+    """
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing or not col.nullable or col.primary_key:
+                continue
+            col_type = col.type.compile(dialect=db.engine.dialect)
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}'))
+            except (OperationalError, ProgrammingError):
+                # Another worker starting at the same time may have added it first (duplicate column)
+                if col.name not in {c['name'] for c in db.inspect(db.engine).get_columns(table.name)}:
+                    raise
+        for index in table.indexes:
+            if db.engine.dialect.name in ('sqlite', 'postgresql'):
+                # IF NOT EXISTS instead of checkfirst: reflection skips expression indexes (lower(...))
+                with db.engine.begin() as conn:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            else:
+                index.create(db.engine, checkfirst=True)
@@ -2,31 +2,47 @@
 # Improvement: at least 3 actionable items, crop-stage and weather aware; 5-year trend stub
 
 from services.weather import fetch_weather
+from services.forecast_rules import evaluate_forecasts
+from services.crop_advice import advisory_crops, forecast_conditions, get_crop_advice_index
 from services.soil import get_soil_advisory
 from translations import get_translation
 
 
-def get_advisory(lang, lat=None, lon=None, state=None, farmer=None):
-    weather = fetch_weather(lat=lat, lon=lon)
-    soil = get_soil_advisory(state=state, district=(farmer.district if farmer else None), lang=lang)
+def get_advisory(lang, lat=None, lon=None, state=None, farmer=None, weather=None):
+    # Callers that already hold a forecast (e.g. /api/dashboard) pass it in to avoid a second fetch
+    if weather is None:
+        weather = fetch_weather(lat=lat, lon=lon)
+    crops = advisory_crops(getattr(farmer, "crops", None) if farmer else None)
+    return build_advisory(lang, weather, state=state, crops=crops)
+
+
+def build_advisory(lang, weather, state=None, crops=(), hits=None, crop_advice=None):
+    """
+    Advisory for one cohort: depends only on the forecast (i.e. the weather grid cell), state, the farmer's
+    (crop, stage, season) list and language, which is what services.advisory_cache precomputes it by.
+    Soil advice is per state. Batch callers pass the cell's forecast rule hits and the crop advice in.
+    """
+    soil = get_soil_advisory(state=state, lang=lang)
     items = []
     cur = weather.get("current") if weather else None
     cond = (cur.get("condition") or "sunny") if cur else "sunny"
     cond_label = get_translation(lang, "common", f"weather.conditions.{cond}")
     temp = cur.get("temperature") if cur else None
 
-    # 1. Weather-aware advice (actionable)
-    if cur:
-        if cond == "rainy":
-            items.append(get_translation(lang, "common", "weather_alert.rainy") if lang != "en" else "Rain expected. Reduce irrigation, check drainage.")
-        elif cond == "stormy":
-            items.append(get_translation(lang, "common", "weather_alert.stormy") if lang != "en" else "Storm likely. Keep crops and yourself safe.")
-        elif temp is not None and temp >= 42:
-            items.append(get_translation(lang, "common", "weather_alert.extreme_heat") if lang != "en" else "Extreme heat. Ensure water and shade.")
-        elif temp is not None and temp <= 2:
-            items.append(get_translation(lang, "common", "weather_alert.extreme_cold") if lang != "en" else "Cold conditions. Protect sensitive crops.")
-        else:
-            items.append((cond_label + (" " + f"{temp:.0f}°C." if temp is not None else ".")) + " Suitable for field work.")
+    # 1. Weather-aware advice (actionable): the strongest forecast rules hit in the next days
+    if hits is None:
+        hits = evaluate_forecasts({"here": weather}).get("here", []) if weather else []
+    if hits:
+        seen = set()
+        for rule, _ in hits:
+            if rule.id in seen:
+                continue
+            seen.add(rule.id)
+            items.append(get_translation(lang, "common", rule.i18n) if rule.i18n and lang != "en" else rule.message)
+            if len(seen) == 2:
+                break
+    elif cur:
+        items.append((cond_label + (" " + f"{temp:.0f}°C." if temp is not None else ".")) + " Suitable for field work.")
     else:
         items.append(cond_label + ". Check local forecast before spraying or irrigation.")
 
@@ -38,22 +54,12 @@ def get_advisory(lang, lat=None, lon=None, state=None, farmer=None):
     if npk_tip:
         items.append(npk_tip)
 
-    # 3. Crop-stage-aware advice when farmer has crops (at least one more actionable)
-    if farmer and getattr(farmer, "crops", None):
-        for c in list(farmer.crops)[:2]:
-            stage = (c.stage or "").strip() or "general"
-            crop_name = c.crop_type or "crop"
-            if stage == "sowing":
-                items.append(f"{crop_name}: Ensure seed treatment and timely sowing; check soil moisture.")
-            elif stage == "vegetative":
-                items.append(f"{crop_name}: Monitor for pests; avoid excess nitrogen; weeding and irrigation as needed.")
-            elif stage == "flowering":
-                items.append(f"{crop_name}: Avoid water stress; watch for pests during flowering.")
-            elif stage == "harvesting":
-                items.append(f"{crop_name}: Plan harvest; avoid rain if possible; store grain dry.")
-            else:
-                items.append(f"{crop_name}: Regular monitoring for disease and pest; follow recommended spray schedule.")
-            break
+    # 3. Crop-stage advice for each of the farmer's crops, adjusted to the forecast (services/crop_advice.py)
+    if crops:
+        index = get_crop_advice_index()
+        if crop_advice is None:
+            crop_advice = index.advise(crops, forecast_conditions(hits))
+        items.extend(index.render(crop_advice))
     if len(items) < 3:
         items.append("Get Soil Health Card and follow recommended doses. Save our number for weather alerts.")
 
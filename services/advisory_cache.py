@@ -0,0 +1,249 @@
+# Advisory cache: "Today's Advisory" materialized per cohort
+# An advisory depends only on (weather grid cell, state, crop/stage/season list, language), so after each weather
+# refresh the scheduler builds one AdvisoryCache row per cohort in use and /api/advisory serves it with a
+# single primary-key lookup. Rows carry a version stamp (ADVISORY_CACHE_VERSION plus the build that wrote
+# them) and stay valid until the next build replaces them or ADVISORY_CACHE_MAX_AGE passes; a missing,
+# outdated or expired row is computed on demand and written back. Rows leave out the current conditions
+# (`weather`), which are attached from the live weather cache when a row is served.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import LANGUAGE_CODES, DEFAULT_LANGUAGE
+from models import db, AdvisoryCache, Farmer, FarmerCrop
+from services.advisory import build_advisory
+from services.crop_advice import advisory_crops, forecast_conditions, get_crop_advice_index
+from services.forecast_rules import evaluate_forecasts
+from services.alert_scheduler import WEATHER_ALERT_HOURS
+from services.gazetteer import farmer_coordinates
+from services.weather import fetch_current_weather, fetch_weather, fetch_weather_batch, geo_cell, DEFAULT_LAT, DEFAULT_LON
+
+logger = logging.getLogger(__name__)
+
+ADVISORY_CACHE_VERSION = "3"  # bump when the advisory content changes so existing rows stop being served
+# Rows older than this are recomputed; two build intervals, so one failed build does not empty the cache
+ADVISORY_CACHE_MAX_AGE = int(os.environ.get("ADVISORY_CACHE_MAX_AGE", str(2 * WEATHER_ALERT_HOURS * 3600)))  # seconds
+ADVISORY_BUILD_CHUNK = int(os.environ.get("ADVISORY_BUILD_CHUNK", "1000"))  # farmers per read, rows per upsert
+
+# Stats of the most recent build_advisory_cache run
+last_build = {}
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stale": 0, "on_demand_ms": 0.0}
+
+
+def advisory_version(now=None):
+    """Version stamp of rows written by a build (or on demand) at `now`, e.g. 2:20260618T0555."""
+    return f"{ADVISORY_CACHE_VERSION}:{(now or datetime.utcnow()):%Y%m%dT%H%M}"
+
+
+def _current(row, now):
+    """A cached row is served if this code version wrote it and it is younger than ADVISORY_CACHE_MAX_AGE."""
+    return (
+        row.version.split(":", 1)[0] == ADVISORY_CACHE_VERSION
+        and row.built_at is not None
+        and row.built_at >= now - timedelta(seconds=ADVISORY_CACHE_MAX_AGE)
+    )
+
+
+def advisory_cell(lat=None, lon=None):
+    """Weather grid cell of a request; unknown locations use the default forecast location like fetch_weather."""
+    lat = float(lat or os.environ.get("WEATHER_LAT", DEFAULT_LAT))
+    lon = float(lon or os.environ.get("WEATHER_LON", DEFAULT_LON))
+    return geo_cell(lat, lon)
+
+
+def cohort_key(cell, state, crops, lang):
+    """e.g. 30.9,75.8|Punjab|wheat:sowing:rabi+paddy:harvesting:kharif|hi (crops as from advisory_crops)."""
+    key = f"{cell[0]},{cell[1]}|{state or ''}|{'+'.join(':'.join(c) for c in crops)}|{lang}"
+    return key if len(key) <= 255 else hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+# Built once: a Core select on the session's connection skips the ORM query machinery on every request
+_table = AdvisoryCache.__table__
+_LOOKUP = db.select(_table.c.version, _table.c.built_at, _table.c.payload).where(_table.c.cohort_key == db.bindparam("key"))
+
+
+def _usable(weather):
+    """Advisories built from a failed forecast are served but not cached."""
+    return bool(weather) and not weather.get("error") and weather.get("current") is not None
+
+
+def _stored(advisory):
+    """Payload of a cached row: the advisory without its current conditions, which go stale within hours."""
+    return json.dumps({k: v for k, v in advisory.items() if k != "weather"})
+
+
+def _upsert(rows):
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        for r in rows:
+            db.session.merge(AdvisoryCache(**r))
+        return
+    stmt = insert(AdvisoryCache.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["cohort_key"],
+        set_={"version": stmt.excluded.version, "payload": stmt.excluded.payload, "built_at": stmt.excluded.built_at},
+    )
+    db.session.connection().execute(stmt, rows)
+
+
+def get_cached_advisory(lang, lat=None, lon=None, state=None, farmer=None, weather=None):
+    """
+    get_advisory() served from the cohort cache: one primary-key lookup on a hit, plus the current conditions
+    from the weather cache; on a miss (or an outdated or expired row) the advisory is computed, stored and
+    returned. Callers that already hold the forecast (e.g. /api/dashboard) pass it in so it is not fetched again.
+    """
+    crops = advisory_crops(farmer.crops if farmer else None)
+    state = (state or "").strip()
+    cell = advisory_cell(lat, lon)
+    key = cohort_key(cell, state, crops, lang)
+    now = datetime.utcnow()
+    row = db.session.connection().execute(_LOOKUP, {"key": key}).first()
+    if row is not None and _current(row, now):
+        with _stats_lock:
+            _stats["hits"] += 1
+        advisory = json.loads(row.payload)
+        advisory["weather"] = weather.get("current") if weather is not None else fetch_current_weather(*cell)
+        return advisory
+
+    started = time.perf_counter()
+    if weather is None:
+        weather = fetch_weather(*cell)
+    advisory = build_advisory(lang, weather, state=state, crops=crops)
+    if _usable(weather):
+        try:
+            _upsert([{"cohort_key": key, "version": advisory_version(now), "payload": _stored(advisory), "built_at": now}])
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.warning("Advisory cache write failed: %s", e)
+    with _stats_lock:
+        _stats["stale" if row is not None else "misses"] += 1
+        _stats["on_demand_ms"] += (time.perf_counter() - started) * 1000
+    return advisory
+
+
+def iter_farmer_cohorts(chunk_size=ADVISORY_BUILD_CHUNK):
+    """Yield (farmer count, {cohort key: (cell, state, crops, lang)}) per keyset-paginated chunk of farmers."""
+    last_id = 0
+    while True:
+        rows = (
+            Farmer.query
+            .with_entities(Farmer.id, Farmer.state, Farmer.district, Farmer.village, Farmer.lat, Farmer.lon, Farmer.geo_key,
+                           Farmer.language_code)
+            .filter(Farmer.id > last_id)
+            .order_by(Farmer.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+        crops = {}
+        for c in (
+            FarmerCrop.query
+            .with_entities(FarmerCrop.farmer_id, FarmerCrop.crop_type, FarmerCrop.stage, FarmerCrop.season)
+            .filter(FarmerCrop.farmer_id.in_([r.id for r in rows]))
+            .order_by(FarmerCrop.id)
+        ):
+            crops.setdefault(c.farmer_id, []).append(c)
+        cohorts = {}
+        for r in rows:
+            lang = r.language_code if r.language_code in LANGUAGE_CODES else DEFAULT_LANGUAGE
+            # Same location resolution as a logged-in request (app._request_coords without lat/lon arguments)
+            cohort = (advisory_cell(*farmer_coordinates(r)), (r.state or "").strip(), advisory_crops(crops.get(r.id)), lang)
+            cohorts.setdefault(cohort_key(*cohort), cohort)
+        yield len(rows), cohorts
+        last_id = rows[-1].id
+
+
+def build_advisory_cache(chunk_size=ADVISORY_BUILD_CHUNK):
+    """
+    Materialize the advisory of every cohort in use (each farmer's, plus the logged-out default per language)
+    and delete expired rows and rows of other code versions. Rows this build could not rewrite (their
+    forecast failed) keep being served until they expire. Run inside an app context, after the weather refresh.
+    """
+    started = time.monotonic()
+    build_started = datetime.utcnow()
+    version = advisory_version(build_started)
+    stats = {"farmers": 0, "cohorts": 0, "cells": 0, "cells_failed": 0, "rows_written": 0, "rows_pruned": 0}
+
+    cohorts = {}
+    default_cell = advisory_cell()
+    for lang in LANGUAGE_CODES:
+        cohort = (default_cell, "", (), lang)
+        cohorts[cohort_key(*cohort)] = cohort
+    for n, chunk in iter_farmer_cohorts(chunk_size):
+        stats["farmers"] += n
+        cohorts.update(chunk)
+    stats["cohorts"] = len(cohorts)
+
+    forecasts = fetch_weather_batch(list(dict.fromkeys(c[0] for c in cohorts.values())))
+    stats["cells"] = len(forecasts)
+    stats["cells_failed"] = sum(1 for w in forecasts.values() if not _usable(w))
+
+    # Forecast rules for all cells in one vectorized pass, crop advice for all cohorts in one batch
+    usable = {cell: w for cell, w in forecasts.items() if _usable(w)}
+    hits = evaluate_forecasts(usable)
+    built = [(key, cohort) for key, cohort in cohorts.items() if cohort[0] in usable]
+    crop_advice = get_crop_advice_index().advise_batch(
+        (crops, forecast_conditions(hits.get(cell, []))) for _, (cell, _, crops, _) in built
+    )
+
+    now = datetime.utcnow()
+    rows = []
+    for (key, (cell, state, crops, lang)), advice in zip(built, crop_advice):
+        advisory = build_advisory(lang, usable[cell], state=state, crops=crops, hits=hits.get(cell, []), crop_advice=advice)
+        rows.append({"cohort_key": key, "version": version, "payload": _stored(advisory), "built_at": now})
+        if len(rows) >= chunk_size:
+            _upsert(rows)
+            db.session.commit()
+            stats["rows_written"] += len(rows)
+            rows = []
+    if rows:
+        _upsert(rows)
+        stats["rows_written"] += len(rows)
+    expired = build_started - timedelta(seconds=ADVISORY_CACHE_MAX_AGE)
+    stats["rows_pruned"] = AdvisoryCache.query.filter(db.or_(
+        AdvisoryCache.built_at < expired, ~AdvisoryCache.version.startswith(f"{ADVISORY_CACHE_VERSION}:")
+    )).delete(synchronize_session=False)
+    db.session.commit()
+
+    stats["version"] = version
+    stats["wall_time_s"] = round(time.monotonic() - started, 3)
+    last_build.clear()
+    last_build.update(stats, finished_at=datetime.utcnow().isoformat())
+    logger.info(
+        "Advisory cache build: farmers=%d cohorts=%d cells=%d written=%d pruned=%d wall=%.3fs",
+        stats["farmers"], stats["cohorts"], stats["cells"], stats["rows_written"], stats["rows_pruned"], stats["wall_time_s"],
+    )
+    return stats
+
+
+def get_advisory_cache_stats():
+    """Lookup counters of this process plus the table size and the last build run (inside an app context)."""
+    with _stats_lock:
+        hits, misses, stale, on_demand_ms = _stats["hits"], _stats["misses"], _stats["stale"], _stats["on_demand_ms"]
+    lookups = hits + misses + stale
+    return {
+        "rows": db.session.query(db.func.count()).select_from(AdvisoryCache).scalar(),
+        "version": ADVISORY_CACHE_VERSION,
+        "max_age_s": ADVISORY_CACHE_MAX_AGE,
+        "hits": hits,
+        "misses": misses,
+        "stale": stale,
+        "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+        "avg_on_demand_ms": round(on_demand_ms / (misses + stale), 2) if misses + stale else 0.0,
+        "last_build": dict(last_build),
+    }
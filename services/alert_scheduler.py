@@ -1,72 +1,357 @@
-# Background weather alerts: monitor forecast and send SMS/notification to farmers
-# Uses farmer's stored mobile and district. SMS gateway (e.g. MSG91, Twilio) can be wired in send_sms().
+# Background weather alerts: monitor forecast and queue SMS to farmers
+# Uses farmer's stored mobile and district. Messages go through the SMS outbox (services/sms_outbox.py),
+# whose dispatcher job talks to the gateway.
 
+import atexit
+import json
 import os
+import socket
+import time
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from services.weather import geo_cell, DEFAULT_LAT, DEFAULT_LON
+from services.gazetteer import resolve_location
 
 logger = logging.getLogger(__name__)
 
 
-def send_sms(mobile: str, message: str) -> bool:
+ALERT_CHUNK_SIZE = int(os.environ.get("ALERT_CHUNK_SIZE", "1000"))  # farmers streamed per DB round-trip
+MANDI_INGEST_HOURS = int(os.environ.get("MANDI_INGEST_HOURS", "6"))
+WEATHER_ALERT_HOURS = int(os.environ.get("WEATHER_ALERT_HOURS", "6"))
+SMS_DISPATCH_MINUTES = float(os.environ.get("SMS_DISPATCH_MINUTES", "1"))
+# Seconds one sms_dispatch run may send for before yielding the tick; the rest waits for the next run
+SMS_DISPATCH_BUDGET = float(os.environ.get("SMS_DISPATCH_BUDGET", str(SMS_DISPATCH_MINUTES * 60)))
+JOB_RUN_RETENTION_DAYS = int(os.environ.get("JOB_RUN_RETENTION_DAYS", "14"))  # JobRun history kept by job_run_prune
+
+# Leader election: processes that start the scheduler compete for one DB lease; only its holder runs jobs.
+# The holder renews it every SCHEDULER_HEARTBEAT seconds; another process takes over once it is
+# SCHEDULER_LEASE_TTL seconds stale. Jobs run under `flask scheduler`; SCHEDULER_IN_WEB=1 also starts
+# the scheduler in every web worker (never on plain import of app.py).
+SCHEDULER_IN_WEB = os.environ.get("SCHEDULER_IN_WEB", "0") == "1"
+SCHEDULER_LEASE = "scheduler"
+SCHEDULER_LEASE_TTL = int(os.environ.get("SCHEDULER_LEASE_TTL", "90"))
+SCHEDULER_HEARTBEAT = int(os.environ.get("SCHEDULER_HEARTBEAT", "30"))
+SCHEDULER_TICK = int(os.environ.get("SCHEDULER_TICK", "60"))  # seconds between checks for due jobs
+
+# Stats of the most recent check_weather_and_alert run
+last_alert_run = {}
+
+
+def farmer_cell(row):
+    """Weather grid cell for a farmer row: cached coordinates, else gazetteer, else the default location."""
+    lat, lon = row.lat, row.lon
+    if lat is None or lon is None:
+        loc = resolve_location(row.state or None, row.district or None, row.village or None)
+        if loc:
+            lat, lon = loc.lat, loc.lon
+    if lat is None or lon is None:
+        lat = float(os.environ.get("WEATHER_LAT", DEFAULT_LAT))
+        lon = float(os.environ.get("WEATHER_LON", DEFAULT_LON))
+    return geo_cell(lat, lon)
+
+
+def iter_farmer_chunks(chunk_size=ALERT_CHUNK_SIZE):
+    """Yield lists of (id, mobile, state, district, village, lat, lon) for alertable farmers, keyset-paginated by id."""
+    from models import Farmer
+
+    last_id = 0
+    while True:
+        rows = (
+            Farmer.query
+            .with_entities(Farmer.id, Farmer.mobile, Farmer.state, Farmer.district, Farmer.village, Farmer.lat, Farmer.lon)
+            .filter(Farmer.id > last_id, Farmer.mobile != "", Farmer.district != "")
+            .order_by(Farmer.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def check_weather_and_alert(app):
+    """
+    Run inside app context: stream farmers in chunks, fetch each weather cell once (batched),
+    evaluate the forecast rules (services/forecast_rules.py) for all new cells of a chunk in one
+    vectorized pass and bulk-insert that chunk's SMS into the outbox.
+    An alert is keyed on its type, the farmer and the forecast date it is about, so later runs that
+    still see the same event (rules look up to three days ahead) queue nothing new.
     """
-    Send SMS to farmer. Replace with real gateway (MSG91, Twilio, etc.) in production.
-    Set SMS_GATEWAY_URL or MSG91_AUTH_KEY etc. and implement HTTP call here.
+    from services.weather import fetch_weather_batch
+    from services.forecast_rules import forecast_alerts
+    from services.sms_outbox import enqueue_sms, sms_key
+
+    started = time.monotonic()
+    cell_alerts = {}  # cell -> (alert type, text, forecast date) or None, evaluated once per run
+    stats = {"cells_fetched": 0, "farmers_evaluated": 0, "alerts_produced": 0, "sms_queued": 0, "sms_duplicate": 0}
+
+    with app.app_context():
+        for rows in iter_farmer_chunks():
+            cells = [farmer_cell(r) for r in rows]
+            new_cells = [c for c in dict.fromkeys(cells) if c not in cell_alerts]
+            if new_cells:
+                forecasts = fetch_weather_batch(new_cells)
+                stats["cells_fetched"] += len(new_cells)
+                cell_alerts.update(forecast_alerts({cell: forecasts.get(cell) for cell in new_cells}))
+
+            messages = []
+            for r, cell in zip(rows, cells):
+                stats["farmers_evaluated"] += 1
+                alert = cell_alerts.get(cell)
+                if alert:
+                    kind, text, forecast_date = alert
+                    messages.append({
+                        "idempotency_key": sms_key(kind, r.id, forecast_date),
+                        "farmer_id": r.id,
+                        "mobile": r.mobile,
+                        "message": text,
+                        "kind": kind,
+                    })
+            stats["alerts_produced"] += len(messages)
+            queued = enqueue_sms(messages)
+            stats["sms_queued"] += queued
+            stats["sms_duplicate"] += len(messages) - queued
+
+    stats["wall_time_s"] = round(time.monotonic() - started, 3)
+    stats["finished_at"] = datetime.utcnow().isoformat()
+    last_alert_run.clear()
+    last_alert_run.update(stats)
+    logger.info(
+        "Weather alert run: cells=%d farmers=%d alerts=%d queued=%d duplicate=%d wall=%.3fs",
+        stats["cells_fetched"], stats["farmers_evaluated"], stats["alerts_produced"],
+        stats["sms_queued"], stats["sms_duplicate"], stats["wall_time_s"],
+    )
+    return stats
+
+
+def run_sms_dispatch(app):
     """
-    mobile = (mobile or "").strip()
-    if not mobile or len(mobile) < 10:
+    Drain the SMS outbox at the configured rate (services/sms_outbox.py) for up to SMS_DISPATCH_BUDGET
+    seconds, re-checking the scheduler lease between batches so a deposed leader stops sending.
+    """
+    from services.sms_outbox import dispatch_outbox
+
+    with app.app_context():
+        owner = scheduler_owner()
+        return dispatch_outbox(time_budget=SMS_DISPATCH_BUDGET, keep_going=lambda: acquire_lease(owner))
+
+
+def run_advisory_build(app):
+    """Rebuild the per-cohort advisory cache from the forecasts the weather job just refreshed."""
+    from services.advisory_cache import build_advisory_cache
+
+    with app.app_context():
+        return build_advisory_cache()
+
+
+def run_mandi_ingest(app):
+    """Incremental data.gov.in mandi ingest (no-op without DATA_GOV_IN_API_KEY)."""
+    from services.mandi import ingest_mandi_prices
+
+    with app.app_context():
+        return ingest_mandi_prices()
+
+
+def prune_job_runs(app, retention_days=JOB_RUN_RETENTION_DAYS):
+    """Delete JobRun history older than retention_days (sms_dispatch alone records ~1,440 runs a day)."""
+    from models import db, JobRun
+
+    with app.app_context():
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        deleted = JobRun.query.filter(JobRun.started_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+        return {"deleted": deleted}
+
+
+# (job id, function(app), interval in hours); a job is due when no run of it started within its interval.
+# Due jobs run in this order, so the advisory build follows the weather refresh in the same tick.
+SCHEDULED_JOBS = (
+    ("weather_alert", check_weather_and_alert, WEATHER_ALERT_HOURS),
+    ("advisory_build", run_advisory_build, WEATHER_ALERT_HOURS),
+    ("mandi_ingest", run_mandi_ingest, MANDI_INGEST_HOURS),
+    ("job_run_prune", prune_job_runs, 24),
+)
+
+# Runs as its own APScheduler job every SMS_DISPATCH_MINUTES, so a slow weather_alert tick never delays it
+SMS_DISPATCH_JOB = "sms_dispatch"
+
+_scheduler = None
+_is_leader = False
+
+
+def scheduler_owner():
+    """Lease owner id of this process (computed per call: gunicorn forks workers after import)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire_lease(owner, name=SCHEDULER_LEASE, ttl=SCHEDULER_LEASE_TTL):
+    """
+    Take or renew the lease; True while owner holds it. A conditional UPDATE renews our own lease or
+    takes over an expired one, and the first claim is an INSERT, so two processes never both win.
+    Run inside an app context.
+    """
+    from sqlalchemy.exc import IntegrityError
+    from models import db, SchedulerLease
+
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=ttl)
+    updated = (
+        SchedulerLease.query
+        .filter(SchedulerLease.name == name, db.or_(SchedulerLease.owner == owner, SchedulerLease.expires_at < now))
+        .update({
+            "acquired_at": db.case((SchedulerLease.owner == owner, SchedulerLease.acquired_at), else_=now),
+            "owner": owner,
+            "heartbeat_at": now,
+            "expires_at": expires,
+        }, synchronize_session=False)
+    )
+    if updated:
+        db.session.commit()
+        return True
+    try:
+        db.session.add(SchedulerLease(name=name, owner=owner, acquired_at=now, heartbeat_at=now, expires_at=expires))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()  # held by another live process
         return False
-    # Stub: log only. In production: POST to SMS API with mobile and message.
-    logger.info("SMS stub: to=%s msg=%s", mobile[-10:], message[:80])
-    if os.environ.get("ALERT_LOG_ONLY") != "1":
-        pass  # Could write to queue (Redis, DB) for a worker to send
-    return True
 
 
-def check_weather_and_alert(app):
-    """Run inside app context: fetch weather for farmers with district; send alert if severe."""
-    from models import Farmer
-    from services.weather import fetch_weather
+def release_lease(owner, name=SCHEDULER_LEASE):
+    """Expire our lease now so another process can take over without waiting for the TTL."""
+    from models import db, SchedulerLease
+
+    SchedulerLease.query.filter_by(name=name, owner=owner).update(
+        {"expires_at": datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _job_due(job_id, interval_hours):
+    from models import JobRun
+
+    last = JobRun.query.filter_by(job_id=job_id).order_by(JobRun.started_at.desc()).first()
+    return last is None or last.started_at <= datetime.utcnow() - timedelta(hours=interval_hours)
+
+
+def run_scheduled_job(app, job_id, fn):
+    """Run fn(app) and record it as a JobRun (start, end, duration, outcome, returned stats)."""
+    from models import db, JobRun
+
+    with app.app_context():
+        run = JobRun(job_id=job_id, owner=scheduler_owner(), status="running")
+        db.session.add(run)
+        db.session.commit()
+        run_id = run.id
+    started = time.perf_counter()
+    status, result, error = "ok", None, None
+    try:
+        result = fn(app)
+    except Exception as e:
+        status, error = "failed", str(e)[:255]
+        logger.exception("Scheduled job %s failed", job_id)
+    duration_ms = (time.perf_counter() - started) * 1000
+    with app.app_context():
+        run = db.session.get(JobRun, run_id)
+        run.status = status
+        run.error = error
+        run.finished_at = datetime.utcnow()
+        run.duration_ms = round(duration_ms, 1)
+        run.result = json.dumps(result, default=str) if result is not None else None
+        db.session.commit()
+    logger.info("Scheduled job %s %s in %.0f ms", job_id, status, duration_ms)
+    return result
 
+
+def _heartbeat(app):
+    global _is_leader
+    try:
+        with app.app_context():
+            leader = acquire_lease(scheduler_owner())
+    except Exception as e:
+        logger.warning("Scheduler heartbeat failed: %s", e)
+        leader = False
+    if leader != _is_leader:
+        logger.info("Scheduler leadership %s by %s", "acquired" if leader else "lost", scheduler_owner())
+    _is_leader = leader
+
+
+def run_due_jobs(app, jobs=SCHEDULED_JOBS):
+    """Run every job whose interval has elapsed, if this process holds the lease. Returns the job ids run."""
+    ran = []
+    for job_id, fn, interval_hours in jobs:
+        with app.app_context():
+            # Re-checked per job: a long run must not let a deposed leader start the next one
+            if not acquire_lease(scheduler_owner()) or not _job_due(job_id, interval_hours):
+                continue
+        run_scheduled_job(app, job_id, fn)
+        ran.append(job_id)
+    return ran
+
+
+def run_sms_dispatch_job(app):
+    """Drain the SMS outbox as a recorded JobRun, if this process holds the lease."""
     with app.app_context():
-        farmers = Farmer.query.filter(Farmer.mobile != "", Farmer.district != "").all()
-        for f in farmers:
-            try:
-                # Use district/state for lat/lon if you have a geocoding API; else skip or use default
-                data = fetch_weather()
-                if not data or not data.get("current"):
-                    continue
-                cur = data["current"]
-                temp = cur.get("temperature")
-                cond = (cur.get("condition") or "").lower()
-                msg = None
-                # Stricter thresholds to reduce false positives (aligned with dashboard)
-                if cond == "stormy":
-                    msg = "KRISHSAATHI: Storm likely. Keep crops and yourself safe."
-                elif cond == "rainy":
-                    msg = "KRISHSAATHI: Rain expected. Reduce irrigation, check drainage."
-                elif temp is not None and temp >= 43:
-                    msg = "KRISHSAATHI: Extreme heat. Ensure water and shade for crops."
-                elif temp is not None and temp <= 1:
-                    msg = "KRISHSAATHI: Cold conditions. Protect sensitive crops."
-                if msg:
-                    send_sms(f.mobile, msg)
-            except Exception as e:
-                logger.warning("Alert check failed for farmer %s: %s", f.id, e)
-
-
-def start_alert_scheduler(flask_app):
-    """Start APScheduler to run check_weather_and_alert periodically (e.g. every 6 hours)."""
+        if not acquire_lease(scheduler_owner()):
+            return None
+    return run_scheduled_job(app, SMS_DISPATCH_JOB, run_sms_dispatch)
+
+
+def _release(app):
+    try:
+        with app.app_context():
+            release_lease(scheduler_owner())
+    except Exception:
+        pass
+
+
+def start_alert_scheduler(flask_app, blocking=False):
+    """
+    Start APScheduler with the lease heartbeat, a tick that runs due jobs (see SCHEDULED_JOBS) and the
+    SMS dispatcher.
+    Safe to start in every process: only the lease holder runs jobs. blocking=True runs in the foreground.
+    """
+    global _scheduler
     try:
         from apscheduler.schedulers.background import BackgroundScheduler
-        scheduler = BackgroundScheduler()
+        from apscheduler.schedulers.blocking import BlockingScheduler
+        if _scheduler is not None:
+            if not blocking:
+                return _scheduler
+            _scheduler.shutdown(wait=False)
+        scheduler = BlockingScheduler() if blocking else BackgroundScheduler()
+        scheduler.add_job(
+            _heartbeat,
+            "interval",
+            seconds=SCHEDULER_HEARTBEAT,
+            args=[flask_app],
+            id="scheduler_heartbeat",
+            next_run_time=datetime.now(),
+        )
+        scheduler.add_job(
+            run_due_jobs,
+            "interval",
+            seconds=SCHEDULER_TICK,
+            args=[flask_app],
+            id="scheduler_tick",
+            max_instances=1,
+            coalesce=True,
+        )
         scheduler.add_job(
-            lambda: check_weather_and_alert(flask_app),
+            run_sms_dispatch_job,
             "interval",
-            hours=6,
-            id="weather_alert",
+            seconds=SMS_DISPATCH_MINUTES * 60,
+            args=[flask_app],
+            id=SMS_DISPATCH_JOB,
+            max_instances=1,
+            coalesce=True,
         )
+        _scheduler = scheduler
+        atexit.register(_release, flask_app)
+        logger.info("Scheduler started by %s (jobs: %s)", scheduler_owner(), ", ".join([j[0] for j in SCHEDULED_JOBS] + [SMS_DISPATCH_JOB]))
         scheduler.start()
-        logger.info("Weather alert scheduler started (every 6h)")
     except Exception as e:
         logger.warning("Could not start alert scheduler: %s", e)
+    return _scheduler
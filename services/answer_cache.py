@@ -0,0 +1,227 @@
+# Semantic answer cache for LLM chatbot replies
+# Farmers ask the same questions over and over; replies are cached per (language, coarse location, topic)
+# and looked up by exact normalized text first, then by cosine similarity of hashed character n-gram vectors,
+# so "whitefly on my cotton?" and "white fly in cotton" share one GPT-4o answer. The topic (crops, pests,
+# diseases, schemes named in the question) keeps "urea for wheat" from matching "urea for paddy".
+
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from services.chatbot_engine import scan_message
+
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", "21600"))  # seconds an answer is reused
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.86"))  # cosine threshold
+ANSWER_CACHE_DIM = 512  # hashed n-gram vector width
+NGRAM_SIZES = (2, 3, 4)
+
+# Farmer names are swapped for this marker when stored, so a cached greeting fits any farmer
+NAME_MARKER = "\x00name\x00"
+
+CacheHit = namedtuple("CacheHit", "answer similarity saved_seconds")
+
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    """Case-, punctuation- and whitespace-insensitive form of a question (Indic text kept)."""
+    text = unicodedata.normalize("NFC", text or "").casefold()
+    text = text.replace("़", "").replace("ँ", "ं")
+    # Letters, marks (Indic vowel signs) and digits are kept; everything else separates words
+    text = "".join(c if unicodedata.category(c)[0] in "LMN" else " " for c in text)
+    return _SPACE.sub(" ", text).strip()
+
+
+def ngram_vector(normalized, dim=ANSWER_CACHE_DIM):
+    """L2-normalized float32 vector of hashed character n-grams of each (space-padded) word."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in normalized.split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                vec[zlib.crc32(padded[i:i + n].encode("utf-8")) % dim] += 1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class _Entry:
+    __slots__ = ("slot", "answer", "created", "latency", "hits")
+
+    def __init__(self, slot, answer, created, latency):
+        self.slot = slot
+        self.answer = answer
+        self.created = created
+        self.latency = latency  # seconds the original LLM call took
+        self.hits = 0
+
+
+class AnswerCache:
+    """
+    Bounded LRU of answers with TTL. Vectors live in one preallocated (max_entries x dim) matrix;
+    a similarity lookup is a single matrix-vector product over the slots of the same partition.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL,
+                 threshold=ANSWER_CACHE_SIMILARITY, dim=ANSWER_CACHE_DIM):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.dim = dim
+        self._entries = OrderedDict()  # (lang, location, topic, normalized) -> _Entry, least recently used first
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._slot_group = np.full(max_entries, -1, dtype=np.int64)  # partition id per slot, -1 = free
+        self._slot_keys = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._groups = {}  # (lang, location, topic) -> partition id, dropped with its last entry
+        self._group_sizes = {}  # partition id -> entries
+        self._next_group = 0
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        group = int(self._slot_group[entry.slot])
+        self._group_sizes[group] -= 1
+        if not self._group_sizes[group]:
+            del self._group_sizes[group]
+            del self._groups[key[:3]]
+        self._slot_group[entry.slot] = -1
+        self._slot_keys[entry.slot] = None
+        self._free.append(entry.slot)
+
+    def _hit(self, key, entry, similarity):
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        self.saved_seconds += entry.latency
+        return CacheHit(entry.answer, round(similarity, 4), entry.latency)
+
+    def get(self, message, lang, location=None, topic=""):
+        """CacheHit for the question (exact or near-duplicate) in this language, location and topic, else None."""
+        normalized = normalize_question(message)
+        if not normalized:
+            return None
+        key = (lang, location or "", topic, normalized)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry.created <= self.ttl:
+                    self.exact_hits += 1
+                    return self._hit(key, entry, 1.0)
+                self._remove(key)
+                self.expired += 1
+            group = self._groups.get(key[:3])
+            if group is not None:
+                slots = np.flatnonzero(self._slot_group == group)
+                if len(slots):
+                    sims = self._vectors[slots] @ ngram_vector(normalized, self.dim)
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.threshold:
+                        match_key = self._slot_keys[slots[best]]
+                        match = self._entries[match_key]
+                        if now - match.created <= self.ttl:
+                            self.similar_hits += 1
+                            return self._hit(match_key, match, float(sims[best]))
+                        self._remove(match_key)
+                        self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, message, lang, answer, location=None, topic="", latency=0.0):
+        normalized = normalize_question(message)
+        if not normalized or not answer or self.max_entries <= 0:
+            return
+        key = (lang, location or "", topic, normalized)
+        vector = ngram_vector(normalized, self.dim)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if not self._free:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            slot = self._free.pop()
+            group = self._groups.get(key[:3])
+            if group is None:
+                group = self._groups[key[:3]] = self._next_group
+                self._next_group += 1
+            self._group_sizes[group] = self._group_sizes.get(group, 0) + 1
+            self._vectors[slot] = vector
+            self._slot_group[slot] = group
+            self._slot_keys[slot] = key
+            self._entries[key] = _Entry(slot, answer, time.monotonic(), latency)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            top = sorted(self._entries.items(), key=lambda kv: kv[1].hits, reverse=True)[:10]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "partitions": len(self._groups),
+                "ttl": self.ttl,
+                "similarity_threshold": self.threshold,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 2),
+                "top_questions": [
+                    {"question": key[3], "language": key[0], "location": key[1], "topic": key[2], "hits": entry.hits}
+                    for key, entry in top if entry.hits
+                ],
+            }
+
+
+def question_topic(message):
+    """Knowledge-base entities named in the question, e.g. "crop:wheat pest:aphid" ("" if none)."""
+    scan = scan_message(normalize_question(message))
+    return " ".join(f"{kind}:{key}" for kind in ("crop", "pest", "disease", "scheme") for key in sorted(scan.keys(kind)))
+
+
+def mask_farmer_name(answer, farmer_name):
+    """Replace the farmer's name in an answer with NAME_MARKER so it can be shared."""
+    if farmer_name and len(farmer_name) >= 3:
+        return answer.replace(farmer_name, NAME_MARKER)
+    return answer
+
+
+def fill_farmer_name(answer, farmer_name):
+    return answer.replace(NAME_MARKER, farmer_name or "Kisan")
+
+
+def get_cached_answer(message, lang, location=None, farmer_name=None):
+    """Cached answer text personalized for farmer_name, or None."""
+    hit = _answer_cache.get(message, lang, location, question_topic(message))
+    return fill_farmer_name(hit.answer, farmer_name) if hit else None
+
+
+def cache_answer(message, lang, answer, location=None, farmer_name=None, latency=0.0):
+    """Store an LLM answer; the farmer's name is replaced by a marker so the answer can be shared."""
+    _answer_cache.put(message, lang, mask_farmer_name(answer, farmer_name), location, question_topic(message), latency)
+
+
+def get_answer_cache_stats():
+    return _answer_cache.stats()
+
+
+_answer_cache = AnswerCache()
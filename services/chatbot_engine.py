@@ -3,7 +3,11 @@
 
 import re
 import random
+import unicodedata
+from collections import namedtuple
 from translations import get_translation
+from services.keyword_matcher import build_keyword_index
+from services.knowledge_search import search_knowledge
 
 # Import knowledge base
 try:
@@ -60,59 +64,101 @@ INTENT_KEYWORDS = {
     "greeting": ["hello", "hi", "namaste", "नमस्ते", "help", "मदद", "hii", "hey"]
 }
 
-def detect_intent(message):
-    """Detect user intent from message."""
-    msg_lower = message.lower()
-    
-    for intent, keywords in INTENT_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in msg_lower:
-                return intent
-    
-    return "general"
+# Single automaton over every intent keyword and entity name, built once at import
+KEYWORD_INDEX = build_keyword_index(
+    INTENT_KEYWORDS, CROP_DATABASE, PEST_DATABASE, DISEASE_DATABASE, GOVERNMENT_SCHEMES
+)
+
+
+def scan_message(message):
+    """All intents and entities in the message (one pass), with positions and scores."""
+    return KEYWORD_INDEX.scan(message)
+
 
-def find_crop_in_message(message):
+def detect_intent(message, scan=None):
+    """Detect user intent from message (first intent in INTENT_KEYWORDS order with a hit)."""
+    return (scan or scan_message(message)).first("intent") or "general"
+
+def find_crop_in_message(message, scan=None):
     """Find crop name in message."""
-    msg_lower = message.lower()
-    
-    # Check all crops
-    for crop_key, crop_data in CROP_DATABASE.items():
-        if crop_key in msg_lower or crop_data.get("hindi", "").lower() in msg_lower:
-            return crop_key
-    
-    return None
+    return (scan or scan_message(message)).first("crop")
 
-def find_pest_in_message(message):
+def find_pest_in_message(message, scan=None):
     """Find pest name in message."""
-    msg_lower = message.lower()
-    
-    for pest_key, pest_data in PEST_DATABASE.items():
-        if pest_key.replace("_", " ") in msg_lower or pest_data.get("hindi", "").lower() in msg_lower:
-            return pest_key
-    
-    return None
+    return (scan or scan_message(message)).first("pest")
 
-def find_disease_in_message(message):
+def find_disease_in_message(message, scan=None):
     """Find disease name in message."""
-    msg_lower = message.lower()
-    
-    for disease_key, disease_data in DISEASE_DATABASE.items():
-        if disease_key.replace("_", " ") in msg_lower or disease_data.get("hindi", "").lower() in msg_lower:
-            return disease_key
-    
-    return None
+    return (scan or scan_message(message)).first("disease")
 
-def find_scheme_in_message(message):
+def find_scheme_in_message(message, scan=None):
     """Find scheme name in message."""
-    msg_lower = message.lower()
-    
-    for scheme_key, scheme_data in GOVERNMENT_SCHEMES.items():
-        keywords = [scheme_key, scheme_data["name"].lower(), scheme_data["hindi"].lower()]
-        for kw in keywords:
-            if kw.replace("_", " ") in msg_lower:
-                return scheme_key
-    
-    return None
+    return (scan or scan_message(message)).first("scheme")
+
+# Phrases that make a question open-ended (advice, comparison, reasoning) rather than a lookup
+OPEN_ENDED_MARKERS = [
+    "why", "should", "can i", "what if", "better", "compare", " vs ", "best", "instead",
+    "क्यों", "चाहिए", "बेहतर", "कौन सा", "तुलना",
+]
+
+# intent: "crop", "pest", "disease", "scheme", "greeting" (answerable locally) or another detected intent
+LocalRoute = namedtuple("LocalRoute", "intent entity confidence")
+
+def score_local_answer(message, scan=None):
+    """
+    How well a knowledge-base template would answer the message (0-1). A lookup-style question naming
+    one entry ("wheat rust", "PM-KISAN eligibility") scores high; long or open-ended questions and
+    questions naming several entries score low.
+    """
+    scan = scan or scan_message(message)
+    text = (message or "").lower()
+    letters = [unicodedata.category(c)[0] in "LMN" for c in text]
+    if not any(letters):
+        return LocalRoute("general", None, 0.0)
+    # Pest/disease entries are more specific than the crop they are mentioned with
+    entity_kinds = [kind for kind in ("disease", "pest", "scheme", "crop") if scan.keys(kind)]
+    intent = entity_kinds[0] if entity_kinds else detect_intent(message, scan)
+    # Greeting keywords only count as whole words ("hi" inside "this" or "chilli" is no greeting)
+    greetings = [
+        m for m in scan.matches
+        if m.kind == "intent" and m.key == "greeting"
+        and (m.start == 0 or not letters[m.start - 1]) and (m.end == len(text) or not letters[m.end])
+    ]
+    if intent == "greeting" and not greetings:
+        intent = "general"
+    if intent not in ("disease", "pest", "scheme", "crop", "greeting"):
+        return LocalRoute(intent, None, 0.0)
+
+    # Share of the message's letters taken up by the matched names/keywords
+    covered = set()
+    for m in (greetings if intent == "greeting" else scan.matches):
+        if m.kind in entity_kinds or intent == "greeting":
+            covered.update(range(m.start, m.end))
+    coverage = sum(1 for i in covered if letters[i]) / sum(letters)
+
+    if intent == "greeting":
+        entity = None
+        confidence = 0.4 + 0.6 * coverage
+    else:
+        entity = scan.first(intent)
+        entities = sum(len(scan.keys(kind)) for kind in entity_kinds)
+        confidence = 0.55 + 0.45 * coverage - 0.1 * (entities - 1)
+    if any(marker in text for marker in OPEN_ENDED_MARKERS):
+        confidence -= 0.25
+    return LocalRoute(intent, entity, round(min(1.0, max(0.0, confidence)), 3))
+
+def get_local_answer(route, lang):
+    """Template reply for a LocalRoute from score_local_answer (None if there is none)."""
+    if route.intent == "greeting":
+        return RESPONSE_TEMPLATES.get(lang, RESPONSE_TEMPLATES["en"])["greeting"]
+    responders = {
+        "crop": get_crop_response,
+        "pest": get_pest_response,
+        "disease": get_disease_response,
+        "scheme": get_scheme_response,
+    }
+    responder = responders.get(route.intent)
+    return responder(route.entity, lang) if responder and route.entity else None
 
 def get_crop_response(crop_key, lang):
     """Generate response for crop query."""
@@ -184,6 +230,39 @@ def get_scheme_response(scheme_key, lang):
         docs=", ".join(scheme.get("documents", []))
     )
 
+# Minimum BM25 score for a free-text search hit to be served instead of generic tips
+KNOWLEDGE_MIN_SCORE = 3.0
+
+
+def get_weather_advisory_response(condition_key, lang):
+    """Generate response from a WEATHER_ADVISORY entry (general advice plus crop-specific lines)."""
+    advisory = WEATHER_ADVISORY.get(condition_key)
+    if not advisory:
+        return None
+    lines = [f"• {t}" for t in advisory.get("general", [])]
+    for crop, tips in advisory.items():
+        if crop != "general":
+            lines += [f"• {crop.title()}: {t}" for t in tips]
+    templates = RESPONSE_TEMPLATES.get(lang, RESPONSE_TEMPLATES["en"])
+    return templates["weather_advice"].format(advice="\n".join(lines))
+
+
+KNOWLEDGE_RESPONSES = {
+    "crop": get_crop_response,
+    "pest": get_pest_response,
+    "disease": get_disease_response,
+    "scheme": get_scheme_response,
+    "weather": get_weather_advisory_response,
+}
+
+
+def get_knowledge_search_reply(message, lang, kinds=None):
+    """Best BM25 knowledge-base entry for a free-text message, or None below KNOWLEDGE_MIN_SCORE."""
+    hits = search_knowledge(message, k=1, kinds=kinds)
+    if not hits or hits[0].score < KNOWLEDGE_MIN_SCORE:
+        return None
+    return KNOWLEDGE_RESPONSES[hits[0].kind](hits[0].key, lang)
+
 def analyze_image_symptoms(message):
     """Analyze image based on text description or simulate analysis."""
     msg_lower = message.lower()
@@ -233,7 +312,8 @@ def get_chatbot_reply(message, lang="hi"):
         return templates["greeting"]
     
     msg = message.strip()
-    intent = detect_intent(msg)
+    scan = scan_message(msg)
+    intent = detect_intent(msg, scan)
     
     # Handle greeting
     if intent == "greeting":
@@ -242,7 +322,7 @@ def get_chatbot_reply(message, lang="hi"):
     
     # Handle crop queries
     if intent == "crop":
-        crop = find_crop_in_message(msg)
+        crop = find_crop_in_message(msg, scan)
         if crop:
             response = get_crop_response(crop, lang)
             if response:
@@ -250,11 +330,14 @@ def get_chatbot_reply(message, lang="hi"):
     
     # Handle pest queries
     if intent == "pest" or "pest" in msg.lower() or "कीट" in msg:
-        pest = find_pest_in_message(msg)
+        pest = find_pest_in_message(msg, scan)
         if pest:
             response = get_pest_response(pest, lang)
             if response:
                 return response
+        response = get_knowledge_search_reply(msg, lang, kinds=("pest",))
+        if response:
+            return response
         # If no specific pest found, give general pest tips
         if lang == "hi":
             return "कीट प्रबंधन के लिए:\n\n🌿 **जैविक विधियां**:\n• नीम तेल 5ml/लीटर छिड़काव\n• ट्राइकोग्रामा कार्ड लगाएं\n• फेरोमोन ट्रैप 5/हेक्टेयर\n\n💡 **रासायनिक नियंत्रण**: केवल आर्थिक क्षति स्तर (ETL) पार होने पर करें।\n\n📞 अपनी फसल का नाम बताएं तो विस्तृत जानकारी दे सकता हूं।"
@@ -263,11 +346,14 @@ def get_chatbot_reply(message, lang="hi"):
     
     # Handle disease queries
     if intent == "disease" or any(word in msg.lower() for word in ["disease", "रोग", "infection", "problem"]):
-        disease = find_disease_in_message(msg)
+        disease = find_disease_in_message(msg, scan)
         if disease:
             response = get_disease_response(disease, lang)
             if response:
                 return response
+        response = get_knowledge_search_reply(msg, lang, kinds=("disease",))
+        if response:
+            return response
         # Analyze symptoms from message
         analysis = analyze_image_symptoms(msg)
         if analysis:
@@ -276,7 +362,7 @@ def get_chatbot_reply(message, lang="hi"):
     
     # Handle scheme queries
     if intent == "scheme":
-        scheme = find_scheme_in_message(msg)
+        scheme = find_scheme_in_message(msg, scan)
         if scheme:
             response = get_scheme_response(scheme, lang)
             if response:
@@ -306,6 +392,11 @@ def get_chatbot_reply(message, lang="hi"):
         else:
             return "**Soil & Fertilizer Advice**:\n\n🧪 **Get soil tested** - It's FREE!\n\n**General recommendations**:\n• Nitrogen (N): from Urea\n• Phosphorus (P): from DAP\n• Potash (K): from MOP\n\n💡 **Organic options**:\n• Vermicompost 2-5 tonnes/hectare\n• Jeevamrit/Ghanjeevamrit\n• Green manuring\n\n⚠️ **Caution**: Don't apply fertilizers without soil test."
     
+    # Free-text search over the knowledge base before falling back to generic tips
+    response = get_knowledge_search_reply(msg, lang)
+    if response:
+        return response
+
     # Default helpful response
     templates = RESPONSE_TEMPLATES.get(lang, RESPONSE_TEMPLATES["en"])
     tips = get_general_tips(lang)
@@ -0,0 +1,214 @@
+# Crop-stage advisory rules - a (crop, stage, weather condition, season) -> advice keys table
+# CROP_STAGE_RULES rows may use "*" for any value. At load time they are expanded, together with the
+# crop-specific lines of WEATHER_ADVISORY, into a dict keyed by concrete (crop, stage, condition, season)
+# tuples, so each of a farmer's crops costs one lookup for its stage advice plus one per active weather
+# condition. advise_batch() evaluates many farmers at once, resolving each distinct crop situation once.
+
+from collections import namedtuple
+from datetime import date
+
+from config import CROP_TYPES, CROP_STAGES, SEASONS
+from services.agri_knowledge import WEATHER_ADVISORY
+
+ANY = "*"
+
+# Forecast rule id (services.forecast_rules) -> weather condition (the WEATHER_ADVISORY keys, plus humid/windy)
+RULE_CONDITIONS = {
+    "storm": "rain_expected",
+    "heavy_rain": "rain_expected",
+    "rain": "rain_expected",
+    "extreme_heat": "hot_weather",
+    "heatwave": "hot_weather",
+    "dry_spell": "hot_weather",
+    "cold": "cold_wave",
+    "fungal_risk": "humid",
+    "high_wind": "windy",
+}
+CONDITIONS = ("rain_expected", "hot_weather", "cold_wave", "humid", "windy")
+
+CROP_ADVICE = {
+    "stage.sowing": "Ensure seed treatment and timely sowing; check soil moisture.",
+    "stage.vegetative": "Monitor for pests; avoid excess nitrogen; weeding and irrigation as needed.",
+    "stage.flowering": "Avoid water stress; watch for pests during flowering.",
+    "stage.harvesting": "Plan harvest; avoid rain if possible; store grain dry.",
+    "stage.general": "Regular monitoring for disease and pest; follow recommended spray schedule.",
+    "sowing.hot": "Sow in the evening and give a light irrigation; hot soil hurts germination.",
+    "sowing.rain": "Delay sowing until the rain passes; waterlogged seed rots.",
+    "flowering.hot": "Irrigate lightly in the evening to protect flowers from heat.",
+    "harvesting.rain": "Harvest mature crop before the rain and cover harvested produce.",
+    "paddy.sowing.kharif": "Raise the nursery on time and treat seed before sowing.",
+    "paddy.vegetative": "Top-dress urea at tillering and keep about 5 cm of standing water.",
+    "paddy.flowering.humid": "Humid weather favours blast: scout leaves and panicle necks for spindle-shaped spots.",
+    "wheat.sowing.rabi": "Sow by mid-November; late sowing cuts yield.",
+    "wheat.vegetative.humid": "Humid spell: scout for yellow rust stripes on leaves.",
+    "wheat.flowering.hot": "Heat at heading shrivels grain; irrigate now.",
+    "cotton.vegetative": "Scout for sucking pests (whitefly, jassids) twice a week.",
+    "cotton.flowering": "Install pheromone traps for pink bollworm.",
+    "cotton.harvesting.rain": "Pick open bolls before the rain to keep the lint clean.",
+    "sugarcane.vegetative.windy": "Earth up and tie canes to prevent lodging in strong wind.",
+    "maize.sowing.rain": "Maize seedlings suffer in waterlogging; keep drainage channels open.",
+    "soybean.vegetative.rain": "Clear field drainage; waterlogging stunts soybean.",
+    "groundnut.harvesting.rain": "Lift and dry pods before the rain to avoid aflatoxin.",
+    "chickpea.flowering": "Avoid irrigation at flowering and scout for pod borer.",
+}
+
+# crop, stage, condition, season, advice keys (CROP_ADVICE keys, most specific first within a row)
+CropRule = namedtuple("CropRule", "crop stage condition season advice")
+
+CROP_STAGE_RULES = (
+    CropRule(ANY, "sowing", ANY, ANY, ("stage.sowing",)),
+    CropRule(ANY, "vegetative", ANY, ANY, ("stage.vegetative",)),
+    CropRule(ANY, "flowering", ANY, ANY, ("stage.flowering",)),
+    CropRule(ANY, "harvesting", ANY, ANY, ("stage.harvesting",)),
+    CropRule(ANY, "post_harvest", ANY, ANY, ("stage.general",)),
+    CropRule(ANY, "general", ANY, ANY, ("stage.general",)),
+    CropRule(ANY, "sowing", "hot_weather", ANY, ("sowing.hot",)),
+    CropRule(ANY, "sowing", "rain_expected", ANY, ("sowing.rain",)),
+    CropRule(ANY, "flowering", "hot_weather", ANY, ("flowering.hot",)),
+    CropRule(ANY, "harvesting", "rain_expected", ANY, ("harvesting.rain",)),
+    CropRule("paddy", "sowing", ANY, "kharif", ("paddy.sowing.kharif",)),
+    CropRule("paddy", "vegetative", ANY, ANY, ("paddy.vegetative",)),
+    CropRule("paddy", "flowering", "humid", ANY, ("paddy.flowering.humid",)),
+    CropRule("wheat", "sowing", ANY, "rabi", ("wheat.sowing.rabi",)),
+    CropRule("wheat", "vegetative", "humid", ANY, ("wheat.vegetative.humid",)),
+    CropRule("wheat", "flowering", "hot_weather", ANY, ("wheat.flowering.hot",)),
+    CropRule("cotton", "vegetative", ANY, ANY, ("cotton.vegetative",)),
+    CropRule("cotton", "flowering", ANY, ANY, ("cotton.flowering",)),
+    CropRule("cotton", "harvesting", "rain_expected", ANY, ("cotton.harvesting.rain",)),
+    CropRule("sugarcane", "vegetative", "windy", ANY, ("sugarcane.vegetative.windy",)),
+    CropRule("maize", "sowing", "rain_expected", ANY, ("maize.sowing.rain",)),
+    CropRule("soybean", "vegetative", "rain_expected", ANY, ("soybean.vegetative.rain",)),
+    CropRule("groundnut", "harvesting", "rain_expected", ANY, ("groundnut.harvesting.rain",)),
+    CropRule("chickpea", "flowering", ANY, ANY, ("chickpea.flowering",)),
+)
+
+CROP_TIPS_PER_CROP = 2  # advice lines kept per crop, most specific first
+
+
+def current_season(today=None):
+    """Cropping season of a date: kharif (Jun-Oct), rabi (Nov-Mar) or zaid (Apr-May)."""
+    month = (today or date.today()).month
+    if 6 <= month <= 10:
+        return "kharif"
+    if month >= 11 or month <= 3:
+        return "rabi"
+    return "zaid"
+
+
+def advisory_crops(crops, today=None):
+    """
+    (crop, stage, season) per crop of a farmer (FarmerCrop rows or anything with crop_type/stage/season):
+    unknown stages become "general" and missing seasons the current one. Duplicates are dropped.
+    """
+    season_now = None
+    out = []
+    for c in crops or ():
+        stage = (c.stage or "").strip().lower()
+        season = (getattr(c, "season", None) or "").strip().lower()
+        if season not in SEASONS:
+            season = season_now = season_now or current_season(today)
+        out.append((c.crop_type or "crop", stage if stage in CROP_STAGES else "general", season))
+    return tuple(dict.fromkeys(out))
+
+
+def forecast_conditions(hits):
+    """Weather conditions of forecast rule hits ([(ForecastRule, day), ...]), strongest first."""
+    return tuple(dict.fromkeys(RULE_CONDITIONS[rule.id] for rule, _ in hits if rule.id in RULE_CONDITIONS))
+
+
+def _weather_rules(weather_advisory):
+    """Rows for the crop-specific lines of WEATHER_ADVISORY, with their texts."""
+    rules, texts = [], {}
+    for condition, entry in weather_advisory.items():
+        for crop, lines in entry.items():
+            if crop == "general":
+                continue
+            keys = []
+            for i, line in enumerate(lines):
+                key = f"weather.{condition}.{crop}.{i}"
+                texts[key] = line if line.endswith(".") else line + "."
+                keys.append(key)
+            rules.append(CropRule(crop, ANY, condition, ANY, tuple(keys)))
+    return rules, texts
+
+
+class CropAdviceIndex:
+    """CROP_STAGE_RULES plus WEATHER_ADVISORY expanded into {(crop, stage, condition, season): advice keys}."""
+
+    def __init__(self, rules=CROP_STAGE_RULES, weather_advisory=WEATHER_ADVISORY, per_crop=CROP_TIPS_PER_CROP):
+        weather_rules, self.texts = _weather_rules(weather_advisory)
+        self.texts.update(CROP_ADVICE)
+        rules = tuple(rules) + tuple(weather_rules)
+        self.crops = frozenset(CROP_TYPES) | {r.crop for r in rules if r.crop != ANY}
+        self.per_crop = per_crop
+        domains = {
+            "crop": tuple(self.crops) + (ANY,),  # ANY stands for crops without rules of their own
+            "stage": tuple(CROP_STAGES) + ("general",),
+            "season": tuple(SEASONS),
+        }
+        matched = {}
+        for order, rule in enumerate(rules):
+            missing = [k for k in rule.advice if k not in self.texts]
+            if missing:
+                raise ValueError(f"Unknown advice keys in crop rule: {missing}")
+            # Condition-specific advice first, then stage-, crop- and season-specific, then table order
+            rank = (rule.condition == ANY, rule.stage == ANY, rule.crop == ANY, rule.season == ANY, order)
+            for crop in domains["crop"] if rule.crop == ANY else (rule.crop,):
+                for stage in domains["stage"] if rule.stage == ANY else (rule.stage,):
+                    for season in domains["season"] if rule.season == ANY else (rule.season,):
+                        matched.setdefault((crop, stage, rule.condition, season), []).append((rank, rule.advice))
+        self.index = {
+            key: tuple(dict.fromkeys(k for _, advice in sorted(entries) for k in advice))
+            for key, entries in matched.items()
+        }
+
+    def lookup(self, crop, stage, condition, season):
+        """Advice keys for one concrete (crop, stage, condition, season); condition ANY = regardless of weather."""
+        return self.index.get((crop if crop in self.crops else ANY, stage, condition, season), ())
+
+    def crop_keys(self, crop, stage, season, conditions=()):
+        """Advice keys for one crop: one lookup per active condition plus the weather-independent one."""
+        crop = crop.strip().lower()
+        keys = []
+        for condition in conditions:
+            keys.extend(self.lookup(crop, stage, condition, season))
+        keys.extend(self.lookup(crop, stage, ANY, season))
+        return tuple(dict.fromkeys(keys))[:self.per_crop]
+
+    def advise(self, crops, conditions=()):
+        """[(crop, advice keys), ...] for advisory_crops() output under the given weather conditions."""
+        conditions = tuple(conditions)
+        return [(crop, self.crop_keys(crop, stage, season, conditions)) for crop, stage, season in crops]
+
+    def advise_batch(self, farmers):
+        """
+        advise() for many (crops, conditions) pairs, e.g. every farmer of a nightly run. Each distinct
+        (crop, stage, season, conditions) is resolved once and shared by all farmers that have it.
+        """
+        memo = {}
+        out = []
+        for crops, conditions in farmers:
+            conditions = tuple(conditions)
+            advice = []
+            for crop, stage, season in crops:
+                signature = (crop, stage, season, conditions)
+                keys = memo.get(signature)
+                if keys is None:
+                    keys = memo[signature] = self.crop_keys(crop, stage, season, conditions)
+                advice.append((crop, keys))
+            out.append(advice)
+        return out
+
+    def render(self, advice):
+        """One 'crop: advice' line per crop."""
+        return [f"{crop}: " + " ".join(self.texts[k] for k in keys) for crop, keys in advice if keys]
+
+
+_index = None
+
+
+def get_crop_advice_index():
+    global _index
+    if _index is None:
+        _index = CropAdviceIndex()
+    return _index
@@ -0,0 +1,237 @@
+# Asynchronous image diagnosis jobs
+# Image requests are stored as DiagnosisJob rows and answered by a bounded pool of worker threads, so a
+# 10-30 s vision call never holds a web worker. Jobs live in the database: a job whose worker died is
+# picked up again once its lease (DIAGNOSIS_JOB_TIMEOUT) expires, by this or any other process.
+
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from models import db, DiagnosisJob, ChatMessage
+from services.chatbot_engine import analyze_image_symptoms, RESPONSE_TEMPLATES
+
+logger = logging.getLogger(__name__)
+
+DIAGNOSIS_WORKERS = int(os.environ.get("DIAGNOSIS_WORKERS", "2"))  # 0 = this process does not run jobs
+DIAGNOSIS_POLL_INTERVAL = float(os.environ.get("DIAGNOSIS_POLL_INTERVAL", "2"))  # idle seconds between DB checks
+DIAGNOSIS_JOB_TIMEOUT = int(os.environ.get("DIAGNOSIS_JOB_TIMEOUT", "180"))  # running longer than this = orphaned
+DIAGNOSIS_MAX_ATTEMPTS = int(os.environ.get("DIAGNOSIS_MAX_ATTEMPTS", "3"))
+VISION_BACKEND = os.environ.get("VISION_BACKEND", "openai")  # "openai" or "fake"
+FAKE_VISION_DELAY = float(os.environ.get("FAKE_VISION_DELAY", "0"))
+
+
+def openai_vision_backend(message, lang, image_base64, farmer_id=None):
+    """GPT-4o Vision through the chatbot (falls back to the knowledge base when OpenAI is unavailable)."""
+    from services.pest_health_ai import get_pest_health_reply
+
+    return get_pest_health_reply(message, lang, image_base64, farmer_id=farmer_id)
+
+
+def fake_vision_backend(message, lang, image_base64, farmer_id=None):
+    """Offline, deterministic backend for tests and local development (VISION_BACKEND=fake)."""
+    if FAKE_VISION_DELAY:
+        time.sleep(FAKE_VISION_DELAY)
+    analysis = analyze_image_symptoms(message) or f"Received image ({len(image_base64 or '')} bytes); no symptoms described."
+    templates = RESPONSE_TEMPLATES.get(lang, RESPONSE_TEMPLATES["en"])
+    return templates["image_analysis"].format(analysis=analysis)
+
+
+VISION_BACKENDS = {
+    "openai": openai_vision_backend,
+    "fake": fake_vision_backend,
+}
+
+_backend = None
+
+
+def set_vision_backend(backend):
+    """Use a backend by name (see VISION_BACKENDS) or any callable(message, lang, image_base64, farmer_id=None)."""
+    global _backend
+    _backend = VISION_BACKENDS[backend] if isinstance(backend, str) else backend
+
+
+def get_vision_backend():
+    if _backend is None:
+        set_vision_backend(VISION_BACKEND)
+    return _backend
+
+
+def job_to_dict(job):
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "reply": job.result,
+        "error": job.error if job.status == "failed" else None,
+        "attempts": job.attempts,
+        "language": job.language_code,
+        "conversation_id": job.session_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def enqueue_diagnosis(image_base64, message, lang, farmer_id=None, session_id=None):
+    """Store a queued job (commits) and wake the local workers. Returns the DiagnosisJob."""
+    job = DiagnosisJob(
+        id=uuid.uuid4().hex,
+        status="queued",
+        farmer_id=farmer_id,
+        session_id=session_id,
+        language_code=lang,
+        message=message or "",
+        image=image_base64,
+    )
+    db.session.add(job)
+    db.session.commit()
+    if _pool is not None:
+        _pool.notify()
+    return job
+
+
+def _orphaned():
+    stale = datetime.utcnow() - timedelta(seconds=DIAGNOSIS_JOB_TIMEOUT)
+    return db.and_(DiagnosisJob.status == "running", DiagnosisJob.started_at < stale)
+
+
+def _claimable():
+    return db.or_(
+        DiagnosisJob.status == "queued",
+        db.and_(_orphaned(), DiagnosisJob.attempts < DIAGNOSIS_MAX_ATTEMPTS),
+    )
+
+
+def fail_orphaned_jobs():
+    """
+    Mark orphaned running jobs that used up DIAGNOSIS_MAX_ATTEMPTS as failed (e.g. a photo that crashes
+    the worker every time) instead of leaving them running forever. Returns the number failed.
+    """
+    failed = (
+        DiagnosisJob.query.filter(_orphaned(), DiagnosisJob.attempts >= DIAGNOSIS_MAX_ATTEMPTS)
+        .update(
+            {"status": "failed", "image": None, "finished_at": datetime.utcnow(),
+             "error": "Worker stopped while processing the image"},
+            synchronize_session=False,
+        )
+    )
+    db.session.commit()
+    if failed:
+        logger.warning("Failed %d orphaned diagnosis jobs after %d attempts", failed, DIAGNOSIS_MAX_ATTEMPTS)
+    return failed
+
+
+def claim_next_job():
+    """
+    Atomically mark the oldest queued (or orphaned running, attempts left) job as running and return its id.
+    The conditional UPDATE makes the claim safe across threads and processes. When nothing is claimable,
+    orphans out of attempts are failed.
+    """
+    candidates = (
+        db.session.query(DiagnosisJob.id)
+        .filter(_claimable())
+        .order_by(DiagnosisJob.created_at)
+        .limit(5)
+        .all()
+    )
+    for (job_id,) in candidates:
+        claimed = (
+            DiagnosisJob.query.filter(DiagnosisJob.id == job_id, _claimable())
+            .update(
+                {"status": "running", "started_at": datetime.utcnow(), "attempts": DiagnosisJob.attempts + 1},
+                synchronize_session=False,
+            )
+        )
+        db.session.commit()
+        if claimed:
+            return job_id
+    if not candidates:
+        fail_orphaned_jobs()
+    return None
+
+
+def run_job(job_id):
+    """Run one claimed job through the vision backend and store the reply (also as a chat message)."""
+    job = db.session.get(DiagnosisJob, job_id)
+    if job is None:
+        return None
+    started = time.perf_counter()
+    try:
+        reply = get_vision_backend()(job.message, job.language_code, job.image, farmer_id=job.farmer_id)
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(DiagnosisJob, job_id)
+        job.error = str(e)[:255]
+        if job.attempts >= DIAGNOSIS_MAX_ATTEMPTS:
+            job.status = "failed"
+            job.image = None
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = "queued"
+        db.session.commit()
+        logger.warning("Diagnosis job %s attempt %s failed: %s", job_id, job.attempts, e)
+        return job
+    job.status = "done"
+    job.result = reply
+    job.image = None
+    job.finished_at = datetime.utcnow()
+    if reply and job.session_id:
+        db.session.add(ChatMessage(session_id=job.session_id, is_user=False, text=reply, language_code=job.language_code))
+    db.session.commit()
+    logger.info("Diagnosis job %s done in %.0f ms", job_id, (time.perf_counter() - started) * 1000)
+    return job
+
+
+class DiagnosisWorkerPool:
+    """Daemon threads that claim and run jobs; woken on enqueue, otherwise polling the table."""
+
+    def __init__(self, app, workers=DIAGNOSIS_WORKERS, poll_interval=DIAGNOSIS_POLL_INTERVAL):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"diagnosis-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            job_id = None
+            try:
+                with self.app.app_context():
+                    job_id = claim_next_job()
+                    if job_id:
+                        run_job(job_id)
+            except Exception as e:
+                logger.warning("Diagnosis worker error: %s", e)
+            if job_id is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+
+_pool = None
+
+
+def start_diagnosis_workers(app, workers=DIAGNOSIS_WORKERS):
+    """Start this process's worker pool once (no-op when workers is 0)."""
+    global _pool
+    if _pool is None and workers > 0:
+        _pool = DiagnosisWorkerPool(app, workers).start()
+        logger.info("Diagnosis workers started (%s threads, backend=%s)", workers, VISION_BACKEND)
+    return _pool
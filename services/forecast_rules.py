@@ -0,0 +1,192 @@
+# Forecast alert rules - declarative thresholds evaluated over every geo-cell at once
+# Daily forecasts of all cells are packed into (cell x day) float32 arrays. Each rule is a list of
+# (field, op, value) conditions over a day window; all conditions of all rules are compared in one broadcast
+# per (field, op) and ANDed per rule by gathering condition rows, giving (cell, rule, day) hits for the SMS
+# alerts (services/alert_scheduler.py) and the advisory card (services/advisory.py).
+
+import operator
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Daily forecast fields (keys of the "daily" dict from services.weather) usable in rules
+FORECAST_FIELDS = (
+    "temperature_2m_max",
+    "temperature_2m_min",
+    "precipitation_sum",
+    "wind_speed_10m_max",
+    "relative_humidity_2m_max",
+    "weather_code",
+)
+
+_OPS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "==": operator.eq,
+}
+
+STORM_CODES = (95, 96, 99)  # WMO thunderstorm codes
+
+# id, kind (SMS idempotency type), severity (higher wins), conditions, days (first, last) of the forecast,
+# min_days (hit days needed in the window), sms (send as an alert), message, i18n (common.json key or None)
+ForecastRule = namedtuple("ForecastRule", "id kind severity conditions days min_days sms message i18n")
+
+RuleHits = namedtuple("RuleHits", "cell rule day")  # parallel index arrays, sorted by cell
+
+DEFAULT_RULES = (
+    ForecastRule("storm", "weather:storm", 90, [("weather_code", ">=", STORM_CODES[0])], (0, 1), 1, True,
+                 "Storm likely. Keep crops and yourself safe.", "weather_alert.stormy"),
+    ForecastRule("heavy_rain", "weather:heavy_rain", 80, [("precipitation_sum", ">=", 50)], (0, 1), 1, True,
+                 "Heavy rain expected. Clear field drainage and postpone fertilizer and spraying.", "weather_alert.heavy_rain"),
+    ForecastRule("extreme_heat", "weather:heat", 70, [("temperature_2m_max", ">=", 43)], (0, 1), 1, True,
+                 "Extreme heat. Ensure water and shade.", "weather_alert.extreme_heat"),
+    ForecastRule("cold", "weather:cold", 70, [("temperature_2m_min", "<=", 1)], (0, 1), 1, True,
+                 "Cold conditions. Protect sensitive crops.", "weather_alert.extreme_cold"),
+    ForecastRule("heatwave", "weather:heatwave", 60, [("temperature_2m_max", ">=", 40)], (0, 2), 2, True,
+                 "Heatwave over the next days. Irrigate in the evening and mulch to keep soil moist.", "weather_alert.heatwave"),
+    ForecastRule("rain", "weather:rain", 50, [("precipitation_sum", ">=", 10)], (0, 1), 1, True,
+                 "Rain expected. Reduce irrigation, check drainage.", "weather_alert.rainy"),
+    ForecastRule("high_wind", "weather:wind", 40, [("wind_speed_10m_max", ">=", 40)], (0, 1), 1, False,
+                 "Strong winds forecast. Avoid spraying and stake tall crops.", "weather_alert.high_wind"),
+    ForecastRule("fungal_risk", "weather:fungal", 30,
+                 [("relative_humidity_2m_max", ">=", 90), ("temperature_2m_max", ">=", 20), ("temperature_2m_max", "<=", 32)],
+                 (0, 2), 2, False, "Humid, warm days ahead: high fungal disease risk. Scout leaves and keep canopy open.",
+                 "weather_alert.fungal_risk"),
+    ForecastRule("dry_spell", "weather:dry", 20, [("precipitation_sum", "<", 1), ("temperature_2m_max", ">=", 35)],
+                 (0, 2), 3, False, "Hot and dry for the next days. Plan irrigation.", "weather_alert.dry_spell"),
+)
+
+
+class ForecastGrid:
+    """Daily forecasts of many cells as float32 arrays of shape (n_cells, n_days); NaN where missing."""
+
+    def __init__(self, cells, fields):
+        self.cells = list(cells)
+        self.fields = fields
+        self.n_days = next(iter(fields.values())).shape[1] if fields else 0
+
+    @classmethod
+    def from_forecasts(cls, forecasts, days=None):
+        """forecasts: {cell: forecast dict from services.weather} (errored entries become all-NaN rows)."""
+        cells = list(forecasts)
+        daily = [(f or {}).get("daily") or {} for f in forecasts.values()]
+        if days is None:
+            days = max((len(d.get("time") or []) for d in daily), default=0)
+        fields = {}
+        for name in FORECAST_FIELDS:
+            arr = np.full((len(cells), days), np.nan, dtype=np.float32)
+            for i, d in enumerate(daily):
+                values = (d.get(name) or [])[:days]
+                if values:
+                    arr[i, :len(values)] = np.array(values, dtype=np.float32)  # None -> NaN
+            fields[name] = arr
+        return cls(cells, fields)
+
+
+class CompiledRules:
+    """
+    Rules compiled for vectorized evaluation: conditions grouped by (field, op) with their thresholds as one
+    vector, a (rules x max conditions) table of condition rows to AND (padded with an all-true row), and
+    per-rule day windows.
+    """
+
+    def __init__(self, rules=DEFAULT_RULES):
+        self.rules = tuple(rules)
+        groups = {}
+        per_rule = []
+        for rule in self.rules:
+            if not rule.conditions:
+                raise ValueError(f"Rule {rule.id} needs at least one condition")
+            keys = []
+            for field, op, value in rule.conditions:
+                if field not in FORECAST_FIELDS or op not in _OPS:
+                    raise ValueError(f"Unsupported rule condition: {field} {op}")
+                thresholds = groups.setdefault((field, op), {})
+                keys.append((field, op, thresholds.setdefault(float(value), len(thresholds))))
+            per_rule.append(keys)
+        # Condition rows in evaluation order: each (field, op) group's distinct thresholds, then the padding row
+        self.groups, offsets = [], {}
+        row = 0
+        for (field, op), thresholds in groups.items():
+            offsets[field, op] = row
+            values = sorted(thresholds, key=thresholds.get)
+            self.groups.append((field, _OPS[op], np.array(values, dtype=np.float32)[:, None, None]))
+            row += len(values)
+        width = max((len(k) for k in per_rule), default=1)
+        self.condition_rows = np.full((len(self.rules), width), row, dtype=np.int64)
+        for r, keys in enumerate(per_rule):
+            self.condition_rows[r, :len(keys)] = [offsets[field, op] + i for field, op, i in keys]
+        self.windows = np.array([r.days for r in self.rules], dtype=np.int64).reshape(-1, 2)
+        self.min_days = np.array([r.min_days for r in self.rules], dtype=np.int64)
+
+    def evaluate(self, grid):
+        """(cell, rule, day) index arrays of every rule hit, ordered by cell then rule then day."""
+        n_cells, n_days = len(grid.cells), grid.n_days
+        if not n_cells or not n_days or not self.rules:
+            empty = np.zeros(0, dtype=np.int64)
+            return RuleHits(empty, empty, empty)
+        # (conditions + 1, cells, days): one broadcast comparison per (field, op); NaN compares False
+        masks = np.concatenate(
+            [op(grid.fields[field][None, :, :], thresholds) for field, op, thresholds in self.groups]
+            + [np.ones((1, n_cells, n_days), dtype=bool)]
+        )
+        per_rule = masks[self.condition_rows[:, 0]]  # (rules, cells, days)
+        for j in range(1, self.condition_rows.shape[1]):
+            per_rule &= masks[self.condition_rows[:, j]]
+        day = np.arange(n_days)
+        per_rule &= ((day >= self.windows[:, :1]) & (day <= self.windows[:, 1:]))[:, None, :]
+        if (self.min_days > 1).any():
+            hit_days = per_rule.view(np.uint8).sum(axis=2, dtype=np.uint8)  # (rules, cells)
+            per_rule &= (hit_days >= self.min_days[:, None])[:, :, None]
+        # Cell-major copy so flat indices come out ordered by cell, rule, day
+        by_cell = np.ascontiguousarray(per_rule.transpose(1, 0, 2))
+        cell, rule, day = np.unravel_index(np.flatnonzero(by_cell), by_cell.shape)
+        return RuleHits(cell, rule, day)
+
+    def hits_by_cell(self, grid):
+        """{cell: [(ForecastRule, day), ...]} strongest rule first (then earliest day)."""
+        hits = self.evaluate(grid)
+        out = {}
+        for c, r, d in zip(hits.cell.tolist(), hits.rule.tolist(), hits.day.tolist()):
+            out.setdefault(grid.cells[c], []).append((self.rules[r], d))
+        for matches in out.values():
+            matches.sort(key=lambda m: (-m[0].severity, m[1]))
+        return out
+
+
+_compiled = None
+
+
+def get_forecast_rules():
+    global _compiled
+    if _compiled is None:
+        _compiled = CompiledRules(DEFAULT_RULES)
+    return _compiled
+
+
+def evaluate_forecasts(forecasts):
+    """{cell: [(ForecastRule, day), ...]} for a {cell: forecast} mapping, strongest rule first."""
+    rules = get_forecast_rules()
+    return rules.hits_by_cell(ForecastGrid.from_forecasts(forecasts))
+
+
+def forecast_date(forecast, day):
+    """Date (YYYY-MM-DD) of forecast day `day`: the forecast's own daily time, else counted from today (UTC)."""
+    times = ((forecast or {}).get("daily") or {}).get("time") or []
+    if day < len(times) and times[day]:
+        return str(times[day])
+    return (datetime.utcnow().date() + timedelta(days=day)).isoformat()
+
+
+def forecast_alerts(forecasts):
+    """{cell: (kind, SMS text, forecast date of the hit) or None}: the strongest SMS-worthy rule hit per cell."""
+    out = {}
+    for cell, matches in evaluate_forecasts(forecasts).items():
+        for rule, day in matches:
+            if rule.sms:
+                out[cell] = (rule.kind, f"KRISHSAATHI: {rule.message}", forecast_date(forecasts[cell], day))
+                break
+    return {cell: out.get(cell) for cell in forecasts}
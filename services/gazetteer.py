@@ -0,0 +1,256 @@
+# Offline gazetteer: state / district / village -> lat, lon
+# Bundled CSV (data/gazetteer.csv) of district headquarters and known villages, with Latin and Indic aliases.
+# Lookups are in-memory dict/bisect operations so they can run on every request and in the alert scheduler.
+
+import csv
+import os
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+
+from config import GAZETTEER_CSV, INDIAN_STATES
+
+# level: "village", "district" or "state" (state = centroid of its districts)
+Location = namedtuple("Location", "lat lon level state_code district village")
+
+# Native-script and common alternate names for the profile state codes in config.INDIAN_STATES
+STATE_ALIASES = {
+    "AP": ["आंध्र प्रदेश", "ఆంధ్ర ప్రదేశ్", "Andhra"],
+    "TG": ["Telangana", "तेलंगाना", "తెలంగాణ", "TS"],
+    "KA": ["कर्नाटक", "ಕರ್ನಾಟಕ"],
+    "TN": ["तमिलनाडु", "தமிழ்நாடு"],
+    "KL": ["केरल", "കേരളം"],
+    "MH": ["महाराष्ट्र"],
+    "GJ": ["गुजरात", "ગુજરાત"],
+    "RJ": ["राजस्थान"],
+    "MP": ["मध्य प्रदेश"],
+    "UP": ["उत्तर प्रदेश"],
+    "WB": ["पश्चिम बंगाल", "পশ্চিমবঙ্গ", "Bengal"],
+    "BH": ["बिहार", "BR"],
+    "PB": ["पंजाब", "ਪੰਜਾਬ"],
+    "HR": ["हरियाणा"],
+    "OR": ["ओडिशा", "ଓଡ଼ିଶା", "Orissa", "OD"],
+    "AS": ["असम", "অসম"],
+    "MN": ["मणिपुर"],
+}
+
+# Words farmers add around a place name ("Ludhiana district", "जिला पटना")
+_NOISE_WORDS = {"district", "dist", "zila", "jila", "zilla", "जिला", "village", "gaon", "गांव", "गाव"}
+
+# Latin spelling variants collapsed for fuzzy matching (Ludhiyana -> Ludhiana, Nasik -> Nashik)
+_PHONETIC_RULES = [
+    ("aa", "a"), ("ee", "i"), ("ii", "i"), ("oo", "u"), ("uu", "u"), ("ou", "u"),
+    ("ph", "f"), ("sh", "s"), ("kh", "k"), ("gh", "g"), ("th", "t"), ("dh", "d"), ("bh", "b"),
+    ("ch", "c"), ("jh", "j"), ("w", "v"), ("z", "j"), ("q", "k"), ("ck", "k"), ("iy", "i"), ("y", "i"),
+]
+
+
+def normalize_name(text):
+    """Case-, accent- and punctuation-insensitive key; Indic scripts are kept (nukta/chandrabindu folded)."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = text.replace("़", "").replace("ँ", "ं").replace("‌", "").replace("‍", "")
+    # Drop Latin combining accents but keep Indic vowel signs (also category Mn)
+    text = "".join(c for c in text if not (unicodedata.category(c) == "Mn" and ord(c) < 0x0900))
+    text = unicodedata.normalize("NFC", text).casefold()
+    words = [w for w in re.split(r"[\s,.\-/()]+", text) if w and w not in _NOISE_WORDS]
+    # Keep letters, marks (Indic vowel signs) and digits only
+    return "".join(c for w in words for c in w if unicodedata.category(c)[0] in "LMN")
+
+
+def phonetic_key(key):
+    """Coarse spelling-variant key for Latin names; Indic keys are returned unchanged."""
+    if not key.isascii():
+        return key
+    for src, dst in _PHONETIC_RULES:
+        key = key.replace(src, dst)
+    key = re.sub(r"h", "", key)
+    key = re.sub(r"(.)\1+", r"\1", key)
+    return key.rstrip("a") or key
+
+
+def _within_distance(a, b, limit):
+    """Levenshtein distance <= limit, with early exit once every cell in a row exceeds it."""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return False
+        prev = cur
+    return prev[-1] <= limit
+
+
+class Gazetteer:
+    """In-memory index over gazetteer rows: exact, phonetic, prefix and bounded fuzzy matching."""
+
+    def __init__(self, rows):
+        self.states = {}      # normalized state name/code -> state code
+        self.districts = {}   # (state_code, key) -> Location; key is any normalized name or alias
+        self.villages = {}    # (state_code, district, key) -> Location
+        self.by_key = {}      # key -> [Location] across states, for farmers without a state
+        self.phonetic = {}    # (state_code, phonetic key) -> Location
+        self._sorted = {}     # state_code or None -> sorted [(key, Location)] for prefix search
+        self._state_sums = {}
+
+        for code, name in INDIAN_STATES:
+            for alias in [code, name] + STATE_ALIASES.get(code, []):
+                self.states[normalize_name(alias)] = code
+
+        for row in rows:
+            code = (row.get("state_code") or "").strip().upper()
+            district = (row.get("district") or "").strip()
+            village = (row.get("village") or "").strip()
+            try:
+                lat, lon = float(row["lat"]), float(row["lon"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            names = [village or district] + [a for a in (row.get("aliases") or "").split("|") if a.strip()]
+            keys = {normalize_name(n) for n in names} - {""}
+            if village:
+                loc = Location(lat, lon, "village", code, district, village)
+                for key in keys:
+                    self.villages[(code, normalize_name(district), key)] = loc
+                continue
+            loc = Location(lat, lon, "district", code, district, None)
+            for key in keys:
+                self.districts[(code, key)] = loc
+                self.by_key.setdefault(key, []).append(loc)
+                self.phonetic.setdefault((code, phonetic_key(key)), loc)
+                self.phonetic.setdefault((None, phonetic_key(key)), loc)
+                self._sorted.setdefault(code, []).append((key, loc))
+                self._sorted.setdefault(None, []).append((key, loc))
+            s = self._state_sums.setdefault(code, [0.0, 0.0, 0])
+            s[0] += lat
+            s[1] += lon
+            s[2] += 1
+        for entries in self._sorted.values():
+            entries.sort(key=lambda e: e[0])
+        self._sorted_keys = {code: [k for k, _ in entries] for code, entries in self._sorted.items()}
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls(list(csv.DictReader(f)))
+
+    def __len__(self):
+        return len({loc for loc in self.districts.values()}) + len(set(self.villages.values()))
+
+    def resolve_state(self, state):
+        key = normalize_name(state)
+        if not key:
+            return None
+        code = self.states.get(key)
+        if code:
+            return code
+        for name, code in self.states.items():
+            if len(key) >= 5 and _within_distance(key, name, 2):
+                return code
+        return None
+
+    def search(self, prefix, state=None, limit=10):
+        """Districts whose name or alias starts with prefix (autocomplete), deduplicated."""
+        key = normalize_name(prefix)
+        code = self.resolve_state(state) if state else None
+        keys = self._sorted_keys.get(code, [])
+        entries = self._sorted.get(code, [])
+        out = []
+        i = bisect_left(keys, key)
+        while i < len(keys) and keys[i].startswith(key) and len(out) < limit:
+            if entries[i][1] not in out:
+                out.append(entries[i][1])
+            i += 1
+        return out
+
+    def resolve_district(self, district, code=None):
+        key = normalize_name(district)
+        if not key:
+            return None
+        if code:
+            loc = self.districts.get((code, key))
+            if loc:
+                return loc
+        else:
+            matches = {loc for loc in self.by_key.get(key, [])}
+            if len(matches) == 1:
+                return matches.pop()
+        loc = self.phonetic.get((code, phonetic_key(key)))
+        if loc:
+            return loc
+        if len(key) >= 3:
+            matches = {loc for loc in self.search(district, state=code, limit=5)}
+            if len(matches) == 1:
+                return matches.pop()
+        if len(key) >= 4:
+            limit = 1 if len(key) < 7 else 2
+            for cand, loc in self._sorted.get(code, []):
+                if _within_distance(key, cand, limit):
+                    return loc
+        return None
+
+    def resolve(self, state=None, district=None, village=None):
+        """Best Location for free-text profile fields: village, else district, else state centroid."""
+        code = self.resolve_state(state) if state else None
+        loc = self.resolve_district(district, code) if district else None
+        if loc and village:
+            v = self.villages.get((loc.state_code, normalize_name(loc.district), normalize_name(village)))
+            if v:
+                return v
+        if loc:
+            return loc
+        if code and code in self._state_sums:
+            lat_sum, lon_sum, n = self._state_sums[code]
+            return Location(round(lat_sum / n, 4), round(lon_sum / n, 4), "state", code, None, None)
+        return None
+
+
+_gazetteer = None
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        path = os.environ.get("GAZETTEER_CSV") or GAZETTEER_CSV
+        try:
+            _gazetteer = Gazetteer.from_csv(path)
+        except OSError:
+            _gazetteer = Gazetteer([])
+    return _gazetteer
+
+
+@lru_cache(maxsize=8192)
+def resolve_location(state=None, district=None, village=None):
+    """Memoized Gazetteer.resolve for (state, district, village) strings; None if unknown."""
+    return get_gazetteer().resolve(state, district, village)
+
+
+def location_key(farmer):
+    """Normalized profile location; stored with the coordinates to detect profile edits."""
+    return "|".join(normalize_name(getattr(farmer, f, None)) for f in ("state", "district", "village"))[:255]
+
+
+def geocode_farmer(farmer, force=False):
+    """Resolve and cache coordinates on the farmer row (caller commits). Returns True if changed."""
+    key = location_key(farmer)
+    if not force and farmer.geo_key == key:
+        return False
+    loc = resolve_location(farmer.state or None, farmer.district or None, farmer.village or None)
+    farmer.lat = loc.lat if loc else None
+    farmer.lon = loc.lon if loc else None
+    farmer.geo_level = loc.level if loc else None
+    farmer.geo_key = key
+    return True
+
+
+def farmer_coordinates(farmer):
+    """(lat, lon) for a farmer from the cached row, else resolved on the fly; (None, None) if unknown."""
+    if farmer is None:
+        return None, None
+    if farmer.lat is not None and farmer.geo_key == location_key(farmer):
+        return farmer.lat, farmer.lon
+    loc = resolve_location(farmer.state or None, farmer.district or None, farmer.village or None)
+    return (loc.lat, loc.lon) if loc else (None, None)
@@ -0,0 +1,160 @@
+# Shared pooled HTTP clients for upstream APIs (Open-Meteo, data.gov.in, OpenAI)
+# One keep-alive connection pool per host, reused across requests and scheduler runs,
+# so repeated calls skip DNS + TCP + TLS handshakes.
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", "10"))  # number of per-host pools kept
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "20"))  # keep-alive connections per host
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", "0.5"))  # sleeps 0.5s, 1s, 2s ... between retries
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+_sessions = {}  # read retries -> Session
+_session_lock = threading.Lock()
+_openai_http_client = None
+_openai_stats = {"requests": 0, "reused": 0}
+
+
+def _build_session(read_retries):
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=read_retries,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = "KRISHSAATHI/1.0"
+    return session
+
+
+def get_session(read_retries=HTTP_RETRIES):
+    """Process-wide requests.Session with per-host keep-alive pools and retry-with-backoff."""
+    session = _sessions.get(read_retries)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(read_retries)
+            if session is None:
+                session = _sessions[read_retries] = _build_session(read_retries)
+    return session
+
+
+def get_json(url, params=None, timeout=None):
+    """
+    GET url and decode JSON. timeout is the read timeout (connect timeout is HTTP_CONNECT_TIMEOUT).
+    Calls with a read timeout above HTTP_READ_TIMEOUT (batch forecasts, mandi pages) are not retried after
+    a read error, so they give up after about one timeout; connect errors and 429/5xx are still retried.
+    Raises requests.RequestException (an OSError) or a JSON decode error (a ValueError).
+    """
+    read_timeout = timeout or HTTP_READ_TIMEOUT
+    session = get_session(HTTP_RETRIES if read_timeout <= HTTP_READ_TIMEOUT else 0)
+    resp = session.get(url, params=params, timeout=(HTTP_CONNECT_TIMEOUT, read_timeout))
+    resp.raise_for_status()
+    return resp.json()
+
+
+class _ConnectionTrace:
+    """
+    httpcore trace callback for one request: records whether the pool opened a TCP connection for it
+    (no connect event = an idle keep-alive connection was reused). Chains to a trace set by the caller.
+    """
+
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.connected = False
+
+    def __call__(self, event_name, info):
+        if event_name.startswith("connection.connect_tcp."):
+            self.connected = True
+        if self.inner is not None:
+            self.inner(event_name, info)
+
+
+def get_openai_http_client():
+    """
+    Pooled httpx client for the OpenAI SDK (which uses httpx rather than requests).
+    Returns None when httpx is unavailable so the SDK falls back to its own client.
+    """
+    global _openai_http_client
+    if _openai_http_client is not None:
+        return _openai_http_client
+    try:
+        import httpx
+    except ImportError:
+        return None
+
+    def _on_request(request):
+        request.extensions["trace"] = _ConnectionTrace(request.extensions.get("trace"))
+
+    def _on_response(response):
+        trace = response.request.extensions.get("trace")
+        with _session_lock:
+            _openai_stats["requests"] += 1
+            if isinstance(trace, _ConnectionTrace) and not trace.connected:
+                _openai_stats["reused"] += 1
+
+    with _session_lock:
+        if _openai_http_client is None:
+            _openai_http_client = httpx.Client(
+                timeout=httpx.Timeout(60.0, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_MAXSIZE,
+                    max_keepalive_connections=HTTP_POOL_MAXSIZE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                event_hooks={"request": [_on_request], "response": [_on_response]},
+            )
+    return _openai_http_client
+
+
+def get_pool_stats():
+    """Per-host connection pool statistics: active/idle connections, requests and reuse ratio."""
+    hosts = []
+    for read_retries, session in list(_sessions.items()):
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                queue = list(pool.pool.queue) if pool.pool is not None else []
+                idle = sum(1 for c in queue if c is not None)
+                requests_made = pool.num_requests
+                hosts.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "read_retries": read_retries,
+                    "active": pool.pool.maxsize - len(queue) if pool.pool is not None else 0,
+                    "idle": idle,
+                    "connections_opened": pool.num_connections,
+                    "requests": requests_made,
+                    "reuse_ratio": round(1 - pool.num_connections / requests_made, 4) if requests_made else 0.0,
+                })
+    openai_pool = None
+    if _openai_http_client is not None:
+        conns = []
+        try:
+            conns = list(_openai_http_client._transport._pool.connections)
+        except AttributeError:
+            pass
+        idle = sum(1 for c in conns if c.is_idle())
+        total = _openai_stats["requests"]
+        openai_pool = {
+            "active": len(conns) - idle,
+            "idle": idle,
+            "requests": total,
+            "reuse_ratio": round(_openai_stats["reused"] / total, 4) if total else 0.0,
+        }
+    return {"hosts": hosts, "openai": openai_pool}
@@ -0,0 +1,176 @@
+# Perceptual-hash dedupe cache for crop image diagnoses
+# A re-sent photo (network retry, or the same field shot by a neighbour) hashes to the same or a nearby
+# 64-bit dHash, so a recent diagnosis in the same language, asked with the same question, is reused instead
+# of making another vision call.
+
+import base64
+import binascii
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+IMAGE_CACHE_TTL = int(os.environ.get("IMAGE_CACHE_TTL", "86400"))  # seconds a diagnosis is reused
+IMAGE_CACHE_MAX_DISTANCE = int(os.environ.get("IMAGE_CACHE_MAX_DISTANCE", "6"))  # Hamming bits out of 64
+
+
+def dhash(image, size=8):
+    """64-bit difference hash: brightness gradients between neighbouring cells of a 9x8 grayscale thumbnail."""
+    if image.format == "JPEG":
+        image.draft("L", (size * 8, size * 8))
+    small = np.asarray(image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def image_hash(image_base64):
+    """dHash of a base64 image (data URI prefix allowed), or None if it cannot be decoded."""
+    data = image_base64 or ""
+    if "," in data[:100]:
+        data = data.split(",", 1)[1]
+    try:
+        return dhash(Image.open(io.BytesIO(base64.b64decode(data))))
+    except (binascii.Error, ValueError, UnidentifiedImageError, OSError):
+        return None
+
+
+def question_hash(question):
+    """64-bit hash of an already normalized question ("" for a photo sent without text)."""
+    return int.from_bytes(hashlib.blake2b((question or "").encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def hamming_distances(hashes, phash):
+    """Bit differences between each uint64 in hashes and phash (np.bitwise_count needs NumPy 2, so unpack bits)."""
+    diff = np.ascontiguousarray(hashes ^ np.uint64(phash))
+    return np.unpackbits(diff.view(np.uint8)).reshape(-1, 64).sum(axis=1, dtype=np.int64)
+
+
+class _Entry:
+    __slots__ = ("slot", "reply", "created", "hits")
+
+    def __init__(self, slot, reply, created):
+        self.slot = slot
+        self.reply = reply
+        self.created = created
+        self.hits = 0
+
+
+class ImageDiagnosisCache:
+    """
+    Bounded LRU of diagnoses keyed by (language, question hash, dHash) with TTL. Hashes sit in preallocated
+    uint64 arrays, so a near-duplicate lookup is one XOR + popcount over the slots of that language and question.
+    """
+
+    def __init__(self, max_entries=IMAGE_CACHE_MAX_ENTRIES, ttl=IMAGE_CACHE_TTL, max_distance=IMAGE_CACHE_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # (lang, question hash, hash) -> _Entry, least recently used first
+        self._hashes = np.zeros(max_entries, dtype=np.uint64)
+        self._questions = np.zeros(max_entries, dtype=np.uint64)
+        self._slot_lang = np.full(max_entries, -1, dtype=np.int64)  # language id per slot, -1 = free
+        self._slot_keys = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._langs = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._distance_total = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._slot_lang[entry.slot] = -1
+        self._slot_keys[entry.slot] = None
+        self._free.append(entry.slot)
+
+    def get(self, phash, lang, qhash=0):
+        """(reply, distance) for the nearest unexpired entry of the same question within max_distance, else None."""
+        now = time.monotonic()
+        with self._lock:
+            lang_id = self._langs.get(lang)
+            if lang_id is not None:
+                slots = np.flatnonzero((self._slot_lang == lang_id) & (self._questions == np.uint64(qhash)))
+                if len(slots):
+                    distances = hamming_distances(self._hashes[slots], phash)
+                    for i in np.argsort(distances, kind="stable"):
+                        if distances[i] > self.max_distance:
+                            break
+                        key = self._slot_keys[slots[i]]
+                        entry = self._entries[key]
+                        if now - entry.created > self.ttl:
+                            self._remove(key)
+                            self.expired += 1
+                            continue
+                        entry.hits += 1
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        self._distance_total += int(distances[i])
+                        return entry.reply, int(distances[i])
+            self.misses += 1
+            return None
+
+    def put(self, phash, lang, reply, qhash=0):
+        if not reply or self.max_entries <= 0:
+            return
+        key = (lang, qhash, phash)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if not self._free:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            slot = self._free.pop()
+            self._hashes[slot] = np.uint64(phash)
+            self._questions[slot] = np.uint64(qhash)
+            self._slot_lang[slot] = self._langs.setdefault(lang, len(self._langs))
+            self._slot_keys[slot] = key
+            self._entries[key] = _Entry(slot, reply, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "avg_hit_distance": round(self._distance_total / self.hits, 2) if self.hits else 0.0,
+            }
+
+
+def get_cached_diagnosis(phash, lang, question=""):
+    """Reply text of a recent diagnosis of the same (or a visually near-identical) image and question, else None."""
+    if phash is None:
+        return None
+    hit = _image_cache.get(phash, lang, question_hash(question))
+    return hit[0] if hit else None
+
+
+def cache_diagnosis(phash, lang, reply, question=""):
+    if phash is not None:
+        _image_cache.put(phash, lang, reply, question_hash(question))
+
+
+def get_image_cache_stats():
+    return _image_cache.stats()
+
+
+_image_cache = ImageDiagnosisCache()
@@ -0,0 +1,175 @@
+# Image preprocessing for vision calls
+# Phone photos arrive as multi-megabyte base64 strings. Each one is decoded once, checked against size
+# limits, auto-oriented, stripped of EXIF, downscaled and re-encoded as JPEG within a byte budget before it
+# is stored for diagnosis and sent to the vision model.
+
+import base64
+import binascii
+import io
+import os
+import threading
+import time
+from collections import namedtuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1024"))  # px, longest side after downscaling
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_MIN_QUALITY = int(os.environ.get("IMAGE_MIN_QUALITY", "50"))
+IMAGE_TARGET_BYTES = int(os.environ.get("IMAGE_TARGET_BYTES", str(250 * 1024)))  # quality is lowered until under this
+IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get("IMAGE_MAX_UPLOAD_BYTES", str(12 * 1024 * 1024)))  # decoded upload
+# Largest multipart image request: the file plus room for the boundaries and the other form fields
+IMAGE_MAX_UPLOAD_REQUEST = IMAGE_MAX_UPLOAD_BYTES + 64 * 1024
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", str(50_000_000)))  # guards against decompression bombs
+
+# Leading bytes of the formats Pillow can decode here; the client's Content-Type is not trusted
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+PreparedImage = namedtuple("PreparedImage", "data width height quality bytes_in bytes_out ms")
+
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "rejected": 0, "bytes_in": 0, "bytes_out": 0, "ms": 0.0}
+
+
+class ImageRejected(ValueError):
+    """The upload is not a usable image or exceeds the configured limits; str(e) is shown to the user."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _reject(message, status_code=400):
+    with _stats_lock:
+        _stats["rejected"] += 1
+    raise ImageRejected(message, status_code)
+
+
+def _reject_too_large():
+    _reject(f"Image is too large (limit {IMAGE_MAX_UPLOAD_BYTES // (1024 * 1024)} MB).", 413)
+
+
+def check_upload_length(content_length):
+    """
+    Reject a multipart image request from its Content-Length before the body is read, so an oversized
+    upload is not spooled in full only to fail the size check afterwards. Raises ImageRejected.
+    """
+    if content_length is not None and content_length > IMAGE_MAX_UPLOAD_REQUEST:
+        _reject_too_large()
+
+
+def decode_image_base64(image_base64):
+    """Raw bytes of a base64 image (data URI prefix allowed); oversized payloads are rejected before decoding."""
+    data = (image_base64 or "").strip()
+    if data.startswith("data:") and "," in data:
+        data = data.split(",", 1)[1]
+    if not data:
+        _reject("No image data received.")
+    if len(data) * 3 // 4 > IMAGE_MAX_UPLOAD_BYTES:
+        _reject_too_large()
+    try:
+        return base64.b64decode(data, validate=False)
+    except (binascii.Error, ValueError):
+        _reject("Image data is not valid base64.")
+
+
+def sniff_image_type(head):
+    """MIME type from an image's first bytes, or None if it is not a supported format."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return None
+
+
+def normalize_image(raw, max_edge=IMAGE_MAX_EDGE, quality=IMAGE_JPEG_QUALITY, target_bytes=IMAGE_TARGET_BYTES):
+    """
+    Decode, auto-orient, drop EXIF/alpha, downscale to max_edge and JPEG-encode within target_bytes.
+    raw is the encoded image as bytes or a seekable binary file (read in place, never copied whole).
+    """
+    started = time.perf_counter()
+    if isinstance(raw, (bytes, bytearray)):
+        size = len(raw)
+        raw = io.BytesIO(raw)
+    else:
+        size = raw.seek(0, io.SEEK_END)
+        raw.seek(0)
+    if size > IMAGE_MAX_UPLOAD_BYTES:
+        _reject_too_large()
+    try:
+        img = Image.open(raw)
+        if img.width * img.height > IMAGE_MAX_PIXELS:
+            _reject(f"Image resolution is too high ({img.width}x{img.height}).", 413)
+        # JPEG: let the decoder downscale by 1/2, 1/4 or 1/8 while decoding (much less work for big photos)
+        if img.format == "JPEG":
+            img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.Resampling.BICUBIC)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        _reject("The file is not a supported image.")
+
+    # Re-encoding without exif= drops all metadata (GPS location included)
+    q = quality
+    while True:
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=q, optimize=True)
+        if buf.tell() <= target_bytes or q <= IMAGE_MIN_QUALITY:
+            break
+        q = max(IMAGE_MIN_QUALITY, q - 10)
+    out = buf.getvalue()
+    ms = (time.perf_counter() - started) * 1000
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += size
+        _stats["bytes_out"] += len(out)
+        _stats["ms"] += ms
+    return PreparedImage(out, img.width, img.height, q, size, len(out), round(ms, 2))
+
+
+def prepare_image_base64(image_base64):
+    """Normalized JPEG as base64 (no data URI prefix) plus its PreparedImage. Raises ImageRejected."""
+    prepared = normalize_image(decode_image_base64(image_base64))
+    return base64.b64encode(prepared.data).decode("ascii"), prepared
+
+
+def prepare_upload(stream):
+    """
+    Normalized JPEG as base64 plus its PreparedImage for a multipart file upload (a seekable stream,
+    e.g. Werkzeug's spooled temp file). The format is sniffed from the file's first bytes. Raises ImageRejected.
+    """
+    head = stream.read(16)
+    stream.seek(0)
+    if not head:
+        _reject("No image data received.")
+    if sniff_image_type(head) is None:
+        _reject("Unsupported image type; please send a JPEG, PNG or WebP photo.", 415)
+    prepared = normalize_image(stream)
+    return base64.b64encode(prepared.data).decode("ascii"), prepared
+
+
+def get_image_prep_stats():
+    with _stats_lock:
+        n = _stats["images"]
+        return {
+            "images": n,
+            "rejected": _stats["rejected"],
+            "bytes_in": _stats["bytes_in"],
+            "bytes_out": _stats["bytes_out"],
+            "reduction": round(1 - _stats["bytes_out"] / _stats["bytes_in"], 4) if _stats["bytes_in"] else 0.0,
+            "avg_ms": round(_stats["ms"] / n, 2) if n else 0.0,
+            "max_edge": IMAGE_MAX_EDGE,
+            "target_bytes": IMAGE_TARGET_BYTES,
+        }
@@ -0,0 +1,158 @@
+# Multi-pattern keyword matching (Aho-Corasick) for chatbot intent and entity detection
+# All intent keywords and knowledge-base entity names are compiled into one automaton, so a message
+# is scanned once regardless of how many keywords/languages are configured.
+
+from collections import deque, namedtuple
+
+# kind: "intent" or an entity table ("crop", "pest", "disease", "scheme"); key: intent name or table key;
+# order: position of the key in its source table (used for first-match compatibility)
+Match = namedtuple("Match", "kind key pattern start end order")
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton over str patterns; each pattern carries an arbitrary payload."""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self._patterns = []
+        self._built = False
+
+    def add(self, pattern, payload):
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = nxt
+        self._out[node] = self._out[node] + (len(self._patterns),)
+        self._patterns.append((pattern, payload))
+        self._built = False
+
+    def build(self):
+        """Compute failure links breadth-first and fold suffix outputs into each node."""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+        return self
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def iter(self, text):
+        """Yield (start, end, pattern, payload) for every (possibly overlapping) occurrence in text."""
+        if not self._built:
+            self.build()
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self._patterns
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pid in out[node]:
+                pattern, payload = patterns[pid]
+                yield i - len(pattern) + 1, i + 1, pattern, payload
+
+
+class ScanResult:
+    """All keyword hits in one message, with helpers reproducing the old first-match functions."""
+
+    def __init__(self, matches):
+        self.matches = matches
+
+    def keys(self, kind):
+        """Matched keys of one kind, in source-table order (the order the old loops checked them)."""
+        found = {}
+        for m in self.matches:
+            if m.kind == kind and (m.key not in found or m.order < found[m.key]):
+                found[m.key] = m.order
+        return sorted(found, key=found.get)
+
+    def first(self, kind):
+        keys = self.keys(kind)
+        return keys[0] if keys else None
+
+    def scores(self, kind):
+        """{key: score}: matched characters per key, normalized so the strongest key scores 1.0."""
+        out = {}
+        for m in self.matches:
+            if m.kind == kind:
+                out[m.key] = out.get(m.key, 0) + (m.end - m.start)
+        top = max(out.values(), default=0)
+        return {k: round(v / top, 3) for k, v in out.items()} if top else {}
+
+    def to_dict(self):
+        return {
+            "matches": [m._asdict() for m in self.matches],
+            "intents": self.scores("intent"),
+            "entities": {kind: self.scores(kind) for kind in ("crop", "pest", "disease", "scheme")},
+        }
+
+
+class KeywordIndex:
+    """
+    One automaton over intent keywords and entity names. Patterns are lower-cased, as the
+    loop-based matchers compared against message.lower().
+    """
+
+    def __init__(self):
+        self._ac = AhoCorasick()
+
+    def add(self, kind, key, pattern, order):
+        pattern = (pattern or "").lower()
+        if pattern:
+            self._ac.add(pattern, (kind, key, order))
+
+    def build(self):
+        self._ac.build()
+        return self
+
+    def __len__(self):
+        return len(self._ac)
+
+    def scan(self, message):
+        """All hits in one pass; start/end are offsets into message.lower()."""
+        text = (message or "").lower()
+        return ScanResult([
+            Match(kind, key, pattern, start, end, order)
+            for start, end, pattern, (kind, key, order) in self._ac.iter(text)
+        ])
+
+
+def build_keyword_index(intent_keywords, crops, pests, diseases, schemes):
+    """Index with the same patterns the chatbot's loop-based find_* functions checked."""
+    index = KeywordIndex()
+    order = 0
+    for intent, keywords in intent_keywords.items():
+        for kw in keywords:
+            index.add("intent", intent, kw, order)
+        order += 1
+    for i, (key, data) in enumerate(crops.items()):
+        index.add("crop", key, key, i)
+        index.add("crop", key, data.get("hindi", ""), i)
+    for kind, table in (("pest", pests), ("disease", diseases)):
+        for i, (key, data) in enumerate(table.items()):
+            index.add(kind, key, key.replace("_", " "), i)
+            index.add(kind, key, data.get("hindi", ""), i)
+    for i, (key, data) in enumerate(schemes.items()):
+        for kw in (key, data.get("name", ""), data.get("hindi", "")):
+            index.add("scheme", key, kw.lower().replace("_", " "), i)
+    return index.build()
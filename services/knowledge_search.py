@@ -0,0 +1,153 @@
+# BM25 search over the agricultural knowledge base (offline chatbot fallback)
+# Builds an in-memory inverted index over CROP/PEST/DISEASE/SCHEME/WEATHER entries in agri_knowledge.py,
+# tokenized for Latin and Indic scripts, so free-text questions can be answered without the LLM.
+
+import heapq
+import json
+import math
+import re
+import unicodedata
+from collections import Counter, namedtuple
+
+from services.agri_knowledge import (
+    CROP_DATABASE, PEST_DATABASE, DISEASE_DATABASE, GOVERNMENT_SCHEMES, WEATHER_ADVISORY,
+)
+
+KNOWLEDGE_TABLES = (
+    ("crop", CROP_DATABASE),
+    ("pest", PEST_DATABASE),
+    ("disease", DISEASE_DATABASE),
+    ("scheme", GOVERNMENT_SCHEMES),
+    ("weather", WEATHER_ADVISORY),
+)
+
+# Entry names (key, Hindi name, scheme name) count this many times more than body text
+TITLE_BOOST = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+SearchHit = namedtuple("SearchHit", "kind key score")
+
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "for", "to", "is", "are", "my", "i", "me", "what", "how",
+    "do", "does", "can", "should", "with", "at", "by", "it", "this", "that", "be", "from", "which", "when",
+    "का", "की", "के", "को", "में", "है", "हैं", "और", "से", "पर", "क्या", "कैसे", "मेरे", "मेरी", "मेरा", "एक",
+    "भी", "तो", "यह", "वह", "कि", "हो", "करें", "करना",
+}
+_SPLIT = re.compile(r"[^\wऀ-෿]+")
+
+
+def _stem(token):
+    """Light English suffix stripping (pests -> pest, leaves -> leav, spraying -> spray)."""
+    if not token.isascii() or len(token) <= 3:
+        return token
+    for suffix, repl in (("ies", "y"), ("ing", ""), ("es", ""), ("s", "")):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3 and not token.endswith("ss"):
+            return token[: -len(suffix)] + repl
+    return token
+
+
+def tokenize(text):
+    """Lower-cased word tokens for Latin and Indic scripts; nukta/chandrabindu folded, stopwords removed."""
+    text = unicodedata.normalize("NFC", text or "").casefold()
+    text = text.replace("़", "").replace("ँ", "ं").replace("_", " ")
+    return [_stem(t) for t in _SPLIT.split(text) if t and t not in _STOPWORDS and not t.isdigit()]
+
+
+def _flatten(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for k, v in value.items():
+            yield str(k)
+            yield from _flatten(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _flatten(v)
+
+
+def _documents():
+    """(kind, key, title text, body text) for every knowledge-base entry."""
+    for kind, table in KNOWLEDGE_TABLES:
+        for key, entry in table.items():
+            title = [key]
+            if isinstance(entry, dict):
+                title += [entry.get("hindi", ""), entry.get("name", "")]
+            yield kind, key, " ".join(t for t in title if t), " ".join(_flatten(entry))
+
+
+class BM25Index:
+    """Inverted index: term -> [(doc_id, tf)], with precomputed idf and length norms."""
+
+    def __init__(self, docs=(), postings=None, doc_len=None):
+        self.docs = list(docs)  # [(kind, key)]
+        self.postings = postings or {}
+        self.doc_len = doc_len or []
+        self._prepare()
+
+    @classmethod
+    def build(cls, documents):
+        docs, postings, doc_len = [], {}, []
+        for doc_id, (kind, key, title, body) in enumerate(documents):
+            tf = Counter(tokenize(body))
+            for tok in tokenize(title):
+                tf[tok] += TITLE_BOOST
+            docs.append((kind, key))
+            doc_len.append(sum(tf.values()))
+            for term, count in tf.items():
+                postings.setdefault(term, []).append((doc_id, count))
+        return cls(docs, postings, doc_len)
+
+    def _prepare(self):
+        n = len(self.docs)
+        avgdl = (sum(self.doc_len) / n) if n else 1.0
+        # Per-document BM25 length normalization, and idf per term
+        self._norm = [BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl) for dl in self.doc_len]
+        self._idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.docs)
+
+    def search(self, query, k=5, kinds=None):
+        """Top-k SearchHits for a free-text query, optionally limited to some entry kinds."""
+        scores = {}
+        norm = self._norm
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self._idf[term]
+            for doc_id, tf in plist:
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm[doc_id])
+        if kinds:
+            scores = {d: s for d, s in scores.items() if self.docs[d][0] in kinds}
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [SearchHit(self.docs[d][0], self.docs[d][1], round(s, 4)) for d, s in top]
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"docs": self.docs, "postings": self.postings, "doc_len": self.doc_len}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        postings = {t: [tuple(p) for p in plist] for t, plist in data["postings"].items()}
+        return cls([tuple(d) for d in data["docs"]], postings, data["doc_len"])
+
+
+_index = None
+
+
+def get_knowledge_index():
+    global _index
+    if _index is None:
+        _index = BM25Index.build(_documents())
+    return _index
+
+
+def search_knowledge(query, k=5, kinds=None):
+    return get_knowledge_index().search(query, k=k, kinds=kinds)
@@ -2,13 +2,26 @@
 # https://data.gov.in/catalog/current-daily-price-various-commodities-various-markets-mandi
 
 import os
+import time
 import json
-import urllib.request
-import urllib.error
+import base64
+import logging
+from datetime import datetime
+
+import requests
+from sqlalchemy import and_, or_, func
+
+from services.http_client import get_json
+from models import db, MandiPrice
+
+logger = logging.getLogger(__name__)
 
 # data.gov.in: resource IDs for "Current daily price of various commodities from various markets (Mandi)"
 # User can set DATA_GOV_IN_API_KEY after registering at data.gov.in
 DATA_GOV_IN_BASE = "https://api.data.gov.in/resource"
+DEFAULT_MANDI_RESOURCE_ID = "9ef84268-d583-4a30-b979-715d3eec5311"
+MANDI_INGEST_PAGE_SIZE = int(os.environ.get("MANDI_INGEST_PAGE_SIZE", "1000"))
+MANDI_UPSERT_BATCH = 500
 # Fallback: representative mandi prices (structure mirrors government data; update periodically)
 FALLBACK_MANDI = [
     {"commodity": "Rice", "market": "Delhi", "modal_price": 3200, "min_price": 3100, "max_price": 3350, "unit": "Quintal"},
@@ -26,15 +39,207 @@ def fetch_mandi(api_key=None, limit=20):
     api_key = api_key or os.environ.get("DATA_GOV_IN_API_KEY", "").strip()
     if api_key:
         # data.gov.in format: resource id for mandi prices (example - replace with actual resource id from portal)
-        resource_id = os.environ.get("DATA_GOV_IN_MANDI_RESOURCE_ID", "9ef84268-d583-4a30-b979-715d3eec5311")
-        url = f"{DATA_GOV_IN_BASE}/{resource_id}?api-key={api_key}&format=json&limit={limit}"
+        resource_id = os.environ.get("DATA_GOV_IN_MANDI_RESOURCE_ID", DEFAULT_MANDI_RESOURCE_ID)
+        url = f"{DATA_GOV_IN_BASE}/{resource_id}"
         try:
-            with urllib.request.urlopen(url, timeout=15) as resp:
-                raw = json.loads(resp.read().decode())
+            raw = get_json(url, params={"api-key": api_key, "format": "json", "limit": limit}, timeout=15)
             # Normalize response; data.gov.in returns {"records": [...]} or similar
             records = raw.get("records") or raw.get("Records") or raw.get("data") or []
             if isinstance(records, list) and len(records) > 0:
                 return {"prices": records[:limit], "source": "data.gov.in"}
-        except (urllib.error.URLError, json.JSONDecodeError, OSError, KeyError):
+        except (requests.RequestException, ValueError, KeyError):
             pass
     return {"prices": FALLBACK_MANDI, "source": "fallback"}
+
+
+# ---------- Local store: bulk ingestion and filtered queries ----------
+
+def _parse_price(value):
+    try:
+        return float(value) if value not in (None, "", "NR") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_record(rec):
+    """Normalize one data.gov.in record to MandiPrice column values, or None if unusable."""
+    rec = {str(k).lower(): v for k, v in rec.items()}
+    raw_date = (rec.get("arrival_date") or "").strip()
+    try:
+        arrival = datetime.strptime(raw_date, "%d/%m/%Y").date()
+    except ValueError:
+        return None
+    commodity = (rec.get("commodity") or "").strip()
+    state = (rec.get("state") or "").strip()
+    market = (rec.get("market") or "").strip()
+    if not (commodity and state and market):
+        return None
+    return {
+        "commodity": commodity[:100],
+        "state": state[:100],
+        "district": (rec.get("district") or "").strip()[:100],
+        "market": market[:150],
+        "variety": (rec.get("variety") or "").strip()[:100],
+        "grade": (rec.get("grade") or "").strip()[:50],
+        "arrival_date": arrival,
+        "min_price": _parse_price(rec.get("min_price")),
+        "max_price": _parse_price(rec.get("max_price")),
+        "modal_price": _parse_price(rec.get("modal_price")),
+        "ingested_at": datetime.utcnow(),
+    }
+
+
+def upsert_mandi_rows(rows):
+    """Insert-or-update rows on the natural key in one statement per batch (SQLite/PostgreSQL)."""
+    if not rows:
+        return 0
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        for row in rows:
+            db.session.merge(MandiPrice(**row))
+        return len(rows)
+    key = ["commodity", "state", "market", "variety", "grade", "arrival_date"]
+    # A row may repeat within a page; PostgreSQL rejects updating the same row twice in one statement
+    rows = list({tuple(r[k] for k in key): r for r in rows}.values())
+    for i in range(0, len(rows), MANDI_UPSERT_BATCH):
+        stmt = insert(MandiPrice).values(rows[i:i + MANDI_UPSERT_BATCH])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key,
+            set_={c: stmt.excluded[c] for c in ("district", "min_price", "max_price", "modal_price", "ingested_at")},
+        )
+        db.session.execute(stmt)
+    return len(rows)
+
+
+def ingest_mandi_prices(api_key=None, page_size=MANDI_INGEST_PAGE_SIZE, max_pages=None):
+    """
+    Page through the daily mandi resource (newest arrivals first) and upsert into MandiPrice.
+    Incremental: paging stops once a page is entirely older than the latest stored arrival_date.
+    Must run inside an app context. Returns run stats including rows/sec.
+    """
+    api_key = api_key or os.environ.get("DATA_GOV_IN_API_KEY", "").strip()
+    stats = {"pages": 0, "fetched": 0, "upserted": 0, "skipped_old": 0, "invalid": 0}
+    if not api_key:
+        stats["error"] = "DATA_GOV_IN_API_KEY not set"
+        return stats
+    resource_id = os.environ.get("DATA_GOV_IN_MANDI_RESOURCE_ID", DEFAULT_MANDI_RESOURCE_ID)
+    url = f"{DATA_GOV_IN_BASE}/{resource_id}"
+    watermark = db.session.query(func.max(MandiPrice.arrival_date)).scalar()
+    started = time.monotonic()
+    offset = 0
+    while max_pages is None or stats["pages"] < max_pages:
+        params = {"api-key": api_key, "format": "json", "limit": page_size, "offset": offset, "sort[arrival_date]": "desc"}
+        try:
+            raw = get_json(url, params=params, timeout=60)
+        except (requests.RequestException, ValueError) as e:
+            stats["error"] = str(e)
+            break
+        records = raw.get("records") or []
+        stats["pages"] += 1
+        stats["fetched"] += len(records)
+        rows = []
+        for rec in records:
+            row = _parse_record(rec)
+            if row is None:
+                stats["invalid"] += 1
+            elif watermark and row["arrival_date"] < watermark:
+                stats["skipped_old"] += 1
+            else:
+                rows.append(row)
+        stats["upserted"] += upsert_mandi_rows(rows)
+        db.session.commit()
+        if len(records) < page_size or (watermark and not rows and records):
+            break
+        offset += page_size
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    stats["rows_per_sec"] = round(stats["upserted"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+    logger.info("Mandi ingest: %s", stats)
+    return stats
+
+
+MANDI_SORTS = {
+    "arrival_date": MandiPrice.arrival_date,
+    "modal_price": MandiPrice.modal_price,
+    "commodity": MandiPrice.commodity,
+    "market": MandiPrice.market,
+}
+
+
+def _encode_cursor(value, row_id):
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode()
+
+
+def _decode_cursor(cursor, column):
+    value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    if column is MandiPrice.arrival_date and value is not None:
+        value = datetime.strptime(value, "%Y-%m-%d").date()
+    return value, int(row_id)
+
+
+def price_to_dict(p):
+    return {
+        "commodity": p.commodity,
+        "state": p.state,
+        "district": p.district,
+        "market": p.market,
+        "variety": p.variety,
+        "grade": p.grade,
+        "arrival_date": p.arrival_date.isoformat(),
+        "min_price": p.min_price,
+        "max_price": p.max_price,
+        "modal_price": p.modal_price,
+        "unit": "Quintal",
+    }
+
+
+def query_mandi_store(commodity=None, state=None, market=None, district=None, arrival_date=None,
+                      sort="-arrival_date", limit=20, cursor=None):
+    """
+    Filtered, sorted page from the local store with keyset pagination.
+    sort is a MANDI_SORTS key, prefixed with '-' for descending; cursor is next_cursor of the previous page.
+    Raises ValueError for an unknown sort or malformed cursor.
+    """
+    desc = sort.startswith("-")
+    column = MANDI_SORTS.get(sort.lstrip("-"))
+    if column is None:
+        raise ValueError(f"Unknown sort: {sort}")
+    q = MandiPrice.query.filter(column.isnot(None))
+    # Case-insensitive equality (data.gov.in spells names in title case), served by ix_mandi_price_lookup_ci
+    for col, value in ((MandiPrice.commodity, commodity), (MandiPrice.state, state),
+                       (MandiPrice.market, market), (MandiPrice.district, district)):
+        if value:
+            q = q.filter(func.lower(col) == value.strip().lower())
+    if arrival_date:
+        q = q.filter(MandiPrice.arrival_date == arrival_date)
+    if cursor:
+        try:
+            value, last_id = _decode_cursor(cursor, column)
+        except (ValueError, TypeError, json.JSONDecodeError) as e:
+            raise ValueError("Invalid cursor") from e
+        if desc:
+            q = q.filter(or_(column < value, and_(column == value, MandiPrice.id < last_id)))
+        else:
+            q = q.filter(or_(column > value, and_(column == value, MandiPrice.id > last_id)))
+    order = (column.desc(), MandiPrice.id.desc()) if desc else (column.asc(), MandiPrice.id.asc())
+    rows = q.order_by(*order).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = _encode_cursor(getattr(last, column.key), last.id)
+    return {"prices": [price_to_dict(p) for p in page], "next_cursor": next_cursor, "source": "store"}
+
+
+def get_mandi_prices(limit=20, **filters):
+    """Prices from the local store; falls back to the live API / FALLBACK_MANDI while the store is empty."""
+    if db.session.query(MandiPrice.id).first() is None:
+        out = fetch_mandi(limit=limit)
+        out["next_cursor"] = None
+        return out
+    return query_mandi_store(limit=limit, **filters)
@@ -0,0 +1,264 @@
+# Mandi price history analytics - vectorized over all (commodity, market) series at once
+# Daily modal/min/max prices from the local MandiPrice store are packed into (series x day) NumPy
+# arrays; moving averages, volatility, spreads and cross-market gaps are computed for every series in one pass.
+
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from models import db, MandiPrice
+
+MANDI_HISTORY_DAYS = int(os.environ.get("MANDI_HISTORY_DAYS", "90"))
+MANDI_TRENDS_TTL = int(os.environ.get("MANDI_TRENDS_TTL", "900"))  # seconds a built history is reused
+
+_history = None
+_history_built_at = 0.0
+_history_lock = threading.Lock()
+
+
+class PriceHistory:
+    """
+    Daily price series as float32 arrays of shape (n_series, n_days); NaN where a market did not report.
+    keys[i] is (commodity, state, market) for row i; dates[-1] is the latest arrival date.
+    """
+
+    def __init__(self, keys, dates, modal, low, high):
+        self.keys = keys
+        self.dates = dates
+        self.modal = modal
+        self.low = low
+        self.high = high
+        # Lower-cased key columns for vectorized filtering; commodity_idx groups series by commodity
+        self.key_columns = [np.array([k[pos].lower() for k in keys], dtype=object) for pos in range(3)]
+        if keys:
+            self.commodity_names, self.commodity_idx = np.unique(np.array([k[0] for k in keys], dtype=object), return_inverse=True)
+        else:
+            self.commodity_names, self.commodity_idx = np.array([], dtype=object), np.zeros(0, dtype=np.int64)
+        self._stats = None
+
+    @classmethod
+    def from_rows(cls, rows, end_date, days=MANDI_HISTORY_DAYS):
+        """
+        rows: iterable of (commodity, state, market, arrival_date, min_price, max_price, modal_price).
+        A market reports one row per variety and grade; they are combined per day into the lowest min,
+        the highest max and the median modal price.
+        """
+        start = end_date - timedelta(days=days - 1)
+        index = {}
+        series, offsets, values = [], [], []
+        for commodity, state, market, arrival, lo, hi, modal in rows:
+            key = (commodity, state, market)
+            i = index.get(key)
+            if i is None:
+                i = index[key] = len(index)
+            series.append(i)
+            offsets.append((arrival - start).days)
+            values.append((modal, lo, hi))  # same order as the constructor arrays
+        shape = (len(index), days)
+        arrays = [np.full(shape, np.nan, dtype=np.float32) for _ in range(3)]
+        if values:
+            s = np.asarray(series)
+            d = np.asarray(offsets)
+            v = np.asarray(values, dtype=np.float64)  # None -> nan
+            ok = (d >= 0) & (d < days)
+            if ok.any():
+                # Group rows by (series, day) cell, modal ascending within a cell (NaN sorts last)
+                cell = s[ok] * days + d[ok]
+                v = v[ok]
+                order = np.lexsort((v[:, 0], cell))
+                cell, v = cell[order], v[order]
+                starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+                reported = np.add.reduceat(~np.isnan(v[:, 0]), starts)
+                lower = starts + np.maximum(reported - 1, 0) // 2
+                upper = starts + reported // 2
+                median = np.where(reported > 0, (v[lower, 0] + v[np.minimum(upper, len(v) - 1), 0]) / 2, np.nan)
+                i, j = np.divmod(cell[starts], days)
+                arrays[0][i, j] = median
+                arrays[1][i, j] = np.fmin.reduceat(v[:, 1], starts)
+                arrays[2][i, j] = np.fmax.reduceat(v[:, 2], starts)
+        dates = [start + timedelta(days=i) for i in range(days)]
+        return cls(list(index), dates, *arrays)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def stats(self):
+        """analyze() computed once per built history."""
+        if self._stats is None:
+            self._stats = self.analyze()
+        return self._stats
+
+    def analyze(self):
+        """Per-series trend statistics as arrays (all shape (n_series,)) plus per-commodity market gaps."""
+        modal, low, high = self.modal, self.low, self.high
+        n, days = modal.shape
+        rows = np.arange(n)
+        valid = ~np.isnan(modal)
+
+        # Latest reported price anywhere in the history
+        any_valid = valid.any(axis=1)
+        last_idx = days - 1 - np.argmax(valid[:, ::-1], axis=1) if days else np.zeros(n, dtype=np.int64)
+        latest = np.full(n, np.nan, dtype=np.float64)
+        latest[any_valid] = modal[rows[any_valid], last_idx[any_valid]]
+
+        # Every other statistic only looks at the last 31 days, so work on that slice
+        recent = modal[:, -31:]
+        recent_valid = valid[:, -31:]
+
+        def trailing_mean(window):
+            vals = recent[:, -window:]
+            count = recent_valid[:, -window:].sum(axis=1)
+            total = np.where(recent_valid[:, -window:], vals, 0).sum(axis=1, dtype=np.float64)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(count > 0, total / count, np.nan)
+
+        ma7 = trailing_mean(7)
+        ma30 = trailing_mean(30)
+
+        # Volatility: std of daily log returns over the last 30 days, forward-filling no-report days
+        w = recent.shape[1]
+        idx = np.where(recent_valid, np.arange(w), 0)
+        np.maximum.accumulate(idx, axis=1, out=idx)
+        filled = recent[rows[:, None], idx]
+        filled[~np.maximum.accumulate(recent_valid, axis=1)] = np.nan
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns = np.diff(np.log(filled), axis=1)
+        ok = np.isfinite(returns)
+        count = ok.sum(axis=1)
+        r = np.where(ok, returns, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_r = r.sum(axis=1) / count
+            var = np.where(ok, (r - mean_r[:, None]) ** 2, 0).sum(axis=1) / count
+        volatility = np.where(count >= 2, np.sqrt(var), np.nan)
+
+        # Min/max spread: latest day and 30-day average, relative to modal
+        spread_latest = (high[:, -1] - low[:, -1]).astype(np.float64) if days else np.full(n, np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rel = (high[:, -30:] - low[:, -30:]) / recent[:, -30:]
+        rel_ok = np.isfinite(rel)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            spread_30 = np.where(rel_ok, rel, 0).sum(axis=1, dtype=np.float64) / rel_ok.sum(axis=1)
+
+        # Cross-market gaps per commodity on the latest (forward-filled) modal price
+        c = self.commodity_idx
+        n_comm = len(self.commodity_names)
+        lat = latest
+        best = np.full(n_comm, -np.inf)
+        worst = np.full(n_comm, np.inf)
+        has = ~np.isnan(lat)
+        np.maximum.at(best, c[has], lat[has])
+        np.minimum.at(worst, c[has], lat[has])
+        counts = np.bincount(c[has], minlength=n_comm)
+        mean = np.bincount(c[has], weights=lat[has], minlength=n_comm) / np.maximum(counts, 1)
+        best[counts == 0] = np.nan
+        worst[counts == 0] = np.nan
+        gap_to_best = best[c] - lat if n else np.zeros(0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            momentum = (ma7 - ma30) / ma30
+        return {
+            "latest": latest,
+            "ma7": ma7,
+            "ma30": ma30,
+            "momentum": momentum,
+            "volatility": volatility,
+            "spread_latest": spread_latest,
+            "spread_rel_30": spread_30,
+            "gap_to_best": gap_to_best,
+            "commodity_gaps": {
+                "commodity": self.commodity_names,
+                "best": best,
+                "worst": worst,
+                "mean": mean,
+                "markets": counts,
+            },
+        }
+
+
+def _num(x, digits=2):
+    x = float(x)
+    return None if np.isnan(x) or np.isinf(x) else round(x, digits)
+
+
+def load_price_history(days=MANDI_HISTORY_DAYS):
+    """Build a PriceHistory from the store ending at the latest arrival date (app context required)."""
+    end = db.session.query(db.func.max(MandiPrice.arrival_date)).scalar()
+    if end is None:
+        return PriceHistory([], [], *(np.zeros((0, 0), dtype=np.float32) for _ in range(3)))
+    start = end - timedelta(days=days - 1)
+    rows = (
+        db.session.query(
+            MandiPrice.commodity, MandiPrice.state, MandiPrice.market, MandiPrice.arrival_date,
+            MandiPrice.min_price, MandiPrice.max_price, MandiPrice.modal_price,
+        )
+        .filter(MandiPrice.arrival_date >= start)
+        .yield_per(10000)
+    )
+    return PriceHistory.from_rows(rows, end, days)
+
+
+def get_price_history():
+    """Shared PriceHistory, rebuilt at most every MANDI_TRENDS_TTL seconds."""
+    global _history, _history_built_at
+    with _history_lock:
+        if _history is None or time.monotonic() - _history_built_at > MANDI_TRENDS_TTL:
+            _history = load_price_history()
+            _history_built_at = time.monotonic()
+        return _history
+
+
+def get_mandi_trends(commodity=None, state=None, market=None, sort="-volatility", limit=50):
+    """Trend stats for matching series plus cross-market gaps for the matched commodities."""
+    history = get_price_history()
+    stats = history.stats()
+    sort_key = sort.lstrip("-")
+    if sort_key not in ("latest", "ma7", "ma30", "momentum", "volatility", "spread_rel_30", "gap_to_best"):
+        raise ValueError(f"Unknown sort: {sort}")
+
+    mask = np.ones(len(history), dtype=bool)
+    for pos, value in ((0, commodity), (1, state), (2, market)):
+        if value:
+            mask &= history.key_columns[pos] == value.strip().lower()
+    selected = np.nonzero(mask)[0]
+    order_vals = np.nan_to_num(stats[sort_key][selected].astype(np.float64), nan=-np.inf if sort.startswith("-") else np.inf)
+    order = np.argsort(-order_vals if sort.startswith("-") else order_vals, kind="stable")
+    selected = selected[order][:limit]
+
+    series = []
+    for i in selected:
+        commodity_name, state_name, market_name = history.keys[i]
+        series.append({
+            "commodity": commodity_name,
+            "state": state_name,
+            "market": market_name,
+            "latest_modal": _num(stats["latest"][i]),
+            "ma7": _num(stats["ma7"][i]),
+            "ma30": _num(stats["ma30"][i]),
+            "momentum": _num(stats["momentum"][i], 4),
+            "volatility": _num(stats["volatility"][i], 4),
+            "spread_latest": _num(stats["spread_latest"][i]),
+            "spread_rel_30": _num(stats["spread_rel_30"][i], 4),
+            "gap_to_best_market": _num(stats["gap_to_best"][i]),
+        })
+    gaps = stats["commodity_gaps"]
+    wanted = {s["commodity"] for s in series}
+    commodity_gaps = [
+        {
+            "commodity": name,
+            "best": _num(gaps["best"][j]),
+            "worst": _num(gaps["worst"][j]),
+            "mean": _num(gaps["mean"][j]),
+            "gap": _num(gaps["best"][j] - gaps["worst"][j]),
+            "markets": int(gaps["markets"][j]),
+        }
+        for j, name in enumerate(gaps["commodity"]) if name in wanted
+    ]
+    return {
+        "as_of": history.dates[-1].isoformat() if history.dates else None,
+        "series_total": len(history),
+        "series": series,
+        "commodity_gaps": commodity_gaps,
+    }
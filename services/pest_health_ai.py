@@ -1,24 +1,177 @@
 # OpenAI-Powered Agricultural AI Service for KRISHSAATHI
 # Full OpenAI GPT-4o integration for Voice Assistant and Chatbot
 
+import logging
 import re
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from openai import OpenAI
-from services.chatbot_engine import get_chatbot_reply, analyze_image_symptoms, RESPONSE_TEMPLATES
+from services.chatbot_engine import (
+    get_chatbot_reply, analyze_image_symptoms, RESPONSE_TEMPLATES, score_local_answer, get_local_answer,
+)
 from translations import get_translation
+from services.http_client import get_openai_http_client, HTTP_RETRIES
+from services.gazetteer import geocode_farmer, get_gazetteer
+from services.image_cache import image_hash, get_cached_diagnosis, cache_diagnosis
+from services.answer_cache import (
+    get_cached_answer, cache_answer, normalize_question, mask_farmer_name, fill_farmer_name,
+)
+from config import LLM_BYPASS_THRESHOLDS
 from models import db, Farmer
 
+logger = logging.getLogger(__name__)
+
 # Initialize OpenAI client
 try:
     from config import OPENAI_API_KEY
     if OPENAI_API_KEY:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
+        # Shared keep-alive pool; retries with backoff are handled by the SDK
+        openai_client = OpenAI(api_key=OPENAI_API_KEY, http_client=get_openai_http_client(), max_retries=HTTP_RETRIES)
     else:
         openai_client = None
 except Exception as e:
-    print(f"OpenAI init error: {e}")
+    logger.warning("OpenAI init error: %s", e)
     openai_client = None
 
+# LLM gateway limits: concurrent upstream calls, callers allowed to wait for a slot, and the
+# per-request deadline (seconds) covering queue wait plus the upstream call
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "32"))
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", "30"))
+
+
+class LLMOverloaded(Exception):
+    """The gateway shed the request (queue full, or the deadline passed while waiting)."""
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMGateway:
+    """
+    Front door for upstream LLM calls: at most max_concurrency run at once, up to max_queue more
+    wait for a slot until their deadline, and anything beyond that is shed (LLMOverloaded) so the
+    caller can answer from the knowledge base. Concurrent calls with the same key share one upstream call.
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE, deadline=LLM_DEADLINE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> _Flight
+        self._waits = deque(maxlen=1000)  # recent queue wait times (seconds)
+        self.queued = 0
+        self.running = 0
+        self.calls = 0
+        self.coalesced = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """Hold one upstream slot; yields the seconds left before the deadline. Raises LLMOverloaded."""
+        deadline = deadline or self.deadline
+        start = time.monotonic()
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                if self.queued >= self.max_queue:
+                    self.shed_queue_full += 1
+                    raise LLMOverloaded("LLM queue full")
+                self.queued += 1
+            try:
+                acquired = self._slots.acquire(timeout=deadline)
+            finally:
+                with self._lock:
+                    self.queued -= 1
+        waited = time.monotonic() - start
+        with self._lock:
+            self._waits.append(waited)
+            if not acquired:
+                self.shed_deadline += 1
+                raise LLMOverloaded("LLM deadline passed while queued")
+            self.running += 1
+            self.calls += 1
+        try:
+            yield max(deadline - waited, 1.0)
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+
+    def call(self, fn, key=None, deadline=None):
+        """
+        Run fn(timeout) in an upstream slot and return (result, coalesced). While a call with the
+        same key is in flight, later callers wait for its result instead of making their own.
+        """
+        deadline = deadline or self.deadline
+        if key is None:
+            with self.slot(deadline) as remaining:
+                return fn(remaining), False
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not flight.done.wait(deadline):
+                with self._lock:
+                    self.shed_deadline += 1
+                raise LLMOverloaded("LLM deadline passed waiting for a coalesced call")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            with self.slot(deadline) as remaining:
+                flight.result = fn(remaining)
+            return flight.result, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "deadline": self.deadline,
+                "running": self.running,
+                "queue_depth": self.queued,
+                "in_flight_keys": len(self._inflight),
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "shed_queue_full": self.shed_queue_full,
+                "shed_deadline": self.shed_deadline,
+                "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "wait_ms_p95": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+                "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+            }
+
+
+llm_gateway = LLMGateway()
+
+
+def get_llm_gateway_stats():
+    return llm_gateway.stats()
+
 # Language name mapping for prompts
 LANGUAGE_NAMES = {
     'hi': 'Hindi (हिंदी)', 'bn': 'Bengali (বাংলা)', 'te': 'Telugu (తెలుగు)', 
@@ -55,73 +208,212 @@ CONTEXT:
 
 Remember: You are the farmer's trusted companion. Respond with empathy and expertise."""
 
-def get_openai_response(message, lang, farmer_name=None, location=None, image_base64=None):
+def _build_messages(message, lang, farmer_name=None, location=None, image_base64=None):
+    """Chat messages and max_tokens for a GPT-4o request (text or vision)."""
+    lang_name = LANGUAGE_NAMES.get(lang, 'Hindi (हिंदी)')
+    loc = location or "India"
+    name = farmer_name or "Kisan"
+    
+    system_prompt = SYSTEM_PROMPT.format(
+        language=lang_name,
+        farmer_name=name,
+        location=loc
+    )
+    
+    messages = [
+        {"role": "system", "content": system_prompt}
+    ]
+    
+    # Handle image analysis
+    if image_base64:
+        # GPT-4o Vision for image analysis
+        content = [
+            {"type": "text", "text": f"The farmer has shared this image of their crop and asks: '{message or 'What is wrong with my crop?'}'. Analyze the image and provide detailed diagnosis and treatment recommendations in {lang_name}."}
+        ]
+        
+        # Add image to message
+        if ',' in image_base64:
+            image_data = image_base64  # Already has data URI prefix
+        else:
+            image_data = f"data:image/jpeg;base64,{image_base64}"
+        
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": image_data}
+        })
+        
+        messages.append({"role": "user", "content": content})
+        return messages, 1000
+    
+    # Text-only conversation
+    messages.append({"role": "user", "content": message})
+    return messages, 800
+
+def get_openai_response(message, lang, farmer_name=None, location=None, image_base64=None, timeout=None):
     """Get response from OpenAI GPT-4o."""
     if not openai_client:
         return None
     
     try:
-        lang_name = LANGUAGE_NAMES.get(lang, 'Hindi (हिंदी)')
-        loc = location or "India"
-        name = farmer_name or "Kisan"
-        
-        system_prompt = SYSTEM_PROMPT.format(
-            language=lang_name,
-            farmer_name=name,
-            location=loc
+        messages, max_tokens = _build_messages(message, lang, farmer_name, location, image_base64)
+        response = openai_client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.7,
+            timeout=timeout
         )
         
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        
-        # Handle image analysis
-        if image_base64:
-            # GPT-4o Vision for image analysis
-            content = [
-                {"type": "text", "text": f"The farmer has shared this image of their crop and asks: '{message or 'What is wrong with my crop?'}'. Analyze the image and provide detailed diagnosis and treatment recommendations in {lang_name}."}
-            ]
-            
-            # Add image to message
-            if ',' in image_base64:
-                image_data = image_base64  # Already has data URI prefix
-            else:
-                image_data = f"data:image/jpeg;base64,{image_base64}"
-            
-            content.append({
-                "type": "image_url",
-                "image_url": {"url": image_data}
-            })
-            
-            messages.append({"role": "user", "content": content})
-            
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7
-            )
-        else:
-            # Text-only conversation
-            messages.append({"role": "user", "content": message})
-            
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=800,
-                temperature=0.7
-            )
-        
         if response.choices and response.choices[0].message:
             return response.choices[0].message.content.strip()
         
         return None
         
     except Exception as e:
-        print(f"OpenAI API error: {e}")
+        logger.warning("OpenAI API error: %s", e)
         return None
 
-def get_pest_health_reply(message, lang, image_base64=None, conversation_id=None, farmer_name=None, farmer_id=None):
+def stream_openai_response(message, lang, farmer_name=None, location=None, image_base64=None, timeout=None):
+    """Yield GPT-4o reply text as it is generated. API errors propagate to the caller."""
+    messages, max_tokens = _build_messages(message, lang, farmer_name, location, image_base64)
+    stream = openai_client.chat.completions.create(
+        model="gpt-4o",
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=0.7,
+        stream=True,
+        timeout=timeout
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+    finally:
+        # Closing releases the pooled connection if the client went away mid-stream
+        stream.close()
+
+def _farmer_context(farmer_id, farmer=None):
+    """(Farmer or None, "village, district, state" location string or None); farmer_id is only loaded if no farmer is given."""
+    if farmer is None and farmer_id:
+        farmer = db.session.get(Farmer, farmer_id)
+    if not farmer:
+        return None, None
+    return farmer, f"{farmer.village or ''}, {farmer.district or ''}, {farmer.state or ''}".strip(', ')
+
+def _cache_location(farmer):
+    """Coarse location the answer cache is partitioned by: the farmer's state code ("" if unknown)."""
+    if not farmer or not farmer.state:
+        return ""
+    return get_gazetteer().resolve_state(farmer.state) or farmer.state.strip().upper()
+
+def _local_reply(msg, lang):
+    """
+    Routing tier: the knowledge-base answer when local confidence reaches the intent's threshold
+    (config.LLM_BYPASS_THRESHOLDS), else None to send the question to the LLM. Logs every decision.
+    """
+    started = time.perf_counter()
+    route = score_local_answer(msg)
+    threshold = LLM_BYPASS_THRESHOLDS.get(route.intent)
+    reply = None
+    if threshold is not None and route.confidence >= threshold:
+        reply = get_local_answer(route, lang)
+    logger.info(
+        "chatbot route=%s intent=%s entity=%s confidence=%.3f threshold=%s latency_ms=%.3f",
+        "local" if reply else "llm", route.intent, route.entity, route.confidence, threshold,
+        (time.perf_counter() - started) * 1000,
+    )
+    return reply
+
+def _update_profile_from_message(farmer, msg, lang):
+    """
+    Form filling: apply state/district/village spoken in msg to the profile; confirmation text or None.
+    The changes are left for the caller to commit with the rest of the chat turn.
+    """
+    update_info = {}
+
+    # State patterns (English and Hindi)
+    state_patterns = [
+        r'(?:state is|from|my state|i am from|मेरा राज्य|राज्य है)\s*[:\s]*([a-zA-Z\u0900-\u097F]+)',
+        r'([a-zA-Z]+)\s+state',
+    ]
+    for pattern in state_patterns:
+        match = re.search(pattern, msg, re.IGNORECASE)
+        if match:
+            state = match.group(1).strip().title()
+            if len(state) > 2 and state.lower() not in ['is', 'my', 'the', 'in']:
+                farmer.state = state
+                update_info['state'] = state
+                break
+
+    # District patterns
+    district_patterns = [
+        r'(?:district is|district|my district|जिला|ज़िला)\s*[:\s]*([a-zA-Z\u0900-\u097F]+)',
+    ]
+    for pattern in district_patterns:
+        match = re.search(pattern, msg, re.IGNORECASE)
+        if match:
+            district = match.group(1).strip().title()
+            if len(district) > 2 and district.lower() not in ['is', 'my', 'the']:
+                farmer.district = district
+                update_info['district'] = district
+                break
+
+    # Village patterns
+    village_patterns = [
+        r'(?:village is|my village|गांव|गाँव)\s*[:\s]*([a-zA-Z\u0900-\u097F]+)',
+    ]
+    for pattern in village_patterns:
+        match = re.search(pattern, msg, re.IGNORECASE)
+        if match:
+            village = match.group(1).strip().title()
+            if len(village) > 2:
+                farmer.village = village
+                update_info['village'] = village
+                break
+
+    if update_info:
+        geocode_farmer(farmer)
+        if lang == 'hi':
+            parts = []
+            if 'state' in update_info:
+                parts.append(f"राज्य={update_info['state']}")
+            if 'district' in update_info:
+                parts.append(f"ज़िला={update_info['district']}")
+            if 'village' in update_info:
+                parts.append(f"गांव={update_info['village']}")
+            return f"✅ अपडेट किया गया: {', '.join(parts)}। पेज रिफ्रेश करें।"
+        else:
+            parts = []
+            if 'state' in update_info:
+                parts.append(f"State={update_info['state']}")
+            if 'district' in update_info:
+                parts.append(f"District={update_info['district']}")
+            if 'village' in update_info:
+                parts.append(f"Village={update_info['village']}")
+            return f"✅ Updated: {', '.join(parts)}. Please refresh to see changes."
+    return None
+
+def _fallback_reply(msg, lang, image_base64=None):
+    """Knowledge-base reply used when OpenAI is unavailable or fails."""
+    # Image fallback
+    if image_base64:
+        analysis = analyze_image_symptoms(msg)
+        if analysis:
+            templates = RESPONSE_TEMPLATES.get(lang, RESPONSE_TEMPLATES["en"])
+            return templates["image_analysis"].format(analysis=analysis)
+        
+        if lang == 'hi':
+            return "🔍 छवि विश्लेषण के लिए OpenAI API आवश्यक है। कृपया OPENAI_API_KEY सेट करें या समस्या का विवरण टाइप करें।"
+        else:
+            return "🔍 Image analysis requires OpenAI API. Please set OPENAI_API_KEY or describe the problem in text."
+    
+    # Text fallback to knowledge base
+    return get_chatbot_reply(msg, lang)
+
+def get_pest_health_reply(message, lang, image_base64=None, conversation_id=None, farmer_name=None, farmer_id=None,
+                          farmer=None):
     """
     Main AI function - OpenAI GPT-4o powered agricultural responses.
     
@@ -130,115 +422,127 @@ def get_pest_health_reply(message, lang, image_base64=None, conversation_id=None
     2. Image analysis using GPT-4o Vision
     3. Intelligent responses in 15+ Indian languages
     4. Fallback to knowledge base if API unavailable
+
+    Pass the already-loaded Farmer as farmer (farmer_id is loaded otherwise). Profile updates from
+    form filling are not committed here.
     """
     msg = (message or "").strip()
-    msg_lower = msg.lower()
     
     # Get farmer info for context
-    farmer = None
-    location = None
-    if farmer_id:
-        farmer = Farmer.query.get(farmer_id)
-        if farmer:
-            location = f"{farmer.village or ''}, {farmer.district or ''}, {farmer.state or ''}".strip(', ')
+    farmer, location = _farmer_context(farmer_id, farmer)
     
     # ==========================================================================
     # 1. FORM FILLING - Detect and update profile from voice commands
     # ==========================================================================
     if farmer and msg:
-        update_info = {}
-        
-        # State patterns (English and Hindi)
-        state_patterns = [
-            r'(?:state is|from|my state|i am from|मेरा राज्य|राज्य है)\s*[:\s]*([a-zA-Z\u0900-\u097F]+)',
-            r'([a-zA-Z]+)\s+state',
-        ]
-        for pattern in state_patterns:
-            match = re.search(pattern, msg, re.IGNORECASE)
-            if match:
-                state = match.group(1).strip().title()
-                if len(state) > 2 and state.lower() not in ['is', 'my', 'the', 'in']:
-                    farmer.state = state
-                    update_info['state'] = state
-                    break
-        
-        # District patterns
-        district_patterns = [
-            r'(?:district is|district|my district|जिला|ज़िला)\s*[:\s]*([a-zA-Z\u0900-\u097F]+)',
-        ]
-        for pattern in district_patterns:
-            match = re.search(pattern, msg, re.IGNORECASE)
-            if match:
-                district = match.group(1).strip().title()
-                if len(district) > 2 and district.lower() not in ['is', 'my', 'the']:
-                    farmer.district = district
-                    update_info['district'] = district
-                    break
-        
-        # Village patterns
-        village_patterns = [
-            r'(?:village is|my village|गांव|गाँव)\s*[:\s]*([a-zA-Z\u0900-\u097F]+)',
-        ]
-        for pattern in village_patterns:
-            match = re.search(pattern, msg, re.IGNORECASE)
-            if match:
-                village = match.group(1).strip().title()
-                if len(village) > 2:
-                    farmer.village = village
-                    update_info['village'] = village
-                    break
-        
-        if update_info:
-            db.session.commit()
-            if lang == 'hi':
-                parts = []
-                if 'state' in update_info:
-                    parts.append(f"राज्य={update_info['state']}")
-                if 'district' in update_info:
-                    parts.append(f"ज़िला={update_info['district']}")
-                if 'village' in update_info:
-                    parts.append(f"गांव={update_info['village']}")
-                return f"✅ अपडेट किया गया: {', '.join(parts)}। पेज रिफ्रेश करें।"
-            else:
-                parts = []
-                if 'state' in update_info:
-                    parts.append(f"State={update_info['state']}")
-                if 'district' in update_info:
-                    parts.append(f"District={update_info['district']}")
-                if 'village' in update_info:
-                    parts.append(f"Village={update_info['village']}")
-                return f"✅ Updated: {', '.join(parts)}. Please refresh to see changes."
+        update_reply = _update_profile_from_message(farmer, msg, lang)
+        if update_reply:
+            return update_reply
     
     # ==========================================================================
     # 2. OPENAI GPT-4o - Primary AI Engine
     # ==========================================================================
     if openai_client and (msg or image_base64):
-        response = get_openai_response(
-            message=msg,
-            lang=lang,
-            farmer_name=farmer_name or (farmer.name if farmer else None),
-            location=location,
-            image_base64=image_base64
-        )
+        name = farmer_name or (farmer.name if farmer else None)
+        # Text questions: structured lookups are answered from the knowledge base, then the semantic
+        # cache is tried. Images: a recent diagnosis of a perceptually identical photo with the same
+        # (normalized) question is reused.
+        cache_loc = _cache_location(farmer)
+        phash = None
+        if image_base64:
+            phash = image_hash(image_base64)
+            question = normalize_question(msg)
+            cached = get_cached_diagnosis(phash, lang, question)
+            if cached:
+                return fill_farmer_name(cached, name)
+            flight_key = ("image", lang, question, phash) if phash is not None else None
+        else:
+            local = _local_reply(msg, lang)
+            if local:
+                return local
+            cached = get_cached_answer(msg, lang, cache_loc, name)
+            if cached:
+                return cached
+            flight_key = (lang, cache_loc, normalize_question(msg))
+        
+        started = time.perf_counter()
+        try:
+            # Identical in-flight questions (or photos) share one upstream call; the answer is stored
+            # with the asking farmer's name masked and personalized for each waiter
+            response, _ = llm_gateway.call(
+                lambda timeout: mask_farmer_name(get_openai_response(
+                    message=msg,
+                    lang=lang,
+                    farmer_name=name,
+                    location=location,
+                    image_base64=image_base64,
+                    timeout=timeout
+                ) or "", name),
+                key=flight_key,
+            )
+        except LLMOverloaded:
+            response = None
         
         if response:
-            return response
+            if image_base64:
+                cache_diagnosis(phash, lang, response, question)
+            else:
+                cache_answer(msg, lang, response, cache_loc, name, time.perf_counter() - started)
+            return fill_farmer_name(response, name)
     
     # ==========================================================================
     # 3. FALLBACK - Knowledge-based response if OpenAI unavailable
     # ==========================================================================
+    return _fallback_reply(msg, lang, image_base64)
+
+def stream_pest_health_reply(message, lang, image_base64=None, farmer_name=None, farmer_id=None, farmer=None):
+    """
+    Streaming variant of get_pest_health_reply. Yields (event, text) pairs:
+    ("token", text) for each chunk of the reply, or ("fallback", text) with a complete
+    knowledge-base reply that replaces anything streamed so far if OpenAI fails mid-stream.
+    """
+    msg = (message or "").strip()
+    farmer, location = _farmer_context(farmer_id, farmer)
     
-    # Image fallback
-    if image_base64:
-        analysis = analyze_image_symptoms(msg)
-        if analysis:
-            templates = RESPONSE_TEMPLATES.get(lang, RESPONSE_TEMPLATES["en"])
-            return templates["image_analysis"].format(analysis=analysis)
+    if farmer and msg:
+        update_reply = _update_profile_from_message(farmer, msg, lang)
+        if update_reply:
+            yield "token", update_reply
+            return
+    
+    if openai_client and (msg or image_base64):
+        name = farmer_name or (farmer.name if farmer else None)
+        cache_loc = _cache_location(farmer)
+        if not image_base64:
+            local = _local_reply(msg, lang) or get_cached_answer(msg, lang, cache_loc, name)
+            if local:
+                yield "token", local
+                return
         
-        if lang == 'hi':
-            return "🔍 छवि विश्लेषण के लिए OpenAI API आवश्यक है। कृपया OPENAI_API_KEY सेट करें या समस्या का विवरण टाइप करें।"
-        else:
-            return "🔍 Image analysis requires OpenAI API. Please set OPENAI_API_KEY or describe the problem in text."
+        started = time.perf_counter()
+        parts = []
+        try:
+            # Streams hold a gateway slot for their whole duration (not coalesced)
+            with llm_gateway.slot() as timeout:
+                for delta in stream_openai_response(
+                    message=msg,
+                    lang=lang,
+                    farmer_name=name,
+                    location=location,
+                    image_base64=image_base64,
+                    timeout=timeout
+                ):
+                    parts.append(delta)
+                    yield "token", delta
+            if parts:
+                if not image_base64:
+                    cache_answer(msg, lang, "".join(parts).strip(), cache_loc, name, time.perf_counter() - started)
+                return
+        except LLMOverloaded:
+            pass
+        except Exception as e:
+            logger.warning("OpenAI streaming error: %s", e)
+        yield "fallback", _fallback_reply(msg, lang, image_base64)
+        return
     
-    # Text fallback to knowledge base
-    return get_chatbot_reply(msg, lang)
+    yield "token", _fallback_reply(msg, lang, image_base64)
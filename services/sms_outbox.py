@@ -0,0 +1,268 @@
+# SMS outbox: alert producers bulk-insert messages, a dispatcher drains them
+# Producers never call the gateway. Each row carries an idempotency key (farmer, alert type, forecast date),
+# so a re-run or a crashed run never queues the same alert twice. The dispatcher claims due rows in batches,
+# sends them at SMS_RATE per second on a small thread pool, retries failures with exponential backoff and
+# marks a row dead after SMS_MAX_ATTEMPTS.
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from models import db, SmsOutbox
+
+logger = logging.getLogger(__name__)
+
+SMS_GATEWAY = os.environ.get("SMS_GATEWAY", "log")  # "log" or "fake"
+SMS_RATE = float(os.environ.get("SMS_RATE", "20"))  # messages per second per dispatcher (0 = unlimited)
+SMS_BATCH_SIZE = int(os.environ.get("SMS_BATCH_SIZE", "200"))  # rows claimed per DB round-trip
+SMS_SEND_WORKERS = int(os.environ.get("SMS_SEND_WORKERS", "8"))  # concurrent gateway calls
+SMS_MAX_ATTEMPTS = int(os.environ.get("SMS_MAX_ATTEMPTS", "5"))
+SMS_RETRY_BASE = float(os.environ.get("SMS_RETRY_BASE", "30"))  # seconds before the first retry, doubled per attempt
+SMS_RETRY_MAX = float(os.environ.get("SMS_RETRY_MAX", "3600"))
+SMS_SEND_TIMEOUT = int(os.environ.get("SMS_SEND_TIMEOUT", "300"))  # 'sending' longer than this = orphaned by a crash
+FAKE_SMS_LATENCY = float(os.environ.get("FAKE_SMS_LATENCY", "0"))
+FAKE_SMS_FAILURE_RATE = float(os.environ.get("FAKE_SMS_FAILURE_RATE", "0"))
+
+# Stats of the most recent dispatch_outbox run
+last_dispatch = {}
+
+
+class SmsSendError(Exception):
+    """The gateway did not accept the message; the dispatcher retries it."""
+
+
+def log_gateway(mobile, message):
+    """Default gateway: log only. Wire a real provider (MSG91, Twilio, ...) in here for production."""
+    logger.info("SMS stub: to=%s msg=%s", mobile[-10:], message[:80])
+
+
+class FakeSmsGateway:
+    """Offline gateway for development and benchmarks: fixed latency, random transient failures, records sends."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, mobile, message):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.failure_rate
+            if not failed:
+                self.sent.append((mobile, message))
+        if failed:
+            raise SmsSendError("fake gateway: transient failure")
+
+
+_gateway = None
+
+
+def set_sms_gateway(gateway):
+    """Use a gateway by name ("log", "fake") or any callable(mobile, message) that raises on failure."""
+    global _gateway
+    if gateway == "log":
+        gateway = log_gateway
+    elif gateway == "fake":
+        gateway = FakeSmsGateway(FAKE_SMS_LATENCY, FAKE_SMS_FAILURE_RATE)
+    elif isinstance(gateway, str):
+        raise ValueError(f"Unknown SMS gateway: {gateway}")
+    _gateway = gateway
+
+
+def get_sms_gateway():
+    if _gateway is None:
+        set_sms_gateway(SMS_GATEWAY)
+    return _gateway
+
+
+def sms_key(kind, farmer_id, forecast_date):
+    """Idempotency key: one message per farmer, alert type and forecast day the alert is about."""
+    return f"{kind}:{farmer_id}:{forecast_date}"
+
+
+def _insert_ignoring_duplicates(rows):
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        keys = [r["idempotency_key"] for r in rows]
+        existing = {k for (k,) in db.session.query(SmsOutbox.idempotency_key).filter(SmsOutbox.idempotency_key.in_(keys))}
+        rows = [r for r in {r["idempotency_key"]: r for r in rows}.values() if r["idempotency_key"] not in existing]
+        if rows:
+            db.session.execute(db.insert(SmsOutbox), rows)
+        return len(rows)
+    # Core executemany on the session's connection: rowcount counts only the rows actually inserted
+    stmt = insert(SmsOutbox.__table__).on_conflict_do_nothing(index_elements=["idempotency_key"])
+    return db.session.connection().execute(stmt, rows).rowcount
+
+
+def enqueue_sms(messages):
+    """
+    Bulk-insert outbox rows and commit. messages are dicts with idempotency_key, mobile, message and optional
+    farmer_id and kind; keys already in the outbox (queued, sent or dead) are skipped. Returns the number inserted.
+    """
+    now = datetime.utcnow()
+    rows = []
+    for m in messages:
+        mobile = "".join(c for c in (m.get("mobile") or "") if c.isdigit())[-10:]
+        if len(mobile) != 10:
+            continue
+        rows.append({
+            "idempotency_key": m["idempotency_key"],
+            "farmer_id": m.get("farmer_id"),
+            "mobile": mobile,
+            "message": m["message"],
+            "kind": m.get("kind"),
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+        })
+    if not rows:
+        return 0
+    inserted = _insert_ignoring_duplicates(rows)
+    db.session.commit()
+    return inserted
+
+
+def _claimable(now):
+    stale = now - timedelta(seconds=SMS_SEND_TIMEOUT)
+    return db.or_(
+        db.and_(SmsOutbox.status == "pending", SmsOutbox.next_attempt_at <= now),
+        db.and_(SmsOutbox.status == "sending", SmsOutbox.claimed_at < stale),
+    )
+
+
+def claim_batch(limit=SMS_BATCH_SIZE):
+    """
+    Mark up to limit due rows as sending and return them as (id, mobile, message, attempts) tuples.
+    The conditional UPDATE (claimed_at doubles as the claim token) keeps concurrent dispatchers apart.
+    """
+    now = datetime.utcnow()
+    ids = [
+        row_id for (row_id,) in
+        db.session.query(SmsOutbox.id).filter(_claimable(now)).order_by(SmsOutbox.next_attempt_at, SmsOutbox.id).limit(limit)
+    ]
+    if not ids:
+        return []
+    (
+        SmsOutbox.query.filter(SmsOutbox.id.in_(ids), _claimable(now))
+        .update({"status": "sending", "claimed_at": now, "attempts": SmsOutbox.attempts + 1}, synchronize_session=False)
+    )
+    db.session.commit()
+    return (
+        db.session.query(SmsOutbox.id, SmsOutbox.mobile, SmsOutbox.message, SmsOutbox.attempts)
+        .filter(SmsOutbox.id.in_(ids), SmsOutbox.status == "sending", SmsOutbox.claimed_at == now)
+        .all()
+    )
+
+
+def retry_delay(attempts):
+    """Seconds until the next try after `attempts` failed sends: exponential, capped, with +-20% jitter."""
+    return min(SMS_RETRY_MAX, SMS_RETRY_BASE * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def _send(gateway, mobile, message):
+    """None if the gateway accepted the message, else the error text."""
+    try:
+        if gateway(mobile, message) is False:
+            return "gateway rejected the message"
+        return None
+    except Exception as e:
+        return str(e)[:255] or type(e).__name__
+
+
+def _record_results(results):
+    """One bulk UPDATE by primary key for a batch's outcomes: sent, back to pending with backoff, or dead."""
+    now = datetime.utcnow()
+    updates = []
+    for (row_id, _, _, attempts), error in results:
+        if error is None:
+            updates.append({"id": row_id, "status": "sent", "sent_at": now, "last_error": None})
+        elif attempts >= SMS_MAX_ATTEMPTS:
+            updates.append({"id": row_id, "status": "dead", "last_error": error})
+        else:
+            updates.append({
+                "id": row_id, "status": "pending", "last_error": error,
+                "next_attempt_at": now + timedelta(seconds=retry_delay(attempts)),
+            })
+    if updates:
+        db.session.execute(db.update(SmsOutbox), updates)
+        db.session.commit()
+    return updates
+
+
+def dispatch_outbox(rate=SMS_RATE, batch_size=SMS_BATCH_SIZE, max_batches=None, gateway=None, workers=SMS_SEND_WORKERS,
+                    time_budget=None, keep_going=None):
+    """
+    Drain due outbox rows (run inside an app context) until none are due, max_batches is reached,
+    time_budget seconds have passed or keep_going() returns False (both checked before each batch, so a
+    run overshoots its budget by at most one batch). Gateway calls run on `workers` threads and are
+    started at most `rate` per second.
+    """
+    gateway = gateway or get_sms_gateway()
+    interval = 1.0 / rate if rate > 0 else 0.0
+    stats = {"batches": 0, "sent": 0, "retrying": 0, "dead": 0, "stopped": "drained"}
+    started = time.monotonic()
+    next_slot = started
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sms") as pool:
+        while True:
+            if max_batches is not None and stats["batches"] >= max_batches:
+                stats["stopped"] = "max_batches"
+                break
+            if time_budget is not None and time.monotonic() - started >= time_budget:
+                stats["stopped"] = "time_budget"
+                break
+            if keep_going is not None and stats["batches"] and not keep_going():
+                stats["stopped"] = "keep_going"
+                break
+            batch = claim_batch(batch_size)
+            if not batch:
+                break
+            stats["batches"] += 1
+            futures = []
+            for row in batch:
+                if interval:
+                    now = time.monotonic()
+                    if next_slot > now:
+                        time.sleep(next_slot - now)
+                    next_slot = max(next_slot, now) + interval
+                futures.append(pool.submit(_send, gateway, row.mobile, row.message))
+            # Outcomes are written per batch, so a crash loses at most one batch (re-sent after SMS_SEND_TIMEOUT)
+            for update in _record_results(list(zip(batch, (f.result() for f in futures)))):
+                stats[{"sent": "sent", "dead": "dead"}.get(update["status"], "retrying")] += 1
+    elapsed = time.monotonic() - started
+    stats["wall_time_s"] = round(elapsed, 3)
+    stats["messages_per_s"] = round((stats["sent"] + stats["retrying"] + stats["dead"]) / elapsed, 1) if elapsed else 0.0
+    if stats["batches"]:
+        logger.info(
+            "SMS dispatch: sent=%d retrying=%d dead=%d batches=%d stopped=%s wall=%.3fs",
+            stats["sent"], stats["retrying"], stats["dead"], stats["batches"], stats["stopped"], stats["wall_time_s"],
+        )
+    last_dispatch.clear()
+    last_dispatch.update(stats, finished_at=datetime.utcnow().isoformat())
+    return stats
+
+
+def get_outbox_stats():
+    """Row counts per status plus the last dispatch run (inside an app context)."""
+    counts = dict(db.session.query(SmsOutbox.status, db.func.count()).group_by(SmsOutbox.status).all())
+    return {
+        "pending": counts.get("pending", 0),
+        "sending": counts.get("sending", 0),
+        "sent": counts.get("sent", 0),
+        "dead": counts.get("dead", 0),
+        "rate": SMS_RATE,
+        "last_dispatch": dict(last_dispatch),
+    }
@@ -2,21 +2,36 @@
 # https://open-meteo.com/en/docs
 
 import os
-import urllib.request
-import urllib.error
-import json
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from services.http_client import get_json
 
 OPEN_METEO_BASE = "https://api.open-meteo.com/v1"
 DEFAULT_LAT = 28.6139   # Delhi
 DEFAULT_LON = 77.2090
 
+# Cache: forecasts are shared by everyone in the same grid cell (degrees; 0.1° ~ 11 km)
+WEATHER_CACHE_RESOLUTION = float(os.environ.get("WEATHER_CACHE_RESOLUTION", "0.1"))
+WEATHER_CACHE_TTL = int(os.environ.get("WEATHER_CACHE_TTL", "900"))  # seconds until an entry is stale
+WEATHER_CACHE_MAX_STALE = int(os.environ.get("WEATHER_CACHE_MAX_STALE", "21600"))  # stale entries older than this are refetched inline
+WEATHER_CACHE_MAX_ENTRIES = int(os.environ.get("WEATHER_CACHE_MAX_ENTRIES", "5000"))
+# Open-Meteo accepts comma-separated coordinate lists; cells per multi-coordinate request
+OPEN_METEO_BATCH_SIZE = int(os.environ.get("OPEN_METEO_BATCH_SIZE", "50"))
+WEATHER_FORECAST_DAYS = int(os.environ.get("WEATHER_FORECAST_DAYS", "3"))  # daily values kept per forecast
+
 
 def _get_url(lat, lon):
     return (
         f"{OPEN_METEO_BASE}/forecast?"
         f"latitude={lat}&longitude={lon}"
         "&current=temperature_2m,relative_humidity_2m,precipitation,weather_code,wind_speed_10m"
-        "&daily=temperature_2m_max,temperature_2m_min,precipitation_sum,weather_code"
+        "&daily=temperature_2m_max,temperature_2m_min,precipitation_sum,weather_code,"
+        "wind_speed_10m_max,relative_humidity_2m_max"
         "&timezone=Asia/Kolkata"
     )
 
@@ -38,16 +53,205 @@ def _wmo_code_to_label(code):
     return "cloudy"
 
 
+def geo_cell(lat, lon, resolution=None):
+    """Snap a coordinate to the centre of its cache grid cell, e.g. (28.61, 77.21) at 0.1°."""
+    res = resolution or WEATHER_CACHE_RESOLUTION
+    return (round(round(float(lat) / res) * res, 4), round(round(float(lon) / res) * res, 4))
+
+
+class _Load:
+    __slots__ = ("done", "data")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+
+
+class WeatherCache:
+    """
+    LRU + TTL cache of forecasts keyed by geo cell, with stale-while-revalidate:
+    an expired entry is returned immediately and a single background thread refreshes it.
+    Concurrent misses on the same cell wait for one upstream fetch.
+    """
+
+    def __init__(self, loader, ttl=WEATHER_CACHE_TTL, max_stale=WEATHER_CACHE_MAX_STALE, max_entries=WEATHER_CACHE_MAX_ENTRIES):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # cell -> (fetched_at, data)
+        self._refreshing = set()
+        self._loading = {}  # cell -> _Load of the miss being fetched
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def get(self, cell):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cell)
+            if entry:
+                fetched_at, data = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self._entries.move_to_end(cell)
+                    self.hits += 1
+                    return data
+                if age < self.ttl + self.max_stale:
+                    self._entries.move_to_end(cell)
+                    self.stale += 1
+                    if cell not in self._refreshing:
+                        self._refreshing.add(cell)
+                        threading.Thread(target=self._refresh, args=(cell,), daemon=True).start()
+                    return data
+            self.misses += 1
+            load = self._loading.get(cell)
+            leader = load is None
+            if leader:
+                load = self._loading[cell] = _Load()
+            else:
+                self.coalesced += 1
+        if not leader:
+            load.done.wait()
+            return load.data
+        try:
+            load.data = self.loader(*cell)
+            if not load.data.get("error"):
+                self.put(cell, load.data)
+            return load.data
+        except Exception as e:
+            load.data = {"error": str(e), "current": None, "daily": None}
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(cell, None)
+            load.done.set()
+
+    def get_fresh(self, cell):
+        """Cached data for cell if within TTL, else None (no loading, no background refresh)."""
+        with self._lock:
+            entry = self._entries.get(cell)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(cell)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, cell, data):
+        with self._lock:
+            self._entries[cell] = (time.monotonic(), data)
+            self._entries.move_to_end(cell)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _refresh(self, cell):
+        try:
+            data = self.loader(*cell)
+            if data.get("error"):
+                # Keep serving the stale copy; the next request past TTL retries
+                with self._lock:
+                    self.refresh_errors += 1
+            else:
+                self.put(cell, data)
+        finally:
+            with self._lock:
+                self._refreshing.discard(cell)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "resolution": WEATHER_CACHE_RESOLUTION,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "refreshing": len(self._refreshing),
+                "loading": len(self._loading),
+                "coalesced": self.coalesced,
+                "refresh_errors": self.refresh_errors,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.stale) / lookups, 4) if lookups else 0.0,
+            }
+
+
 def fetch_weather(lat=None, lon=None):
+    """Forecast for the grid cell containing (lat, lon); served from the shared cell cache."""
     lat = float(lat or os.environ.get("WEATHER_LAT", DEFAULT_LAT))
     lon = float(lon or os.environ.get("WEATHER_LON", DEFAULT_LON))
+    # Callers annotate the result (e.g. condition_label), so never hand out the cached dict itself
+    return copy.deepcopy(_weather_cache.get(geo_cell(lat, lon)))
+
+
+def fetch_current_weather(lat=None, lon=None):
+    """Only the `current` block of fetch_weather (None when the forecast failed), without copying the forecast."""
+    lat = float(lat or os.environ.get("WEATHER_LAT", DEFAULT_LAT))
+    lon = float(lon or os.environ.get("WEATHER_LON", DEFAULT_LON))
+    return copy.deepcopy(_weather_cache.get(geo_cell(lat, lon)).get("current"))
+
+
+def fetch_weather_batch(cells):
+    """
+    Forecasts for many grid cells at once: {cell: data}. Fresh cache entries are reused and the
+    rest are fetched with multi-coordinate Open-Meteo requests of OPEN_METEO_BATCH_SIZE cells.
+    """
+    out = {}
+    missing = []
+    for cell in dict.fromkeys(geo_cell(lat, lon) for lat, lon in cells):
+        data = _weather_cache.get_fresh(cell)
+        if data is None:
+            missing.append(cell)
+        else:
+            out[cell] = data
+    for i in range(0, len(missing), OPEN_METEO_BATCH_SIZE):
+        chunk = missing[i:i + OPEN_METEO_BATCH_SIZE]
+        for cell, data in zip(chunk, _fetch_weather_many(chunk)):
+            if not data.get("error"):
+                _weather_cache.put(cell, data)
+            out[cell] = data
+    return copy.deepcopy(out)
+
+
+def get_weather_cache_stats():
+    return _weather_cache.stats()
+
+
+def _fetch_weather_many(cells):
+    """One upstream request for several cells; returns parsed forecasts in the same order."""
+    url = _get_url(",".join(str(lat) for lat, _ in cells), ",".join(str(lon) for _, lon in cells))
+    try:
+        data = get_json(url, timeout=30)
+    except (requests.RequestException, ValueError) as e:
+        return [{"error": str(e), "current": None, "daily": None} for _ in cells]
+    # A single coordinate comes back as an object, several as a list in request order
+    results = data if isinstance(data, list) else [data]
+    if len(results) != len(cells):
+        return [{"error": "Unexpected batch response size", "current": None, "daily": None} for _ in cells]
+    return [_parse_forecast(r, lat, lon) for r, (lat, lon) in zip(results, cells)]
+
+
+def _fetch_weather_uncached(lat, lon):
     url = _get_url(lat, lon)
     try:
-        with urllib.request.urlopen(url, timeout=10) as resp:
-            data = json.loads(resp.read().decode())
-    except (urllib.error.URLError, json.JSONDecodeError, OSError) as e:
+        data = get_json(url, timeout=10)
+    except (requests.RequestException, ValueError) as e:
         return {"error": str(e), "current": None, "daily": None}
+    return _parse_forecast(data, lat, lon)
+
 
+def _parse_forecast(data, lat, lon):
     current = data.get("current") or {}
     daily = data.get("daily") or {}
     weather_code = current.get("weather_code")
@@ -61,12 +265,15 @@ def fetch_weather(lat=None, lon=None):
             "condition": _wmo_code_to_label(weather_code),
         },
         "daily": {
-            "time": daily.get("time", [])[:3],
-            "temperature_2m_max": daily.get("temperature_2m_max", [])[:3],
-            "temperature_2m_min": daily.get("temperature_2m_min", [])[:3],
-            "precipitation_sum": daily.get("precipitation_sum", [])[:3],
-            "weather_code": daily.get("weather_code", [])[:3],
+            key: daily.get(key, [])[:WEATHER_FORECAST_DAYS]
+            for key in (
+                "time", "temperature_2m_max", "temperature_2m_min", "precipitation_sum", "weather_code",
+                "wind_speed_10m_max", "relative_humidity_2m_max",
+            )
         },
         "lat": lat,
         "lon": lon,
     }
+
+
+_weather_cache = WeatherCache(_fetch_weather_uncached)
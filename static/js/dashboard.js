@@ -193,68 +193,40 @@
     if (loading) el.innerHTML = '<p class="dashboard-loading">' + msg + '</p>';
   }
 
-  function loadDashboard() {
-    var weatherEl = document.getElementById('dashboard-weather');
-    var mandiEl = document.getElementById('dashboard-mandi');
-    var schemesEl = document.getElementById('dashboard-schemes');
-    var advisoryEl = document.getElementById('dashboard-advisory');
-    var soilEl = document.getElementById('dashboard-soil');
-    var satelliteEl = document.getElementById('dashboard-satellite');
-
-    if (weatherEl) {
-      setLoading(weatherEl, true);
-      get('/api/weather').then(function (data) {
-        renderWeather(data, weatherEl);
-      }).catch(function (err) {
-        try { sessionStorage.removeItem('weatherAlertShown'); } catch (e) {}
-        if (weatherEl) weatherEl.innerHTML = '<p class="dashboard-error">' + (window.i18n ? window.i18n.t('messages.error', 'common') : 'Error') + ': ' + err.message + '</p>';
-      });
-    }
-
-    if (mandiEl) {
-      setLoading(mandiEl, true);
-      get('/api/mandi?limit=10').then(function (data) {
-        renderMandi(data, mandiEl);
-      }).catch(function (err) {
-        if (mandiEl) mandiEl.innerHTML = '<p class="dashboard-error">' + (window.i18n ? window.i18n.t('messages.error', 'common') : 'Error') + ': ' + err.message + '</p>';
-      });
-    }
-
-    if (schemesEl) {
-      setLoading(schemesEl, true);
-      get('/api/schemes').then(function (data) {
-        renderSchemes(data, schemesEl);
-      }).catch(function (err) {
-        if (schemesEl) schemesEl.innerHTML = '<p class="dashboard-error">' + (window.i18n ? window.i18n.t('messages.error', 'common') : 'Error') + ': ' + err.message + '</p>';
-      });
-    }
-
-    if (advisoryEl) {
-      setLoading(advisoryEl, true);
-      get('/api/advisory').then(function (data) {
-        renderAdvisory(data, advisoryEl);
-      }).catch(function (err) {
-        if (advisoryEl) advisoryEl.innerHTML = '<p class="dashboard-error">' + (window.i18n ? window.i18n.t('messages.error', 'common') : 'Error') + ': ' + err.message + '</p>';
-      });
-    }
-
-    if (soilEl) {
-      setLoading(soilEl, true);
-      get('/api/soil').then(function (data) {
-        renderSoil(data, soilEl);
-      }).catch(function (err) {
-        if (soilEl) soilEl.innerHTML = '<p class="dashboard-error">' + (window.i18n ? window.i18n.t('messages.error', 'common') : 'Error') + ': ' + err.message + '</p>';
-      });
-    }
+  function renderError(el, message) {
+    if (el) el.innerHTML = '<p class="dashboard-error">' + (window.i18n ? window.i18n.t('messages.error', 'common') : 'Error') + ': ' + message + '</p>';
+  }
 
-    if (satelliteEl) {
-      setLoading(satelliteEl, true);
-      get('/api/satellite').then(function (data) {
-        renderSatellite(data, satelliteEl);
-      }).catch(function (err) {
-        if (satelliteEl) satelliteEl.innerHTML = '<p class="dashboard-error">' + (window.i18n ? window.i18n.t('messages.error', 'common') : 'Error') + ': ' + err.message + '</p>';
-      });
-    }
+  /* One round-trip for all cards: /api/dashboard returns every section plus per-section errors */
+  function loadDashboard() {
+    var sections = [
+      { key: 'weather', el: document.getElementById('dashboard-weather'), render: renderWeather },
+      { key: 'mandi', el: document.getElementById('dashboard-mandi'), render: renderMandi },
+      { key: 'schemes', el: document.getElementById('dashboard-schemes'), render: renderSchemes },
+      { key: 'advisory', el: document.getElementById('dashboard-advisory'), render: renderAdvisory },
+      { key: 'soil', el: document.getElementById('dashboard-soil'), render: renderSoil },
+      { key: 'satellite', el: document.getElementById('dashboard-satellite'), render: renderSatellite }
+    ];
+    for (var i = 0; i < sections.length; i++) setLoading(sections[i].el, true);
+
+    get('/api/dashboard?mandi_limit=10').then(function (data) {
+      var errors = (data && data.errors) || {};
+      for (var i = 0; i < sections.length; i++) {
+        var s = sections[i];
+        if (!s.el) continue;
+        if (errors[s.key] || !data[s.key]) {
+          if (s.key === 'weather') {
+            try { sessionStorage.removeItem('weatherAlertShown'); } catch (e) {}
+          }
+          renderError(s.el, errors[s.key] || 'unavailable');
+          continue;
+        }
+        s.render(data[s.key], s.el);
+      }
+    }).catch(function (err) {
+      try { sessionStorage.removeItem('weatherAlertShown'); } catch (e) {}
+      for (var i = 0; i < sections.length; i++) renderError(sections[i].el, err.message);
+    });
   }
 
   if (typeof document !== 'undefined') {
@@ -10,6 +10,9 @@ class VoiceAssistant {
         this.isListening = false;
         this.messages = [];
         this.conversationId = null;
+        this.historyConversationId = null;
+        this.historyBefore = null;  // id of the oldest loaded message while older ones exist
+        this.loadingHistory = false;
 
         // UI Elements
         this.container = null;
@@ -20,6 +23,8 @@ class VoiceAssistant {
         this.micBtn = null;
         this.textInput = null;
         this.sendBtn = null;
+        this.photoBtn = null;
+        this.photoInput = null;
 
         this.init();
     }
@@ -52,6 +57,8 @@ class VoiceAssistant {
       </div>
       <div class="voice-messages"></div>
       <div class="voice-input-area">
+        <input type="file" class="voice-photo-input" accept="image/*" capture="environment" hidden />
+        <button class="voice-photo-btn" title="Send a crop photo">📷</button>
         <input type="text" class="voice-text-input" placeholder="Type your message..." />
         <button class="voice-send-btn" title="Send">➤</button>
       </div>
@@ -69,6 +76,8 @@ class VoiceAssistant {
         this.micBtn = this.overlay.querySelector('.voice-mic-btn');
         this.textInput = this.overlay.querySelector('.voice-text-input');
         this.sendBtn = this.overlay.querySelector('.voice-send-btn');
+        this.photoBtn = this.overlay.querySelector('.voice-photo-btn');
+        this.photoInput = this.overlay.querySelector('.voice-photo-input');
     }
 
     attachEvents() {
@@ -89,6 +98,19 @@ class VoiceAssistant {
         this.textInput.addEventListener('keypress', (e) => {
             if (e.key === 'Enter') this.sendTextMessage();
         });
+
+        // Older history on scroll to top
+        this.messagesContainer.addEventListener('scroll', () => {
+            if (this.messagesContainer.scrollTop < 40) this.loadOlderHistory();
+        });
+
+        // Photo upload
+        this.photoBtn.addEventListener('click', () => this.photoInput.click());
+        this.photoInput.addEventListener('change', () => {
+            const file = this.photoInput.files && this.photoInput.files[0];
+            this.photoInput.value = '';
+            if (file) this.sendPhoto(file, this.textInput.value.trim());
+        });
     }
 
     sendTextMessage() {
@@ -133,11 +155,42 @@ class VoiceAssistant {
             if (data.history && Array.isArray(data.history)) {
                 data.history.forEach(m => this.appendMessage(m.text, m.is_user));
             }
+            this.historyConversationId = data.conversation_id;
+            this.historyBefore = data.next_before;
         } catch (e) {
             console.error("Failed to load history", e);
         }
     }
 
+    /**
+     * Scrolled to the top: fetch the previous page (keyset pagination on message id) and prepend it,
+     * keeping the visible messages in place.
+     */
+    async loadOlderHistory() {
+        if (!this.historyBefore || this.loadingHistory) return;
+        this.loadingHistory = true;
+        try {
+            const params = new URLSearchParams({ before: this.historyBefore });
+            if (this.historyConversationId) params.set('conversation_id', this.historyConversationId);
+            const res = await fetch(`/api/voice/history?${params}`);
+            const data = await res.json();
+            const oldHeight = this.messagesContainer.scrollHeight;
+            const first = this.messagesContainer.firstChild;
+            (data.history || []).forEach(m => {
+                const msg = document.createElement('div');
+                msg.className = `voice-msg ${m.is_user ? 'user' : 'bot'}`;
+                msg.textContent = m.text;
+                this.messagesContainer.insertBefore(msg, first);
+            });
+            this.messagesContainer.scrollTop += this.messagesContainer.scrollHeight - oldHeight;
+            this.historyBefore = data.next_before;
+        } catch (e) {
+            console.error("Failed to load older history", e);
+        } finally {
+            this.loadingHistory = false;
+        }
+    }
+
     greet() {
         const greeting = window.i18n
             ? window.i18n.t('greeting', 'chatbot', { name: (window.currentUser?.name || 'Farmer') })
@@ -207,38 +260,167 @@ class VoiceAssistant {
         this.appendMessage(text, true);
         this.setStatus("🤔 Thinking...");
 
+        const payload = {
+            message: text,
+            conversation_id: this.conversationId
+        };
+
         try {
-            const payload = {
-                message: text,
-                conversation_id: this.conversationId
-            };
+            let reply = null;
+            if (window.ReadableStream && window.TextDecoder) {
+                reply = await this.streamReply(payload);
+            }
+            if (reply === null) {
+                reply = await this.fetchReply(payload);
+            }
+
+            if (!reply) {
+                this.appendMessage("Sorry, I couldn't understand. Please try again.", false);
+            }
+            this.setStatus("Type or tap mic to speak");
+
+        } catch (e) {
+            this.setStatus("Connection error. Try again.");
+            console.error(e);
+            this.appendMessage("Sorry, couldn't connect to server. Please try again.", false);
+        }
+    }
+
+    requestHeaders() {
+        return {
+            'Content-Type': 'application/json',
+            'Accept-Language': window.i18n ? window.i18n.getCurrentLanguage() : 'hi'
+        };
+    }
 
+    finishReply(reply, conversationId) {
+        this.speak(reply);
+        if (conversationId) this.conversationId = conversationId;
+        this.checkForFormUpdates(reply);
+    }
+
+    /** Non-streaming request; used when the browser cannot read response streams. */
+    async fetchReply(payload) {
+        const res = await fetch('/api/chatbot/message', {
+            method: 'POST',
+            headers: this.requestHeaders(),
+            body: JSON.stringify(payload)
+        });
+        const data = await res.json();
+        if (data.reply) {
+            this.appendMessage(data.reply, false);
+            this.finishReply(data.reply, data.conversation_id);
+        }
+        return data.reply || '';
+    }
+
+    /**
+     * Stream the reply from /api/chatbot/stream (Server-Sent Events over a POST response),
+     * rendering tokens into one bot bubble as they arrive. Returns null if streaming is unavailable.
+     */
+    async streamReply(payload) {
+        const res = await fetch('/api/chatbot/stream', {
+            method: 'POST',
+            headers: { ...this.requestHeaders(), 'Accept': 'text/event-stream' },
+            body: JSON.stringify(payload)
+        });
+        if (!res.ok || !res.body) return null;
+
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let bubble = null;
+        let reply = '';
+        let conversationId = null;
+
+        const render = () => {
+            if (!bubble) {
+                this.appendMessage(reply, false);
+                bubble = this.messagesContainer.lastElementChild;
+            }
+            bubble.textContent = reply;
+            this.messages[this.messages.length - 1].text = reply;
+            this.messagesContainer.scrollTop = this.messagesContainer.scrollHeight;
+        };
+
+        const handle = (event, data) => {
+            if (event === 'meta') {
+                conversationId = data.conversation_id;
+            } else if (event === 'token') {
+                reply += data.text;
+                render();
+            } else if (event === 'fallback') {
+                reply = data.text;
+                render();
+            } else if (event === 'done') {
+                reply = data.reply;
+                conversationId = data.conversation_id || conversationId;
+            }
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+                let event = 'message';
+                let data = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (data) handle(event, JSON.parse(data));
+            }
+        }
+
+        if (reply) this.finishReply(reply, conversationId);
+        return reply;
+    }
+
+    /**
+     * Upload a crop photo as multipart/form-data (streamed by the browser, spooled to disk by the
+     * server) and poll the diagnosis job until the reply is ready.
+     */
+    async sendPhoto(file, text) {
+        this.textInput.value = '';
+        this.appendMessage(text ? `📷 ${text}` : '📷 Photo', true);
+        this.setStatus("🔍 Analyzing photo...");
+
+        const form = new FormData();
+        form.append('image', file, file.name || 'photo.jpg');
+        form.append('message', text || '');
+        if (this.conversationId) form.append('conversation_id', this.conversationId);
+
+        try {
             const res = await fetch('/api/chatbot/message', {
                 method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Accept-Language': window.i18n ? window.i18n.getCurrentLanguage() : 'hi'
-                },
-                body: JSON.stringify(payload)
+                headers: { 'Accept-Language': window.i18n ? window.i18n.getCurrentLanguage() : 'hi' },
+                body: form
             });
+            let data = await res.json();
+            if (!res.ok) throw new Error(data.error || `HTTP ${res.status}`);
+            if (data.conversation_id) this.conversationId = data.conversation_id;
+
+            const pollUrl = data.poll_url || `/api/chatbot/jobs/${data.job_id}`;
+            for (let i = 0; data.status !== 'done' && data.status !== 'failed' && i < 120; i++) {
+                await new Promise(resolve => setTimeout(resolve, 1500));
+                data = await (await fetch(pollUrl)).json();
+            }
 
-            const data = await res.json();
-
-            if (data.reply) {
+            if (data.status === 'done' && data.reply) {
                 this.appendMessage(data.reply, false);
                 this.speak(data.reply);
-
-                if (data.conversation_id) this.conversationId = data.conversation_id;
-                this.checkForFormUpdates(data.reply);
             } else {
-                this.appendMessage("Sorry, I couldn't understand. Please try again.", false);
+                this.appendMessage("Sorry, I couldn't analyze the photo. Please try again.", false);
             }
             this.setStatus("Type or tap mic to speak");
-
         } catch (e) {
-            this.setStatus("Connection error. Try again.");
             console.error(e);
-            this.appendMessage("Sorry, couldn't connect to server. Please try again.", false);
+            this.setStatus("Upload failed. Try again.");
+            this.appendMessage(`Sorry, the photo could not be sent (${e.message}).`, false);
         }
     }
 